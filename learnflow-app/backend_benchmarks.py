@@ -0,0 +1,172 @@
+"""
+Microbenchmarks for LearnFlow hot-path request/response handling
+
+Measures the per-request cost of decoding the request body and encoding the
+response for the hot endpoint models (/chat, /execute, /track, /query):
+
+- stdlib: json.loads + model validation, jsonable_encoder + json.dumps
+  (FastAPI's default path)
+- fast:   pydantic-core JSON parsing + validation, compiled model serializer
+  (FastJSONRoute)
+
+and the end-to-end in-process request cost of a plain APIRoute versus
+FastJSONRoute for the same endpoint.
+
+Also compares triage's compiled keyword router with per-keyword substring
+scans as the routing table grows, and measures intent classifier throughput
+one query at a time versus batched.
+
+Run with: python backend_benchmarks.py
+"""
+
+import asyncio
+import importlib
+import json
+import os
+import sys
+import time
+
+import httpx
+import pydantic_core
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+
+SERVICES_DIR = os.path.join(os.path.dirname(__file__), "services")
+
+
+def load_service(name):
+    """Import a service's app.main without leaving its `app` package in sys.modules"""
+    path = os.path.join(SERVICES_DIR, name)
+    sys.path.insert(0, path)
+    try:
+        return importlib.import_module("app.main")
+    finally:
+        sys.path.remove(path)
+        for module in [m for m in sys.modules if m == "app" or m.startswith("app.")]:
+            del sys.modules[module]
+
+
+def per_call_us(fn, seconds=0.5):
+    """Average microseconds per call over roughly `seconds` of work"""
+    fn()
+    calls, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for _ in range(200):
+            fn()
+        calls += 200
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def codec_cases():
+    sys.path.insert(0, os.path.join(SERVICES_DIR, "api-gateway", "app"))
+    import main as gateway
+    progress = load_service("progress-agent")
+    triage = load_service("triage-agent")
+
+    return [
+        ("/chat", gateway.ChatRequest,
+         {"messages": [{"role": "user", "content": "How do for loops work in Python?"}], "user_id": "a1b2c3"},
+         gateway.ChatResponse(response="A for loop repeats a block for each item. " * 12, agent_used="openrouter")),
+        ("/execute", gateway.CodeExecuteRequest,
+         {"code": "for i in range(3):\n    print(i)\n", "user_id": "a1b2c3"},
+         gateway.CodeExecuteResponse(output="0\n1\n2\n", error=None, execution_time_ms=41)),
+        ("/track", progress.ProgressUpdateRequest,
+         {"user_id": "a1b2c3", "module": "Basics", "topic": "loops", "activity_type": "quiz", "score": 0.8},
+         progress.ProgressResponse(user_id="a1b2c3", module="Basics", topic="loops", mastery_score=0.62,
+                                   exercise_completion=0.5, quiz_score=0.8, code_quality=0.7,
+                                   consistency_score=0.4, last_updated="2026-01-15 14:30:00")),
+        ("/query", triage.QueryRequest,
+         {"query": "explain list comprehensions", "user_id": "a1b2c3"},
+         triage.RoutingResponse(agent="concepts-agent", message="Routing to concepts-agent",
+                                params={"original_query": "explain list comprehensions", "user_id": "a1b2c3"})),
+    ], gateway.FastJSONRoute, triage
+
+
+def bench_codecs(cases):
+    print(f"{'endpoint':<10} {'stdlib us':>10} {'fast us':>10} {'speedup':>8}")
+    for endpoint, request_model, payload, response in cases:
+        body = json.dumps(payload).encode()
+
+        def stdlib():
+            request_model.model_validate(json.loads(body))
+            json.dumps(jsonable_encoder(response)).encode()
+
+        def fast():
+            request_model.model_validate(pydantic_core.from_json(body))
+            response.__pydantic_serializer__.to_json(response, by_alias=True)
+
+        slow_us, fast_us = per_call_us(stdlib), per_call_us(fast)
+        print(f"{endpoint:<10} {slow_us:>10.1f} {fast_us:>10.1f} {slow_us / fast_us:>7.1f}x")
+
+
+def bench_routes(cases, route_class, requests=3000):
+    endpoint, request_model, payload, response = cases[0]
+    response_model = type(response)
+
+    def build(cls):
+        app = FastAPI()
+        app.router.route_class = cls
+
+        @app.post("/echo", response_model=response_model)
+        async def echo(data: request_model):
+            return response
+        return app
+
+    async def run(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for _ in range(100):
+                await client.post("/echo", json=payload)
+            start = time.perf_counter()
+            for _ in range(requests):
+                await client.post("/echo", json=payload)
+            return (time.perf_counter() - start) / requests * 1e6
+
+    plain = asyncio.run(run(build(APIRoute)))
+    fast = asyncio.run(run(build(route_class)))
+    print(f"\n{endpoint} in-process request: APIRoute {plain:.0f} us, FastJSONRoute {fast:.0f} us "
+          f"({(plain - fast) / plain:.0%} less)")
+
+
+def bench_triage_router(triage, sizes=(23, 200, 1000)):
+    query = "why does my for loop print the same number twice when i run it"
+    print(f"\n{'phrases':>8} {'scan us':>10} {'compiled us':>12}")
+    for size in sizes:
+        agents = [f"agent-{i}" for i in range(4)]
+        table = {"default_agent": agents[0], "agents": [
+            {"agent": agent, "phrases": {f"phrase {agent} {n}": 1.0 for n in range(i, size, len(agents))}}
+            for i, agent in enumerate(agents)
+        ]}
+        router = triage.KeywordRouter(table)
+        keyword_lists = [list(entry["phrases"]) for entry in table["agents"]]
+
+        def scan():
+            query_lower = query.lower()
+            return [any(keyword in query_lower for keyword in keywords) for keywords in keyword_lists]
+
+        print(f"{size:>8} {per_call_us(scan):>10.1f} {per_call_us(lambda: router.route(query)):>12.1f}")
+
+
+def bench_intent_classifier(triage, batch_size=1000):
+    classifier = triage.intent_classifier
+    if classifier is None:
+        print("\nintent classifier: no model artifact")
+        return
+    training = os.path.join(SERVICES_DIR, "triage-agent", "training", "intent_queries.jsonl")
+    with open(training) as f:
+        queries = [json.loads(line)["query"] for line in f if line.strip()]
+    batch = (queries * (batch_size // len(queries) + 1))[:batch_size]
+
+    single_us = per_call_us(lambda: classifier.classify([queries[0]]))
+    batch_us = per_call_us(lambda: classifier.classify(batch), seconds=1.0)
+    print(f"\nintent classifier: {1e6 / single_us:,.0f} queries/s one at a time, "
+          f"{batch_size * 1e6 / batch_us:,.0f} queries/s in batches of {batch_size}")
+
+
+if __name__ == "__main__":
+    cases, route_class, triage = codec_cases()
+    bench_codecs(cases)
+    bench_routes(cases, route_class)
+    bench_triage_router(triage)
+    bench_intent_classifier(triage)
@@ -14,12 +14,16 @@ import asyncio
 from fastapi.testclient import TestClient
 import sys
 import os
+import json
+import time
+import uuid
 
 # Add the services/api-gateway/app to the path so we can import main
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'services', 'api-gateway', 'app'))
 
 try:
     from main import app  # Import the main FastAPI app
+    import main as gateway
 
     # Create test client
     client = TestClient(app)
@@ -90,6 +94,28 @@ try:
         assert "user" in data
         assert data["user"]["email"] == login_data["email"]
 
+    def test_auth_login_unknown_user():
+        """Test login and profile lookups for users that don't exist"""
+        response = client.post("/auth/login", json={"email": f"nobody-{uuid.uuid4().hex[:8]}@example.com", "password": "pw"})
+        assert response.status_code == 401
+
+        token = gateway.create_token("deleted-user", f"deleted-{uuid.uuid4().hex[:8]}@example.com", "student")
+        assert client.get("/auth/me", headers={"Authorization": f"Bearer {token}"}).status_code == 404
+
+    def test_bounded_store_miss_without_spill(tmp_path):
+        """Test that a miss raises KeyError when nothing has been spilled"""
+        store = gateway.BoundedStore("miss-test", 1024 * 1024, str(tmp_path))
+        with pytest.raises(KeyError):
+            store["missing"]
+        assert store.get("missing") is None and "missing" not in store
+
+    def test_progress_agent_shares_the_bounded_store():
+        """Test that progress-agent's stores are the gateway's shared BoundedStore"""
+        services_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services")
+        gateway.load_agent_app(os.path.join(services_dir, "progress-agent"), "learnflow_progress_store")
+        progress = sys.modules["learnflow_progress_store.main"]
+        assert type(progress.student_progress_db) is gateway.BoundedStore
+
     def test_chat_endpoint():
         """Test AI chat functionality"""
         # This would require a valid token in real implementation
@@ -155,6 +181,1377 @@ try:
             assert "explanation" in data
             assert data["topic"] == explain_data["topic"]
 
+    def auth_headers(role: str = "student") -> dict:
+        """Register a fresh user and return bearer auth headers"""
+        user_data = {
+            "name": "Test User",
+            "email": f"user-{uuid.uuid4().hex[:8]}@example.com",
+            "password": "securepassword123",
+            "role": role
+        }
+        response = client.post("/auth/register", json=user_data)
+        assert response.status_code == 200
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+
+    def test_execute_stream_ndjson():
+        """Test streamed code execution as newline-delimited JSON"""
+        code_data = {"code": "print('first')\nimport sys\nprint('oops', file=sys.stderr)\nprint('second')"}
+
+        response = client.post("/execute/stream", json=code_data, headers=auth_headers())
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+
+        events = [json.loads(line) for line in response.text.splitlines() if line]
+        trailer = events[-1]
+        assert trailer["event"] == "exit"
+        assert trailer["exit_code"] == 0
+        assert trailer["timed_out"] is False
+        assert "execution_time_ms" in trailer
+
+        stdout = "".join(e["data"] for e in events if e["event"] == "output" and e["stream"] == "stdout")
+        stderr = "".join(e["data"] for e in events if e["event"] == "output" and e["stream"] == "stderr")
+        assert stdout == "first\nsecond\n"
+        assert stderr == "oops\n"
+
+    def test_execute_stream_pauses_sandbox_for_slow_client(monkeypatch, tmp_path):
+        """Test that unread output stops the sandbox instead of piling up in the gateway"""
+        monkeypatch.setattr(gateway, "STREAM_QUEUE_MAX_CHUNKS", 1)
+        marker = tmp_path / "finished"
+        code = f"import sys\nsys.stdout.write('x' * 2_000_000)\nsys.stdout.flush()\nopen({str(marker)!r}, 'w').close()"
+
+        async def scenario():
+            events = gateway.stream_execution(code, limit=1)
+            first = await events.__anext__()
+            # Not reading past the deadline: the sandbox stays blocked and is then killed
+            await asyncio.sleep(1.2)
+            paused = not marker.exists()
+            rest = [event async for event in events]
+            return first, paused, rest
+
+        first, paused, rest = asyncio.run(asyncio.wait_for(scenario(), 10))
+        assert first["event"] == "output"
+        assert paused
+        assert rest[-1]["event"] == "exit" and rest[-1]["timed_out"] is True
+        assert not marker.exists()
+
+    def test_execute_stream_time_queued_counts_against_deadline(monkeypatch):
+        """Test that the sandbox limit is sized after waiting for a scheduler slot"""
+        import contextlib
+
+        limits = []
+
+        @contextlib.asynccontextmanager
+        async def slow_slot(tenant, lane):
+            await asyncio.sleep(0.5)
+            yield
+
+        async def fake_execution(code, limit):
+            limits.append(limit)
+            yield {"event": "exit", "exit_code": 0, "timed_out": False, "execution_time_ms": 0}
+
+        monkeypatch.setattr(gateway.work_scheduler, "slot", slow_slot)
+        monkeypatch.setattr(gateway, "stream_execution", fake_execution)
+        headers = {**auth_headers(), "X-Request-Timeout-Ms": "2000"}
+        response = client.post("/execute/stream", json={"code": "print(1)"}, headers=headers)
+        assert response.status_code == 200
+        assert limits and limits[0] <= 1.5
+
+    def test_execute_stream_sse():
+        """Test streamed code execution as Server-Sent Events"""
+        headers = {**auth_headers(), "Accept": "text/event-stream"}
+        response = client.post("/execute/stream", json={"code": "raise SystemExit(3)"}, headers=headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+
+        blocks = [b for b in response.text.split("\n\n") if b]
+        assert blocks[-1].startswith("event: exit")
+        trailer = json.loads(blocks[-1].split("data: ", 1)[1])
+        assert trailer["exit_code"] == 3
+
+    def test_circuit_breaker_trips_and_recovers():
+        """Test circuit breaker state transitions"""
+        breaker = gateway.CircuitBreaker("test", window_size=4, min_calls=4, open_seconds=0.0, half_open_probes=1)
+
+        for failed in (False, True, True, False):
+            assert breaker.allow_request()
+            breaker.record(0.01, failed=failed)
+        assert breaker.state == breaker.OPEN
+
+        # Cool-down of zero lets a single probe through, which closes the circuit
+        assert breaker.allow_request()
+        assert breaker.state == breaker.HALF_OPEN
+        assert not breaker.allow_request()
+        breaker.record(0.01, failed=False)
+        assert breaker.state == breaker.CLOSED
+
+    def test_circuit_breaker_trips_on_slow_calls():
+        """Test that slow successful calls also open the circuit"""
+        breaker = gateway.CircuitBreaker("test", window_size=2, min_calls=2, slow_call_seconds=1.0)
+        breaker.record(5.0, failed=False)
+        breaker.record(5.0, failed=False)
+        assert breaker.state == breaker.OPEN
+        assert not breaker.allow_request()
+        assert breaker.snapshot()["rejected_calls"] == 1
+
+    def test_chat_short_circuits_when_open(monkeypatch):
+        """Test that an open circuit answers immediately with the simulated tutor"""
+        breaker = gateway.CircuitBreaker("test", open_seconds=60.0)
+        breaker._trip()
+        monkeypatch.setattr(gateway, "openrouter_breaker", breaker)
+        monkeypatch.setattr(gateway, "OPENROUTER_API_KEY", "test-key")
+
+        chat_data = {"messages": [{"role": "user", "content": "How do for loops work?"}]}
+        response = client.post("/chat", json=chat_data, headers=auth_headers())
+        assert response.status_code == 200
+        assert response.json()["agent_used"] == "simulated-circuit-open"
+
+        metrics = client.get("/metrics").json()
+        assert metrics["openrouter_circuit"]["state"] == "open"
+
+    def test_deadline_header_bounds_sandbox():
+        """Test that the caller's deadline shortens the sandbox time limit"""
+        headers = {**auth_headers(), "X-Request-Timeout-Ms": "1000"}
+        code_data = {"code": "import time\nprint('start')\ntime.sleep(3)\nprint('never')"}
+
+        response = client.post("/execute/stream", json=code_data, headers=headers)
+        assert response.status_code == 200
+
+        events = [json.loads(line) for line in response.text.splitlines() if line]
+        trailer = events[-1]
+        assert trailer["timed_out"] is True
+        assert trailer["execution_time_ms"] < 3000
+        assert "never" not in "".join(e.get("data", "") for e in events)
+
+    def test_expired_deadline_is_rejected():
+        """Test that work is refused once the caller's budget is spent"""
+        response = client.post("/explain", json={"topic": "loops"}, headers={**auth_headers(), "X-Request-Timeout-Ms": "0"})
+        assert response.status_code == 504
+
+    def test_dapr_services_return_504_past_the_deadline(monkeypatch):
+        """Test that course-agent and user-progress answer 504 when Dapr outlasts the caller's deadline"""
+        import importlib.util
+        import httpx
+
+        services_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services")
+        modules = {}
+        for service in ["course-agent", "user-progress"]:
+            spec = importlib.util.spec_from_file_location(f"learnflow_{service.replace('-', '_')}", os.path.join(services_dir, service, "main.py"))
+            modules[service] = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(modules[service])
+        deadlines = sys.modules["shared.deadlines"]
+
+        async def slow_sidecar(request):
+            await asyncio.sleep(float(request.headers[deadlines.DEADLINE_HEADER]) / 1000 + 0.5)
+            return httpx.Response(200, json={})
+
+        monkeypatch.setattr(deadlines, "dapr_client", httpx.AsyncClient(transport=httpx.MockTransport(slow_sidecar)))
+        headers = {deadlines.DEADLINE_HEADER: "200"}
+        course = TestClient(modules["course-agent"].app)
+        response = course.post("/generate-lesson", json={"course_id": "c1", "user_id": "u1"}, headers=headers)
+        assert response.status_code == 504
+        assert course.get("/state/k1", headers=headers).status_code == 504
+
+        progress = TestClient(modules["user-progress"].app)
+        event = {"lesson_id": "l1", "user_id": "u1", "course_id": "c1"}
+        assert progress.post("/events/lesson-generated", json=event, headers=headers).status_code == 504
+
+    def test_timeout_for_uses_remaining_budget():
+        """Test downstream timeout sizing against the request deadline"""
+        token = gateway.request_deadline.set(time.monotonic() + 2.0)
+        try:
+            assert gateway.timeout_for(30.0) <= 2.0
+            assert gateway.timeout_for(0.5) == 0.5
+            assert int(gateway.deadline_headers()["X-Request-Timeout-Ms"]) <= 2000
+        finally:
+            gateway.request_deadline.reset(token)
+
+        token = gateway.request_deadline.set(time.monotonic() - 1.0)
+        try:
+            with pytest.raises(gateway.DeadlineExceeded):
+                gateway.timeout_for(30.0)
+        finally:
+            gateway.request_deadline.reset(token)
+
+    def test_progress_write_behind_coalesces_and_batches():
+        """Test coalescing, batched flushing and the bounded backlog"""
+        sent = []
+
+        async def send(batch):
+            sent.append(batch)
+
+        sync = gateway.ProgressWriteBehind(send, flush_size=2, max_pending=3)
+        update = {"user_id": "u1", "module": "Basics", "topic": "variables", "activity_type": "quiz", "score": 0.4}
+        sync.enqueue(update)
+        sync.enqueue({**update, "score": 0.9})
+        sync.enqueue({**update, "topic": "operators"})
+        assert len(sync.pending) == 2
+        assert sync.stats["coalesced"] == 1
+
+        sync.enqueue({**update, "user_id": "u2"})
+        sync.enqueue({**update, "user_id": "u3"})
+        assert len(sync.pending) == 3
+        assert sync.stats["dropped"] == 1
+
+        asyncio.run(sync.flush())
+        assert [len(batch) for batch in sent] == [2, 1]
+        assert not sync.pending
+
+    def test_progress_write_behind_requeues_failed_batch():
+        """Test that a batch is retried and kept after repeated failures"""
+        attempts = []
+
+        async def send(batch):
+            attempts.append(batch)
+            raise RuntimeError("progress-agent unavailable")
+
+        sync = gateway.ProgressWriteBehind(send, max_retries=2, retry_backoff=0)
+        sync.enqueue({"user_id": "u1", "module": "Basics", "topic": "variables", "activity_type": "quiz", "score": 0.5})
+        asyncio.run(sync.flush())
+
+        assert len(attempts) == 3
+        assert len(sync.pending) == 1
+        assert sync.stats["failed_batches"] == 1
+
+    def test_progress_write_behind_stop_keeps_in_flight_batch():
+        """Test that stopping mid-send still delivers the batch being sent"""
+        sent = []
+        sending = asyncio.Event()
+
+        async def send(batch):
+            sending.set()
+            await asyncio.sleep(0.05)
+            sent.append(batch)
+
+        async def scenario():
+            sync = gateway.ProgressWriteBehind(send, flush_size=1, flush_seconds=60)
+            sync.start()
+            sync.enqueue({"user_id": "u1", "module": "Basics", "topic": "variables", "activity_type": "quiz", "score": 0.5})
+            await sending.wait()
+            await sync.stop()
+            return sync
+
+        sync = asyncio.run(scenario())
+        assert len(sent) == 1 and sent[0][0]["user_id"] == "u1"
+        assert not sync.pending and sync.task is None
+
+    def test_update_progress_enqueues_sync(monkeypatch):
+        """Test that gateway progress writes are queued for progress-agent"""
+        async def send(batch):
+            pass
+
+        sync = gateway.ProgressWriteBehind(send)
+        monkeypatch.setattr(gateway, "progress_sync", sync)
+        monkeypatch.setattr(gateway, "PROGRESS_SYNC_ENABLED", True)
+
+        headers = auth_headers()
+        progress = {"user_id": "sync_user", "module": "Basics", "topic": "variables", "score": 0.8, "activity_type": "lesson"}
+        for _ in range(3):
+            response = client.post("/progress", json=progress, headers=headers)
+            assert response.status_code == 200
+
+        assert len(sync.pending) == 1
+        queued = next(iter(sync.pending.values()))
+        assert queued["activity_type"] == "concept_learning"
+        assert queued["occurrences"] == 3
+
+    def test_semantic_cache_matches_paraphrases():
+        """Test that paraphrased questions reuse a cached answer"""
+        cache = gateway.SemanticCache(gateway.HashedNgramVectorizer(dim=1024), capacity=8)
+        cache.insert("How do for loops work?", "loop answer")
+        cache.insert("What is a dictionary?", "dict answer")
+
+        hit = cache.lookup("explain for loops in python")
+        assert hit is not None and hit[0] == "loop answer"
+        assert cache.lookup("what are dictionaries")[0] == "dict answer"
+        assert cache.lookup("how do functions work") is None
+
+    def test_semantic_cache_matches_by_similarity():
+        """Test that a paraphrase with different content words hits through the vectors"""
+        cache = gateway.SemanticCache(gateway.HashedNgramVectorizer(dim=1024), capacity=8,
+                                      threshold=gateway.SEMANTIC_CACHE_THRESHOLD)
+        cache.insert("how do loops work", "loop answer")
+        for asked in ("how do for loops work", "for loop explanation"):
+            answer, similarity = cache.lookup(asked)
+            assert answer == "loop answer" and similarity < 1.0, asked
+        # Same shape of difference, but "depth" changes the question
+        cache.insert("what is recursion", "recursion answer")
+        assert cache.lookup("recursion depth") is None
+        # A variant word alone isn't enough when the vectors are too far apart
+        assert cache.lookup("while loops") is None
+
+    def test_semantic_cache_rejects_different_questions():
+        """Test that similar-looking questions with different meanings miss"""
+        pairs = [
+            ("how do I convert a string to int", "how do I convert an int to string"),
+            ("append vs extend", "append vs insert"),
+            ("difference between list and tuple", "difference between list and set"),
+            ("what is a dictionary", "how do I loop over a dictionary"),
+        ]
+        for cached, asked in pairs:
+            cache = gateway.SemanticCache(gateway.HashedNgramVectorizer(dim=1024), capacity=8,
+                                          threshold=gateway.SEMANTIC_CACHE_THRESHOLD)
+            cache.insert(cached, "cached answer")
+            assert cache.lookup(asked) is None, asked
+            assert cache.lookup(cached)[0] == "cached answer"
+
+    def test_semantic_cache_lsh_and_eviction():
+        """Test the LSH lookup path and ring-buffer eviction"""
+        cache = gateway.SemanticCache(gateway.HashedNgramVectorizer(dim=256), capacity=2, brute_force_limit=0)
+        cache.insert("what is recursion", "recursion answer")
+        assert cache.lookup("how does recursion work")[0] == "recursion answer"
+
+        cache.insert("what is a tuple", "tuple answer")
+        cache.insert("what is a set", "set answer")
+        assert cache.lookup("what is recursion") is None
+        assert cache.snapshot()["evictions"] == 1
+
+    def test_chat_uses_semantic_cache(monkeypatch):
+        """Test that standalone chat questions hit the semantic cache"""
+        calls = []
+
+        async def fake_openrouter(messages, max_tokens, temperature=None, model=None):
+            calls.append(messages)
+            return "Loops repeat a block of code."
+
+        monkeypatch.setattr(gateway, "OPENROUTER_API_KEY", "test-key")
+        monkeypatch.setattr(gateway, "call_openrouter", fake_openrouter)
+        monkeypatch.setattr(gateway, "semantic_cache", gateway.SemanticCache(gateway.HashedNgramVectorizer()))
+
+        headers = auth_headers()
+        first = client.post("/chat", json={"messages": [{"role": "user", "content": "How do loops work?"}]}, headers=headers)
+        second = client.post("/chat", json={"messages": [{"role": "user", "content": "explain loops"}]}, headers=headers)
+        assert first.json()["agent_used"] == "openrouter"
+        assert second.json() == {"response": "Loops repeat a block of code.", "agent_used": "semantic-cache"}
+
+        # Follow-ups carry conversation context and always go upstream
+        follow_up = {"messages": [
+            {"role": "user", "content": "How do loops work?"},
+            {"role": "assistant", "content": "Loops repeat a block of code."},
+            {"role": "user", "content": "explain for loop"},
+        ]}
+        assert client.post("/chat", json=follow_up, headers=headers).json()["agent_used"] == "openrouter"
+        assert len(calls) == 2
+
+    def test_model_router_classifies_requests():
+        """Test the complexity heuristic and per-route policy"""
+        tiers = {
+            "fast": {"model": "small", "max_tokens": 300, "cost_per_1k_tokens": 0.001},
+            "code": {"model": "coder", "max_tokens": 1000, "cost_per_1k_tokens": 0.002},
+            "deep": {"model": "large", "max_tokens": 1500, "cost_per_1k_tokens": 0.01},
+        }
+        policy = {"chat": {
+            "short_factual": {"tier": "fast"},
+            "code_debugging": {"tier": "code"},
+            "long_explanation": {"tier": "deep", "max_tokens": 2000},
+        }}
+        router = gateway.ModelRouter(tiers, policy)
+
+        assert router.classify("What is a tuple?") == "short_factual"
+        assert router.classify("Why do I get NameError: name 'x' is not defined") == "code_debugging"
+        assert router.classify("def add(a, b):\n    return a - b\nthis returns the wrong output") == "code_debugging"
+        assert router.classify("Can you explain the difference between lists and tuples?") == "long_explanation"
+
+        decision = router.route("chat", "Walk me through generators step by step")
+        assert decision["tier"] == "deep"
+        assert decision["model"] == "large"
+        assert decision["max_tokens"] == 2000
+        assert router.route("chat", "What is a set?")["model"] == "small"
+
+    def test_chat_routes_by_complexity(monkeypatch):
+        """Test that chat picks the tier model and records per-tier stats"""
+        calls = []
+
+        async def fake_openrouter(messages, max_tokens, temperature=None, model=None):
+            calls.append((model, max_tokens))
+            return "answer"
+
+        tiers = {tier: {**config, "model": f"{tier}-model"} for tier, config in gateway.MODEL_TIERS.items()}
+        router = gateway.ModelRouter(tiers, gateway.MODEL_ROUTING_POLICY)
+        monkeypatch.setattr(gateway, "OPENROUTER_API_KEY", "test-key")
+        monkeypatch.setattr(gateway, "SEMANTIC_CACHE_ENABLED", False)
+        monkeypatch.setattr(gateway, "call_openrouter", fake_openrouter)
+        monkeypatch.setattr(gateway, "model_router", router)
+
+        headers = auth_headers()
+        client.post("/chat", json={"messages": [{"role": "user", "content": "What is a tuple?"}]}, headers=headers)
+        client.post("/chat", json={"messages": [{"role": "user", "content": "Fix this: IndexError: list index out of range"}]}, headers=headers)
+
+        assert [model for model, _ in calls] == ["fast-model", "code-model"]
+        stats = router.snapshot()
+        assert stats["tiers"]["fast"]["requests"] == 1
+        assert stats["tiers"]["code"]["estimated_tokens"] > 0
+        assert stats["categories"]["chat.code_debugging"] == 1
+
+    def test_adaptive_limiter_queues_and_hands_over_slots():
+        """Test that calls over the limit wait for a released slot"""
+        async def scenario():
+            limiter = gateway.AdaptiveConcurrencyLimiter(initial_limit=1)
+            assert await limiter.acquire(timeout=1.0) == 0.0
+
+            waiting = asyncio.create_task(limiter.acquire(timeout=1.0))
+            await asyncio.sleep(0.01)
+            assert limiter.snapshot()["queue_length"] == 1
+
+            limiter.release(0.1, overloaded=False, succeeded=False)
+            queued = await waiting
+            assert queued > 0
+            assert limiter.in_flight == 1
+
+            with pytest.raises(gateway.ConcurrencyLimitExceeded):
+                await limiter.acquire(timeout=0.01)
+            return limiter.snapshot()
+
+        snapshot = asyncio.run(scenario())
+        assert snapshot["rejected"] == 1
+        assert snapshot["queue_length"] == 0
+
+    def test_adaptive_limiter_aimd():
+        """Test additive increase on fast successes and multiplicative decrease on overload"""
+        limiter = gateway.AdaptiveConcurrencyLimiter(initial_limit=4, latency_target=1.0, decrease_cooldown=0.0)
+        limiter.in_flight = 4
+        limiter.release(0.2, overloaded=False, succeeded=True)
+        assert limiter.limit == pytest.approx(4.25)
+
+        limiter.in_flight = 1
+        limiter.release(0.2, overloaded=True, succeeded=False)
+        assert limiter.limit == pytest.approx(2.125)
+
+        # Slow successes hold the limit steady
+        limiter.in_flight = 2
+        limiter.release(5.0, overloaded=False, succeeded=True)
+        assert limiter.limit == pytest.approx(2.125)
+
+    def test_openrouter_overload_signals(monkeypatch):
+        """Test that only 429s, 5xx and upstream timeouts shrink the LLM concurrency limit"""
+        import httpx
+
+        outcomes = iter([
+            httpx.Response(400, json={}),
+            httpx.Response(200, json={"choices": []}),
+            httpx.ConnectError("refused"),
+            httpx.Response(429, json={}),
+            httpx.Response(503, json={}),
+            httpx.ReadTimeout("slow"),
+        ])
+
+        def handler(request):
+            outcome = next(outcomes)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        real_client = httpx.AsyncClient
+        monkeypatch.setattr(gateway.httpx, "AsyncClient", lambda: real_client(transport=httpx.MockTransport(handler)))
+        limiter = gateway.AdaptiveConcurrencyLimiter(initial_limit=64, decrease_cooldown=0.0)
+        monkeypatch.setattr(gateway, "llm_limiter", limiter)
+        monkeypatch.setattr(gateway, "openrouter_breaker", gateway.CircuitBreaker("openrouter-test", min_calls=100))
+
+        decreases = []
+        for _ in range(6):
+            with pytest.raises(Exception):
+                asyncio.run(gateway.call_openrouter([{"role": "user", "content": "hi"}], max_tokens=10))
+            decreases.append(limiter.stats["decreases"])
+        assert decreases == [0, 0, 0, 1, 2, 3]
+
+    def test_cancelled_openrouter_call_is_not_a_failure(monkeypatch):
+        """Test that a cancelled call gives back its probe and limiter slot without tripping the breaker"""
+        import httpx
+
+        async def handler(request):
+            await asyncio.sleep(10)
+
+        real_client = httpx.AsyncClient
+        monkeypatch.setattr(gateway.httpx, "AsyncClient", lambda: real_client(transport=httpx.MockTransport(handler)))
+        limiter = gateway.AdaptiveConcurrencyLimiter(initial_limit=4)
+        breaker = gateway.CircuitBreaker("openrouter-test", open_seconds=0.0, half_open_probes=1)
+        breaker._trip()
+        monkeypatch.setattr(gateway, "llm_limiter", limiter)
+        monkeypatch.setattr(gateway, "openrouter_breaker", breaker)
+
+        async def scenario():
+            call = asyncio.create_task(gateway.call_openrouter([{"role": "user", "content": "hi"}], max_tokens=10))
+            await asyncio.sleep(0.05)
+            assert breaker.state == breaker.HALF_OPEN and breaker.probes_in_flight == 1
+            call.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await call
+
+        asyncio.run(scenario())
+        assert breaker.state == breaker.HALF_OPEN and breaker.probes_in_flight == 0
+        assert breaker.allow_request()
+        assert limiter.in_flight == 0 and limiter.stats["decreases"] == 0
+
+    def test_fair_scheduler_interleaves_tenants_and_prioritises_interactive():
+        """Test weighted fair ordering across tenants and lane priority"""
+        async def scenario():
+            scheduler = gateway.FairScheduler(slots=1, max_queued_per_tenant=3)
+            order = []
+            gate = asyncio.Event()
+
+            async def work(tenant, lane, label):
+                async with scheduler.slot(tenant, lane):
+                    order.append(label)
+                    await gate.wait()
+
+            blocker = asyncio.create_task(work("class-a", "interactive", "a0"))
+            await asyncio.sleep(0)
+            tasks = [asyncio.create_task(work("class-a", "interactive", f"a{i}")) for i in range(1, 4)]
+            await asyncio.sleep(0)
+            tasks.append(asyncio.create_task(work("teacher-x", "batch", "batch")))
+            tasks.append(asyncio.create_task(work("class-b", "interactive", "b1")))
+            await asyncio.sleep(0)
+
+            with pytest.raises(gateway.QueueFullError):
+                async with scheduler.slot("class-a"):
+                    pass
+            assert scheduler.snapshot()["tenants"]["class-a"]["queued"] == 3
+
+            gate.set()
+            await asyncio.gather(blocker, *tasks)
+            return order
+
+        order = asyncio.run(scenario())
+        assert order.index("b1") < order.index("a2")
+        assert order[-1] == "batch"
+
+    def test_class_id_is_carried_in_token():
+        """Test that the scheduling tenant comes from the class in the JWT"""
+        teacher = {"Authorization": f"Bearer {gateway.create_token('teacher-7', 'teacher7@example.com', 'teacher', 'class-7a')}"}
+        invite = client.post("/auth/invites", headers=teacher).json()["invite"]
+        user_data = {
+            "name": "Class Student",
+            "email": f"user-{uuid.uuid4().hex[:8]}@example.com",
+            "password": "securepassword123",
+            "invite": invite
+        }
+        token = client.post("/auth/register", json=user_data).json()["token"]
+        payload = gateway.jwt.decode(token, gateway.SECRET_KEY, algorithms=[gateway.ALGORITHM])
+        assert gateway.tenant_for(payload) == "class-7a"
+
+    def test_class_membership_needs_an_invite():
+        """Test that students can't pick their own class at registration"""
+        user_data = {"name": "Gate Crasher", "email": f"user-{uuid.uuid4().hex[:8]}@example.com", "password": "pw"}
+        assert client.post("/auth/register", json={**user_data, "class_id": "class-7a"}).status_code == 403
+        assert client.post("/auth/register", json={**user_data, "invite": auth_headers()["Authorization"][7:]}).status_code == 403
+        assert client.post("/auth/register", json={**user_data, "invite": "not-a-token"}).status_code == 403
+        assert client.post("/auth/invites", headers=auth_headers()).status_code == 403
+        assert user_data["email"] not in gateway.users_db
+
+    def test_fair_scheduler_rejects_non_positive_weights():
+        """Test that tenant weights are validated when the scheduler is built"""
+        for weight in (0, -1, "2", None):
+            with pytest.raises(ValueError):
+                gateway.FairScheduler(weights={"class-7a": weight})
+        assert gateway.FairScheduler(weights={"class-7a": 0.5}).weights == {"class-7a": 0.5}
+
+    def test_auth_me_etag():
+        """Test conditional GET of the current user"""
+        headers = auth_headers()
+        first = client.get("/auth/me", headers=headers)
+        assert first.status_code == 200
+        etag = first.headers["etag"]
+
+        cached = client.get("/auth/me", headers={**headers, "If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        assert cached.headers["etag"] == etag
+
+    def test_progress_etag_changes_on_update():
+        """Test that progress ETags are validated and bumped by writes"""
+        headers = auth_headers()
+        user_id = f"etag-{uuid.uuid4().hex[:8]}"
+        etag = client.get(f"/progress/{user_id}", headers=headers).headers["etag"]
+
+        assert client.get(f"/progress/{user_id}", headers={**headers, "If-None-Match": f'W/{etag}, "other"'}).status_code == 304
+
+        update = client.post("/progress", json={"user_id": user_id, "module": "Basics", "topic": "variables", "score": 1.0}, headers=headers)
+        assert update.headers["etag"] != etag
+
+        refreshed = client.get(f"/progress/{user_id}", headers={**headers, "If-None-Match": etag})
+        assert refreshed.status_code == 200
+        assert refreshed.headers["etag"] == update.headers["etag"]
+        assert refreshed.json()["modules"]["Basics"]["variables"]["mastery_score"] == 30.0
+        assert "version" not in refreshed.json() and "version" not in update.json()
+
+    def test_etags_change_across_boots(monkeypatch):
+        """Test that a validator from an earlier boot never matches"""
+        headers = auth_headers()
+        user_id = f"epoch-{uuid.uuid4().hex[:8]}"
+        etag = client.get(f"/progress/{user_id}", headers=headers).headers["etag"]
+        monkeypatch.setattr(gateway, "ETAG_EPOCH", "rebooted")
+        response = client.get(f"/progress/{user_id}", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 200 and response.headers["etag"] != etag
+
+    def test_progress_idempotency_key_replays():
+        """Test that a retried progress update is replayed, not applied twice"""
+        headers = {**auth_headers(), "Idempotency-Key": uuid.uuid4().hex}
+        user_id = f"idem-{uuid.uuid4().hex[:8]}"
+        body = {"user_id": user_id, "module": "Basics", "topic": "variables", "score": 1.0}
+
+        first = client.post("/progress", json=body, headers=headers)
+        retry = client.post("/progress", json=body, headers=headers)
+        assert retry.headers["idempotent-replayed"] == "true"
+        assert retry.json() == first.json()
+        assert retry.json()["modules"]["Basics"]["variables"]["mastery_score"] == 30.0
+
+        conflict = client.post("/progress", json={**body, "score": 0.5}, headers=headers)
+        assert conflict.status_code == 422
+
+    def test_idempotency_store_joins_in_flight_duplicate():
+        """Test that concurrent duplicates wait for the original and run once"""
+        store = gateway.IdempotencyStore(ttl_seconds=60, max_entries=10)
+        calls = []
+
+        async def handler():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"ok": len(calls)}
+
+        async def scenario():
+            return await asyncio.gather(store.run("k", "fp", handler), store.run("k", "fp", handler))
+
+        (first, replayed_first), (second, replayed_second) = asyncio.run(scenario())
+        assert len(calls) == 1
+        assert first == second == {"ok": 1}
+        assert (replayed_first, replayed_second) == (False, True)
+
+        async def failing():
+            raise RuntimeError("boom")
+
+        async def retry_after_failure():
+            with pytest.raises(RuntimeError):
+                await store.run("f", "fp", failing)
+            return await store.run("f", "fp", handler)
+
+        assert asyncio.run(retry_after_failure()) == ({"ok": 2}, False)
+
+    def test_session_execution_keeps_state():
+        """Test that session /execute calls share a kernel until it is reset"""
+        headers = auth_headers()
+        session_id = uuid.uuid4().hex
+
+        first = client.post("/execute", json={"code": "total = 40", "session_id": session_id}, headers=headers)
+        assert first.status_code == 200
+        assert first.json()["error"] is None
+
+        second = client.post("/execute", json={"code": "print(total + 2)", "session_id": session_id}, headers=headers)
+        assert second.json()["output"] == "42\n"
+
+        assert client.delete(f"/execute/sessions/{session_id}", headers=headers).json()["reset"] is True
+        after_reset = client.post("/execute", json={"code": "print(total)", "session_id": session_id}, headers=headers)
+        assert "NameError" in after_reset.json()["error"]
+        client.delete(f"/execute/sessions/{session_id}", headers=headers)
+
+    def test_kernel_manager_evicts_least_recently_used():
+        """Test the per-node kernel cap and timeout handling"""
+        manager = gateway.KernelManager(max_kernels=2, idle_seconds=60)
+
+        async def scenario():
+            await manager.execute("a", "x = 1", 5)
+            await manager.execute("b", "x = 2", 5)
+            await manager.execute("a", "x += 1", 5)
+            await manager.execute("c", "x = 3", 5)
+            assert list(manager.kernels) == ["a", "c"]
+
+            timed_out = await manager.execute("a", "while True: pass", 0.5)
+            assert "timed out" in timed_out.error
+            assert "a" not in manager.kernels
+            await manager.stop()
+
+        asyncio.run(scenario())
+        assert manager.stats["evicted"] == 1
+        assert manager.stats["timed_out"] == 1
+        assert not manager.kernels
+
+    def test_kernel_limits_its_own_memory():
+        """Test that kernels apply their memory cap and concurrent first calls share one kernel"""
+        manager = gateway.KernelManager(max_kernels=2, idle_seconds=60, memory_limit_bytes=512 * 1024 * 1024)
+
+        async def scenario():
+            first, second = await asyncio.gather(manager.execute("m", "x = 1", 5), manager.execute("m", "y = 2", 5))
+            assert first.error is None and second.error is None
+            huge = await manager.execute("m", "block = bytearray(1024 * 1024 * 1024)", 5)
+            await manager.stop()
+            return huge
+
+        huge = asyncio.run(scenario())
+        assert manager.stats["started"] == 1
+        assert "MemoryError" in huge.error
+
+    def test_bulk_roster_import():
+        """Test teacher roster import from CSV and NDJSON"""
+        teacher = {"Authorization": f"Bearer {gateway.create_token('teacher-1', 'teacher@example.com', 'teacher', 'class-9b')}"}
+        first, second = (f"roster-{uuid.uuid4().hex[:8]}@example.com" for _ in range(2))
+        roster = f"name,email,password\nAda,{first},pw-one\nBad Row,not-an-email,pw\nAda Again,{first},pw-two\n"
+
+        response = client.post("/auth/register/bulk", content=roster,
+                               headers={**teacher, "Content-Type": "text/csv"})
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line.get("status") for line in lines[:-1]] == ["error", "created", "error"]
+        assert lines[-1] == {"event": "summary", "rows": 3, "created": 1, "failed": 2}
+
+        token = lines[1]["token"]
+        assert client.get("/auth/me", headers={"Authorization": f"Bearer {token}"}).json()["email"] == first
+        assert gateway.users_db[first]["class_id"] == "class-9b"
+
+        ndjson = json.dumps({"name": "Grace", "email": second, "password": "pw", "class_id": "class-9b"}) + "\n"
+        response = client.post("/auth/register/bulk", content=ndjson,
+                               headers={**teacher, "Content-Type": "application/x-ndjson"})
+        assert json.loads(response.text.splitlines()[0])["status"] == "created"
+        assert gateway.users_db[second]["class_id"] == "class-9b"
+
+        student = client.post("/auth/register/bulk", content=ndjson, headers=auth_headers())
+        assert student.status_code == 403
+
+    def test_bulk_roster_import_stays_in_own_class():
+        """Test that roster rows can't join another class or become teachers"""
+        teacher = {"Authorization": f"Bearer {gateway.create_token('teacher-2', 'teacher2@example.com', 'teacher', 'class-9b')}",
+                   "Content-Type": "text/csv"}
+        first, second = (f"roster-{uuid.uuid4().hex[:8]}@example.com" for _ in range(2))
+
+        response = client.post("/auth/register/bulk?class_id=class-victim", content=f"name,email,password\nEve,{first},pw\n",
+                               headers=teacher)
+        assert response.status_code == 403
+        assert first not in gateway.users_db
+
+        roster = f"name,email,password,role,class_id\nEve,{first},pw,teacher,class-victim\nMallory,{second},pw,teacher,\n"
+        lines = [json.loads(line) for line in client.post("/auth/register/bulk", content=roster, headers=teacher).text.splitlines()]
+        assert lines[0]["status"] == "error" and first not in gateway.users_db
+        assert gateway.users_db[second]["role"] == "student"
+        assert gateway.users_db[second]["class_id"] == "class-9b"
+
+        classless = client.post("/auth/register/bulk", content=roster, headers={**auth_headers("teacher"), "Content-Type": "text/csv"})
+        assert classless.status_code == 422
+
+    def test_dashboard_aggregates_parts():
+        """Test the one-call dashboard payload"""
+        user_data = {
+            "name": "Dash Student",
+            "email": f"user-{uuid.uuid4().hex[:8]}@example.com",
+            "password": "securepassword123"
+        }
+        register = client.post("/auth/register", json=user_data).json()
+        headers = {"Authorization": f"Bearer {register['token']}"}
+        user_id = register["user"]["id"]
+
+        for topic in ("variables", "variables", "variables", "variables"):
+            client.post("/progress", json={"user_id": user_id, "module": "Basics", "topic": topic, "score": 1.0}, headers=headers)
+
+        dashboard = client.get("/dashboard", headers=headers).json()
+        assert dashboard["partial"] is False
+        assert dashboard["user"]["name"] == "Dash Student"
+        assert dashboard["progress"]["modules"]["Basics"] > 0
+        assert dashboard["next_topic"] == {"module": "Basics", "topic": "operators", "mastery_score": 0}
+        assert len(dashboard["recent_activity"]) == 4
+
+    def test_dashboard_returns_partial_results():
+        """Test that a slow part is dropped instead of delaying the dashboard"""
+        async def slow():
+            await asyncio.sleep(1)
+            return "late"
+
+        async def fast():
+            return "ok"
+
+        results, errors = asyncio.run(gateway.gather_parts({"fast": fast(), "slow": slow()}, timeout=0.05))
+        assert results == {"fast": "ok", "slow": None}
+        assert errors == {"slow": "timeout"}
+
+    def test_recent_activity_keeps_most_recent_users(monkeypatch):
+        """Test that activity of the least recently active users is dropped past the cap"""
+        monkeypatch.setattr(gateway, "recent_activity", gateway.OrderedDict())
+        monkeypatch.setattr(gateway, "RECENT_ACTIVITY_MAX_USERS", 2)
+        for user_id in ("a", "b", "a", "c"):
+            gateway.record_activity(user_id, {"activity_type": "progress_update"})
+
+        assert list(gateway.recent_activity) == ["a", "c"]
+        assert len(gateway.recent_activity["a"]) == 2
+
+    def test_bounded_store_spills_and_reloads(tmp_path):
+        """Test LRU eviction to disk and transparent reload"""
+        store = gateway.BoundedStore("test", memory_budget_bytes=600, spill_dir=str(tmp_path))
+        for i in range(10):
+            store[f"user-{i}"] = {"id": i, "notes": "x" * 100}
+
+        stats = store.snapshot()
+        assert stats["entries_on_disk"] > 0
+        assert stats["memory_bytes"] <= 600
+        assert len(store) == 10
+        assert "user-0" in store and "missing" not in store
+
+        store["user-0"]["notes"] = "updated in place"
+        store["user-9"]  # touch others so user-0 is evicted again
+        for i in range(5, 10):
+            store[f"user-{i}"]
+        assert store["user-0"] == {"id": 0, "notes": "updated in place"}
+        assert store.snapshot()["reloads"] >= 2
+        assert sorted(store) == sorted(f"user-{i}" for i in range(10))
+
+        del store["user-3"]
+        assert store.get("user-3") is None and len(store) == 9
+
+    def test_state_snapshot_round_trip(tmp_path):
+        """Test that users and progress survive a snapshot and restore"""
+        headers = auth_headers()
+        email = f"snap-{uuid.uuid4().hex[:8]}@example.com"
+        client.post("/auth/register", json={"name": "Snap", "email": email, "password": "pw"})
+        user_id = gateway.users_db[email]["id"]
+        client.post("/progress", json={"user_id": user_id, "module": "Basics", "topic": "loops", "score": 1.0}, headers=headers)
+        expected = dict(gateway.progress_db[user_id])
+
+        sections = {name: gateway.STATE_SECTIONS[name] for name in ("users", "progress")}
+        snapshotter = gateway.StateSnapshotter(str(tmp_path / "state.snap"), sections=sections)
+        asyncio.run(snapshotter.write())
+        assert snapshotter.stats["last_entries"] == len(gateway.users_db) + len(gateway.progress_db)
+
+        del gateway.users_db[email]
+        del gateway.progress_db[user_id]
+        assert snapshotter.restore() == snapshotter.stats["last_entries"]
+        assert gateway.users_db[email]["name"] == "Snap"
+        assert gateway.progress_db[user_id] == expected
+
+        (tmp_path / "state.snap").write_bytes(b"not a snapshot")
+        with pytest.raises(ValueError):
+            snapshotter.restore()
+
+    def test_state_snapshot_stays_off_the_event_loop(tmp_path):
+        """Test snapshot size and timing for 100k users and 100k progress documents"""
+        users = {f"user{i}@example.com": {"id": f"u{i}", "name": f"User {i}", "role": "student"} for i in range(100_000)}
+        progress = {f"u{i}": {"overall_mastery": i % 100, "current_module": "Basics",
+                              "modules": {"Basics": {"loops": {"mastery_score": i % 100}}}} for i in range(100_000)}
+        restored = {"users": {}, "progress": {}}
+        sections = {
+            name: (lambda store=store: iter(store.items()), lambda items, size, name=name: restored[name].update(items))
+            for name, store in (("users", users), ("progress", progress))
+        }
+        snapshotter = gateway.StateSnapshotter(str(tmp_path / "state.snap"), sections=sections)
+
+        async def scenario():
+            stalls = []
+
+            async def ticker():
+                while True:
+                    before = time.perf_counter()
+                    await asyncio.sleep(0.001)
+                    stalls.append(time.perf_counter() - before)
+
+            ticking = asyncio.create_task(ticker())
+            await asyncio.sleep(0.01)
+            await snapshotter.write()
+            ticking.cancel()
+            return max(stalls)
+
+        longest_stall = asyncio.run(scenario())
+        assert longest_stall < 0.25
+        assert snapshotter.stats["last_entries"] == 200_000
+        assert snapshotter.stats["last_bytes"] < 10 * 200_000
+
+        assert snapshotter.restore() == 200_000
+        assert restored["users"] == users and restored["progress"] == progress
+        assert snapshotter.stats["restore_ms"] < 3000
+
+    def test_fast_json_routes_keep_http_contract():
+        """Test the fast JSON route class against FastAPI's behaviour"""
+        headers = {**auth_headers(), "Idempotency-Key": uuid.uuid4().hex}
+        first = client.post("/execute", json={"code": "print('fast')"}, headers=headers)
+        assert first.headers["content-type"] == "application/json"
+        assert first.json()["output"] == "fast\n"
+        replay = client.post("/execute", json={"code": "print('fast')"}, headers=headers)
+        assert replay.headers["idempotent-replayed"] == "true"
+        assert replay.json() == first.json()
+
+        invalid = client.post("/execute", content=b'{"code": ', headers={**auth_headers(), "Content-Type": "application/json"})
+        assert invalid.status_code == 422
+        assert invalid.json()["detail"][0]["type"] == "json_invalid"
+
+        missing = client.post("/execute", json={}, headers=auth_headers())
+        assert missing.status_code == 422
+        assert missing.json()["detail"][0]["loc"] == ["body", "code"]
+
+        schema = client.get("/openapi.json").json()
+        assert "ChatRequest" in schema["components"]["schemas"]
+        execute = schema["paths"]["/execute"]["post"]
+        assert execute["responses"]["200"]["content"]["application/json"]["schema"]["$ref"].endswith("CodeExecuteResponse")
+
+    def test_explanation_prefetch_warms_next_topics():
+        """Test prediction, prefetch, budget cap and prefetch hit accounting"""
+        generated = []
+
+        async def fake_generate(topic, level):
+            generated.append(topic)
+            return f"All about {topic}"
+
+        cache = gateway.ExplanationCache(capacity=10)
+        prefetcher = gateway.ExplanationPrefetcher(cache, fake_generate, depth=2, budget_per_hour=2)
+        progress = gateway.ensure_progress(f"prefetch-{uuid.uuid4().hex[:8]}")
+        progress["modules"]["Basics"]["variables"]["mastery_score"] = 90
+
+        async def drain():
+            while not prefetcher.queue.empty():
+                await prefetcher.prefetch(*prefetcher.queue.get_nowait())
+
+        assert prefetcher.schedule("class-a", progress, "beginner") == 2
+        assert prefetcher.schedule("class-a", progress, "beginner") == 0  # already pending
+        asyncio.run(drain())
+        assert generated == ["operators", "if statements"]
+
+        assert cache.get("Operators", "beginner") == "All about operators"
+        assert cache.get("if_statements", "beginner") == "All about if statements"
+        assert prefetcher.snapshot()["prefetch_hit_rate"] == 1.0
+
+        prefetcher.schedule("class-a", progress, "advanced")
+        asyncio.run(drain())
+        assert prefetcher.stats["skipped_budget"] == 2
+
+    def test_explain_serves_cached_explanations(monkeypatch):
+        """Test that /explain reuses generated explanations"""
+        calls = []
+
+        async def fake_generate(topic, level):
+            calls.append(topic)
+            return "Loops repeat code."
+
+        monkeypatch.setattr(gateway, "OPENROUTER_API_KEY", "test-key")
+        monkeypatch.setattr(gateway, "EXPLAIN_PREFETCH_ENABLED", False)
+        monkeypatch.setattr(gateway, "generate_explanation", fake_generate)
+        monkeypatch.setattr(gateway, "explanation_cache", gateway.ExplanationCache())
+
+        for _ in range(2):
+            response = client.post("/explain", json={"topic": "loops", "level": "beginner"}, headers=auth_headers())
+            assert response.json()["explanation"] == "Loops repeat code."
+        assert calls == ["loops"]
+
+    def test_all_in_one_mounts_agents_in_process():
+        """Test mounting every agent into one app and calling it in-process"""
+        from fastapi import FastAPI
+
+        services_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services")
+        previous_app_module = sys.modules.get("app")
+        combined = FastAPI()
+        agents = gateway.mount_agents(combined, services_dir)
+        assert sys.modules.get("app") is previous_app_module
+        assert set(agents) == set(gateway.AGENT_MOUNTS)
+
+        agent_client = gateway.InProcessAgentClient(agents)
+        update = {"user_id": "aio-user", "module": "Basics", "topic": "loops", "activity_type": "quiz", "score": 0.8}
+
+        async def scenario():
+            routed = await agent_client.post("triage", "/query", {"query": "explain loops", "user_id": "aio-user"})
+            tracked = await agent_client.post("progress", "/track/batch", {"updates": [update]})
+            return routed, tracked
+
+        routed, tracked = asyncio.run(scenario())
+        assert routed["agent"] == "concepts-agent"
+
+        # Agent routes on the public port need a gateway token
+        with TestClient(combined) as combined_client:
+            assert combined_client.get("/agents/progress/progress/aio-user").status_code == 401
+            assert combined_client.post("/agents/triage/routing/reload").status_code == 401
+            assert combined_client.get("/agents/progress/progress/aio-user",
+                                       headers={"Authorization": "Bearer not-a-token"}).status_code == 401
+            progress = combined_client.get("/agents/progress/progress/aio-user", headers=auth_headers()).json()
+        assert progress["modules"]["Basics"]["loops"]["quiz_score"] == 0.8
+
+        # Agent shutdown handlers run with the host app's, through its lifespan
+        assert combined.router.on_startup == [] and combined.router.on_shutdown == []
+        triage = sys.modules["learnflow_agents.triage.main"]
+        closed = []
+        original_close = triage.dispatcher.close
+
+        async def close():
+            closed.append(True)
+            await original_close()
+
+        triage.dispatcher.close = close
+        with TestClient(combined):
+            pass
+        assert closed == [True]
+
+        class IncompleteClient(gateway.AgentClient):
+            pass
+
+        with pytest.raises(TypeError):
+            IncompleteClient()
+
+    def test_quiz_submit_updates_progress():
+        """Test grading a single quiz submission"""
+        register = client.post("/auth/register", json={
+            "name": "Quiz Student", "email": f"quiz-{uuid.uuid4().hex[:8]}@example.com", "password": "pw"
+        }).json()
+        headers = {"Authorization": f"Bearer {register['token']}"}
+
+        quiz = client.get("/quizzes/basics", headers=headers).json()
+        assert len(quiz["items"]) == 4 and "answer" not in quiz["items"][0]
+
+        result = client.post("/quizzes/basics/submit", json={"answers": [1, 1, 0, None]}, headers=headers).json()
+        assert (result["correct"], result["total"]) == (2, 4)
+        assert result["topics"] == {"Basics": {"variables": 1.0, "operators": 0.0}}
+        assert [item["correct"] for item in result["feedback"]] == [True, True, False, False]
+
+        progress = gateway.progress_db[register["user"]["id"]]
+        assert progress["modules"]["Basics"]["variables"]["mastery_score"] == 30.0
+        assert progress["quiz_scores"][-1]["correct"] == 2
+
+        short = client.post("/quizzes/basics/submit", json={"answers": [1]}, headers=headers)
+        assert short.status_code == 422
+        assert client.get("/quizzes/unknown", headers=headers).status_code == 404
+
+    def test_quiz_batch_grading_is_vectorized():
+        """Test class-wide grading in one pass"""
+        quiz = gateway.compiled_quizzes["control-flow"]
+        answers = quiz.answer_matrix([[1, 1, 1, 2], [0, 1, 1, 0], [None, None, None, None]])
+        correct, totals, topic_scores = quiz.grade(answers)
+        assert totals.tolist() == [4, 2, 0]
+        assert topic_scores.tolist() == [[1.0, 1.0], [0.5, 0.5], [0.0, 0.0]]
+
+        class_id = f"class-{uuid.uuid4().hex[:6]}"
+        teacher = {"Authorization": f"Bearer {gateway.create_token('teacher-2', 'teacher2@example.com', 'teacher', class_id)}"}
+        invite = client.post("/auth/invites", headers=teacher).json()["invite"]
+        students = [client.post("/auth/register", json={
+            "name": "Quiz Batch Student", "email": f"quiz-batch-{uuid.uuid4().hex[:8]}@example.com",
+            "password": "pw", "invite": invite,
+        }).json()["user"]["id"] for _ in range(3)]
+        response = client.post("/quizzes/control-flow/submit/batch", json={"submissions": [
+            {"user_id": students[0], "answers": [1, 1, 1, 2]},
+            {"user_id": students[1], "answers": [0, 1, 1, 0]},
+            {"user_id": students[2], "answers": [None, None, None, None]},
+        ]}, headers=teacher).json()
+        assert [s["correct"] for s in response["students"]] == [4, 2, 0]
+        assert response["question_stats"][0]["correct_rate"] == pytest.approx(1 / 3)
+        assert gateway.progress_db[students[0]]["modules"]["Control Flow"]["loops"]["mastery_score"] == 30.0
+
+        assert client.post("/quizzes/control-flow/submit/batch", json={"submissions": []}, headers=auth_headers()).status_code == 403
+
+        # Students must exist and be in the teacher's class
+        outsider = client.post("/auth/register", json={
+            "name": "Other Class", "email": f"quiz-other-{uuid.uuid4().hex[:8]}@example.com", "password": "pw"}).json()["user"]["id"]
+        for user_id, status in [("nonexistent-user", 422), (outsider, 403)]:
+            response = client.post("/quizzes/control-flow/submit/batch", json={"submissions": [
+                {"user_id": user_id, "answers": [1, 1, 1, 2]}]}, headers=teacher)
+            assert response.status_code == status
+        assert "nonexistent-user" not in gateway.progress_db
+
+    def test_quiz_rejects_out_of_range_answers():
+        """Test that answers outside a question's options are rejected"""
+        for answers in ([40000, 1, 1, 1], [7, 1, 1, 1], [-1, 1, 1, 1]):
+            response = client.post("/quizzes/basics/submit", json={"answers": answers}, headers=auth_headers())
+            assert response.status_code == 422
+
+    def test_curriculum_export_is_content_addressed(tmp_path):
+        """Test the static curriculum bundle export"""
+        import gzip
+        import hashlib
+        import export_curriculum
+
+        manifest = export_curriculum.export_curriculum(str(tmp_path))
+        assert {"modules", "exercises", "quizzes", "concepts-beginner", "concepts-advanced"} <= set(manifest["bundles"])
+
+        entry = manifest["bundles"]["modules"]
+        data = (tmp_path / entry["file"]).read_bytes()
+        assert hashlib.sha256(data).hexdigest() == entry["sha256"]
+        assert entry["file"] == f"modules.{entry['sha256'][:12]}.json"
+        assert gzip.decompress((tmp_path / entry["encodings"]["gzip"]["file"]).read_bytes()) == data
+        modules = json.loads(data)["modules"]
+        assert [m["name"] for m in modules] == gateway.MODULE_ORDER
+        assert modules[1]["prerequisites"] == ["Basics"]
+
+        quizzes = json.loads((tmp_path / manifest["bundles"]["quizzes"]["file"]).read_bytes())["quizzes"]
+        assert all("answer" not in item for quiz in quizzes for item in quiz["items"])
+
+        # Unchanged content exports to the same files and version
+        assert export_curriculum.export_curriculum(str(tmp_path)) == manifest
+
+    def test_triage_keyword_router_scores_every_agent():
+        """Test the compiled triage routing table"""
+        services_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services")
+        gateway.load_agent_app(os.path.join(services_dir, "triage-agent"), "learnflow_triage_test")
+        keyword_router = sys.modules["learnflow_triage_test.keyword_router"]
+
+        phrases = ["he", "she", "his", "hers", "not working", "work"]
+        automaton = keyword_router.PhraseAutomaton(phrases)
+        for text in ["ushers", "this is not working", "shhis", "nothing"]:
+            assert automaton.find(text) == {i for i, phrase in enumerate(phrases) if phrase in text}
+
+        router = keyword_router.KeywordRouter({
+            "default_agent": "concepts-agent",
+            "agents": [
+                {"agent": "concepts-agent", "phrases": {"explain": 1.0}},
+                {"agent": "debug-agent", "phrases": {"error": 1.0, "bug": 1.0}},
+            ],
+        })
+        assert router.route("Explain this ERROR")[:2] == ("concepts-agent", 0.5)
+        agent, confidence, confidences = router.route("explain this bug error")
+        assert (agent, confidence) == ("debug-agent", pytest.approx(2 / 3))
+        assert sum(confidences.values()) == pytest.approx(1.0)
+        assert router.route("hello") == ("concepts-agent", 0.0, {"concepts-agent": 0.0, "debug-agent": 0.0})
+
+    def test_triage_intent_classifier_batch_routing():
+        """Test the triage intent classifier and batch routing"""
+        services_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services")
+        triage_app = gateway.load_agent_app(os.path.join(services_dir, "triage-agent"), "learnflow_triage_batch")
+        classifier_module = sys.modules["learnflow_triage_batch.intent_classifier"]
+
+        model = classifier_module.IntentClassifier.train(
+            ["explain loops", "what is a list", "my code has an error", "fix this bug"],
+            ["concepts-agent", "concepts-agent", "debug-agent", "debug-agent"])
+        predictions = model.classify(["explain lists", "an error in my loops", "hello"])
+        assert [p and p[0] for p in predictions] == ["concepts-agent", "debug-agent", None]
+        # Stop words alone, or a weak best guess, leave routing to the keyword table
+        assert model.classify(["a", "is it", "the error"], min_confidence=0.0)[:2] == [None, None]
+        assert model.classify(["an error in my loops"], min_confidence=0.99) == [None]
+        assert sum(predictions[0][2].values()) == pytest.approx(1.0)
+
+        triage_client = TestClient(triage_app)
+        queries = [
+            {"query": "my test fails with an error", "user_id": "u1"},
+            {"query": "give me a practice quiz on loops", "user_id": "u2"},
+            {"query": "zzz", "user_id": "u3"},
+            {"query": "a", "user_id": "u4"},
+        ]
+        results = triage_client.post("/query/batch", json={"queries": queries}).json()["results"]
+        assert [r["agent"] for r in results] == ["debug-agent", "exercise-agent", "concepts-agent", "concepts-agent"]
+        assert results[2]["confidence"] == 0.0 and results[3]["confidence"] == 0.0
+        assert results[0]["params"] == {"original_query": "my test fails with an error", "user_id": "u1"}
+        assert triage_client.post("/query", json=queries[0]).json()["agent"] == "debug-agent"
+
+    def test_triage_routing_cache(tmp_path):
+        """Test the triage routing decision cache"""
+        services_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services")
+        triage_app = gateway.load_agent_app(os.path.join(services_dir, "triage-agent"), "learnflow_triage_cache")
+        triage = sys.modules["learnflow_triage_cache.main"]
+        triage_client = TestClient(triage_app)
+
+        first = triage_client.post("/query", json={"query": "zzz qqq", "user_id": "u1"}).json()
+        again = triage_client.post("/query", json={"query": "  ZZZ   qqq ", "user_id": "u2"}).json()
+        assert again["agent"] == first["agent"] and again["params"]["user_id"] == "u2"
+        cache = triage_client.get("/metrics").json()["routing_cache"]
+        assert (cache["hits"], cache["misses"], cache["entries"]) == (1, 1, 1)
+
+        # A changed routing table gets a new version, and cached decisions are dropped
+        table = {"default_agent": "concepts-agent", "agents": [{"agent": "debug-agent", "phrases": {"zzz": 1.0}}]}
+        (tmp_path / "table.json").write_text(json.dumps(table))
+        old_version = triage.routing_version()
+        triage.settings.ROUTING_TABLE_PATH, original_path = str(tmp_path / "table.json"), triage.settings.ROUTING_TABLE_PATH
+        triage.settings.INTENT_MODEL_PATH, original_model = "", triage.settings.INTENT_MODEL_PATH
+        try:
+            reloaded = triage_client.post("/routing/reload").json()
+            assert reloaded["version"] != old_version
+            assert triage_client.get("/metrics").json()["routing_cache"]["entries"] == 0
+            assert triage_client.post("/query", json={"query": "ZZZ qqq", "user_id": "u1"}).json()["agent"] == "debug-agent"
+        finally:
+            triage.settings.ROUTING_TABLE_PATH, triage.settings.INTENT_MODEL_PATH = original_path, original_model
+
+    def test_triage_dispatch_over_in_memory_broker():
+        """Test dispatching a routed query to its agent through pub/sub"""
+        import httpx
+
+        services_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services")
+        triage_app = gateway.load_agent_app(os.path.join(services_dir, "triage-agent"), "learnflow_triage_dispatch")
+        concepts_app = gateway.load_agent_app(os.path.join(services_dir, "concepts-agent"), "learnflow_concepts_dispatch")
+        triage = sys.modules["learnflow_triage_dispatch.main"]
+        dispatch = sys.modules["shared.dispatch"]
+
+        async def scenario():
+            broker = dispatch.InMemoryBroker()
+            dispatcher = dispatch.PubSubDispatcher(broker, "triage.replies.test", timeout=0.5)
+            broker.subscribe(dispatcher.reply_topic, dispatcher.handle_reply)
+            consumer = dispatch.AgentConsumer(broker, "concepts-agent", concepts_app)
+            consumer.subscribe()
+            triage.dispatcher = dispatcher
+
+            transport = httpx.ASGITransport(app=triage_app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://triage") as triage_client:
+                answered = await triage_client.post("/query/dispatch", json={
+                    "query": "explain list comprehensions", "user_id": "u1", "payload": {"level": "beginner"}})
+                # Nobody consumes debug-agent's topic, so the request times out
+                unanswered = await triage_client.post("/query/dispatch", json={
+                    "query": "my code has an error", "user_id": "u1"})
+                metrics = (await triage_client.get("/metrics")).json()
+            await consumer.close()
+            await broker.close()
+            return answered, unanswered, metrics
+
+        original = triage.dispatcher
+        try:
+            answered, unanswered, metrics = asyncio.run(scenario())
+        finally:
+            triage.dispatcher = original
+
+        body = answered.json()
+        assert answered.status_code == 200
+        assert body["routing"]["agent"] == "concepts-agent"
+        assert body["result"]["level"] == "beginner" and body["result"]["topic"] == "explain list comprehensions"
+        assert unanswered.status_code == 504
+        assert metrics["dispatch"]["timeouts"] == 1 and metrics["dispatch"]["pending"] == 0
+
+    def test_triage_dispatches_in_process_when_all_in_one(monkeypatch):
+        """Test that the all-in-one image dispatches to mounted agents without HTTP or Dapr"""
+        import httpx
+
+        monkeypatch.setenv("ALL_IN_ONE", "true")
+        services_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services")
+        triage_app = gateway.load_agent_app(os.path.join(services_dir, "triage-agent"), "learnflow_triage_local")
+        gateway.load_agent_app(os.path.join(services_dir, "concepts-agent"), "learnflow_concepts_local")
+        triage = sys.modules["learnflow_triage_local.main"]
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=triage_app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://triage") as triage_client:
+                response = await triage_client.post("/query/dispatch", json={
+                    "query": "explain list comprehensions", "user_id": "u1", "payload": {"level": "beginner"}})
+            await triage.dispatcher.close()
+            return response
+
+        response = asyncio.run(scenario())
+        assert response.status_code == 200
+        assert response.json()["result"]["topic"] == "explain list comprehensions"
+
+    def test_agents_serve_dispatched_requests_from_dapr():
+        """Test that each agent subscribes to its request topic and answers on the reply topic"""
+        services_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services")
+        for directory in ["concepts-agent", "code-review-agent", "debug-agent", "exercise-agent"]:
+            alias = f"learnflow_{directory.replace('-', '_')}_consumer"
+            agent_client = TestClient(gateway.load_agent_app(os.path.join(services_dir, directory), alias))
+            assert agent_client.get("/dapr/subscribe").json() == [
+                {"pubsubname": "pubsub", "topic": f"{directory}.requests", "route": "/dispatch/requests"}
+            ]
+
+        published = []
+
+        class RecordingBroker:
+            async def publish(self, topic, message):
+                published.append((topic, message))
+
+        debug = sys.modules["learnflow_debug_agent_consumer.main"]
+        debug.dispatch_consumer.broker = RecordingBroker()
+        request = {"correlation_id": "c-1", "reply_topic": "triage.replies.test", "path": "/debug",
+                   "body": {"code": "", "error_message": "NameError: name 'x' is not defined", "user_id": "u1"}}
+        delivered = TestClient(debug.app).post("/dispatch/requests", json={"data": request})
+        assert delivered.json() == {"status": "SUCCESS"}
+        topic, reply = published[0]
+        assert topic == "triage.replies.test" and reply["correlation_id"] == "c-1"
+        assert "error" not in reply and reply["result"]["hints"]
+
+    def test_dispatch_passes_the_request_deadline_on():
+        """Test that agent calls and dispatched requests carry the remaining deadline"""
+        import httpx
+        from fastapi import FastAPI, Request
+
+        dispatch = sys.modules["shared.dispatch"]
+        agent = FastAPI()
+
+        @agent.post("/echo")
+        async def echo(request: Request):
+            return {"deadline_ms": request.headers.get("X-Request-Timeout-Ms")}
+
+        published = []
+
+        class RecordingBroker:
+            async def publish(self, topic, message):
+                published.append((topic, message))
+
+        async def scenario():
+            dispatcher = dispatch.HTTPDispatcher({"echo-agent": "http://echo"}, timeout=30.0)
+            dispatcher.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=agent))
+            over_http = await dispatcher.dispatch("echo-agent", "/echo", {}, "c-1", timeout=2.0)
+            await dispatcher.close()
+
+            broker = RecordingBroker()
+            pubsub = dispatch.PubSubDispatcher(broker, "triage.replies.test", timeout=30.0)
+            with pytest.raises(dispatch.DispatchTimeout):
+                await pubsub.dispatch("echo-agent", "/echo", {}, "c-2", timeout=0.01)
+            envelope = published[0][1]
+
+            consumer = dispatch.AgentConsumer(broker, "echo-agent", agent)
+            await consumer.handle({**envelope, "deadline": time.time() + 2})
+            await consumer.handle({**envelope, "deadline": time.time() - 1})
+            await consumer.close()
+
+            gateway_client = gateway.InProcessAgentClient({"echo": agent})
+            token = gateway.request_deadline.set(time.monotonic() + 2)
+            try:
+                in_process = await gateway_client.post("echo", "/echo", {})
+            finally:
+                gateway.request_deadline.reset(token)
+            return over_http, envelope, in_process
+
+        over_http, envelope, in_process = asyncio.run(scenario())
+        assert 1000 < int(over_http["deadline_ms"]) <= 2000
+        assert envelope["deadline"] <= time.time()
+        (_, served), (_, expired) = published[1:]
+        assert 1000 < int(served["result"]["deadline_ms"]) <= 2000
+        assert "deadline" in expired["error"] and "result" not in expired
+        assert 1000 < int(in_process["deadline_ms"]) <= 2000
+
+    def test_triage_routes_follow_ups_to_previous_agent():
+        """Test conversation-aware routing with per-user session memory"""
+        services_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services")
+        triage_app = gateway.load_agent_app(os.path.join(services_dir, "triage-agent"), "learnflow_triage_sessions")
+        session_module = sys.modules["learnflow_triage_sessions.session_memory"]
+        triage_client = TestClient(triage_app)
+
+        results = triage_client.post("/query/batch", json={"queries": [
+            {"query": "my code throws a TypeError in add()", "user_id": "s1"},
+            {"query": "why?", "user_id": "s1"},
+            {"query": "why?", "user_id": "s2"},
+            {"query": "show me another example", "user_id": "s1"},
+            {"query": "give me a practice quiz", "user_id": "s1"},
+        ]}).json()["results"]
+        assert [r["agent"] for i, r in enumerate(results) if i != 2] == ["debug-agent", "debug-agent", "debug-agent", "exercise-agent"]
+        assert results[1]["params"]["follow_up"] is True
+        assert results[1]["params"]["previous_query"] == "my code throws a TypeError in add()"
+        assert results[1]["params"]["entities"] == ["TypeError", "add"]
+        assert "follow_up" not in results[2]["params"]
+
+        followed = triage_client.post("/query", json={"query": "why?", "user_id": "s1"}).json()
+        assert followed["agent"] == "exercise-agent"
+        assert triage_client.get("/metrics").json()["sessions"]["follow_ups"] == 3
+
+        memory = session_module.SessionMemory(ttl_seconds=60, max_users=2)
+        decision = ("debug-agent", 1.0, {"debug-agent": 1.0})
+        for user_id in ["a", "b", "c"]:
+            memory.record(user_id, decision, "my code has an error", follow_up=False)
+        assert list(memory.sessions) == ["b", "c"] and memory.stats["evicted"] == 1
+        assert memory.follow_up("b", "why?") is not None
+        assert memory.follow_up("b", "how do i write a recursive function to sum a list") is None
+        memory.ttl_seconds = 0
+        assert memory.follow_up("b", "why?") is None and memory.stats["expired"] == 1
+
+    def test_triage_keeps_fresh_questions_out_of_sessions():
+        """Test that fresh questions with pronouns are classified, and follow-ups carry context to agents"""
+        services_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services")
+        triage_app = gateway.load_agent_app(os.path.join(services_dir, "triage-agent"), "learnflow_triage_fresh")
+        triage = sys.modules["learnflow_triage_fresh.main"]
+        triage_client = TestClient(triage_app)
+
+        for query in ["how do I reverse this list", "what are decorators then", "can I sort it", "write a class for this"]:
+            triage_client.post("/query", json={"query": "my code throws a TypeError in add()", "user_id": "f1"})
+            routed = triage_client.post("/query", json={"query": query, "user_id": "f1"}).json()
+            assert "follow_up" not in routed["params"], query
+            assert routed["agent"] != "debug-agent", query
+
+        class RecordingDispatcher:
+            def __init__(self):
+                self.bodies = []
+
+            async def dispatch(self, agent, path, body, correlation_id, timeout=None):
+                self.bodies.append((agent, path, body))
+                return {"ok": True}
+
+        original = triage.dispatcher
+        triage.dispatcher = RecordingDispatcher()
+        try:
+            triage_client.post("/query/dispatch", json={"query": "my code throws a TypeError in add()", "user_id": "f2"})
+            assert triage_client.post("/query/dispatch", json={"query": "why?", "user_id": "f2"}).status_code == 200
+            agent, path, body = triage.dispatcher.bodies[-1]
+        finally:
+            triage.dispatcher = original
+        assert (agent, path) == ("debug-agent", "/debug")
+        assert body["error_message"] == "my code throws a TypeError in add()"
+        assert body["context"] == {"follow_up": "why?", "previous_query": "my code throws a TypeError in add()",
+                                   "entities": ["TypeError", "add"]}
+
     # Run tests if this file is executed directly
     if __name__ == "__main__":
         print("Running LearnFlow Backend Tests...")
@@ -0,0 +1,156 @@
+"""
+Export the static LearnFlow curriculum as bundles for a static host / CDN
+
+Renders the parts of the curriculum that don't depend on the student into
+JSON bundles:
+
+- modules:            module graph (order, prerequisites, topics)
+- concepts-<level>:   concept explanations per topic for each level
+- exercises:          exercise statements and starter code
+- quizzes:            quiz questions (without answers)
+
+Each bundle is written as <name>.<content hash>.json with .gz (and .br when
+the brotli package is installed) precompressed siblings, so files are
+immutable and can be cached forever. manifest.json maps bundle names to the
+current files and is the only file that should be served with a short TTL.
+
+Run with: python export_curriculum.py [--out dist/curriculum]
+"""
+
+import argparse
+import gzip
+import hashlib
+import importlib
+import json
+import os
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SERVICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services")
+DEFAULT_OUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dist", "curriculum")
+HASH_LENGTH = 12
+
+
+def load_service(name):
+    """Import a service's app.main without leaving its `app` package in sys.modules"""
+    path = os.path.join(SERVICES_DIR, name)
+    sys.path.insert(0, path)
+    try:
+        return importlib.import_module("app.main")
+    finally:
+        sys.path.remove(path)
+        for module in [m for m in sys.modules if m == "app" or m.startswith("app.")]:
+            del sys.modules[module]
+
+
+def load_gateway():
+    path = os.path.join(SERVICES_DIR, "api-gateway", "app")
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    return importlib.import_module("main")
+
+
+def build_bundles(gateway, concepts, exercises):
+    """Return {bundle name: JSON-serializable content}"""
+    modules = list(gateway.CURRICULUM_MODULES.items())
+    bundles = {
+        "modules": {
+            "modules": [
+                {
+                    "name": module,
+                    "order": index,
+                    "prerequisites": [modules[index - 1][0]] if index else [],
+                    "topics": [{"id": topic, "label": gateway.curriculum_topic_label(module, topic)} for topic in topics],
+                }
+                for index, (module, topics) in enumerate(modules)
+            ]
+        }
+    }
+
+    for level in concepts.LEVELS:
+        topics = {}
+        for module, module_topics in modules:
+            for topic in module_topics:
+                rendered = concepts.render_explanation(gateway.curriculum_topic_label(module, topic), level)
+                topics.setdefault(module, {})[topic] = {"explanation": rendered.explanation, "examples": rendered.examples}
+        bundles[f"concepts-{level}"] = {"level": level, "modules": topics}
+
+    # Test cases carry the expected outputs, so only the statements are published
+    bundles["exercises"] = {
+        "modules": {
+            module: {topic: {"problem": e["problem"], "starter_code": e["starter_code"]} for topic, e in topics.items()}
+            for module, topics in exercises.EXERCISES.items()
+        }
+    }
+
+    bundles["quizzes"] = {
+        "quizzes": [
+            {
+                **quiz.summary(),
+                "items": [{"id": qid, "question": q["question"], "options": q["options"], "module": q["module"], "topic": q["topic"]}
+                          for qid, q in zip(quiz.question_ids, quiz.questions)],
+            }
+            for quiz in gateway.compiled_quizzes.values()
+        ]
+    }
+    return bundles
+
+
+def write_file(path, data: bytes):
+    # Write-then-rename so a static host never serves a half-written file
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def write_bundle(out_dir, name, content) -> dict:
+    """Write one bundle and its precompressed variants, returning its manifest entry"""
+    data = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    filename = f"{name}.{digest[:HASH_LENGTH]}.json"
+
+    encodings = {"gzip": (".gz", gzip.compress(data, compresslevel=9, mtime=0))}
+    if brotli is not None:
+        encodings["br"] = (".br", brotli.compress(data, quality=11))
+
+    write_file(os.path.join(out_dir, filename), data)
+    entry = {"file": filename, "sha256": digest, "bytes": len(data), "encodings": {}}
+    for encoding, (suffix, compressed) in encodings.items():
+        write_file(os.path.join(out_dir, filename + suffix), compressed)
+        entry["encodings"][encoding] = {"file": filename + suffix, "bytes": len(compressed)}
+    return entry
+
+
+def export_curriculum(out_dir: str = DEFAULT_OUT_DIR) -> dict:
+    """
+    Write all bundles and the manifest to `out_dir` and return the manifest.
+    Unchanged content keeps its file name, so re-running is idempotent;
+    files from older versions are left in place for clients still holding an
+    older manifest.
+    """
+    gateway = load_gateway()
+    bundles = build_bundles(gateway, load_service("concepts-agent"), load_service("exercise-agent"))
+
+    os.makedirs(out_dir, exist_ok=True)
+    entries = {name: write_bundle(out_dir, name, content) for name, content in sorted(bundles.items())}
+    version = hashlib.sha256("".join(entries[name]["sha256"] for name in sorted(entries)).encode()).hexdigest()[:HASH_LENGTH]
+
+    manifest = {"version": version, "bundles": entries}
+    write_file(os.path.join(out_dir, "manifest.json"), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--out", default=DEFAULT_OUT_DIR, help="output directory (default: dist/curriculum)")
+    args = parser.parse_args()
+
+    manifest = export_curriculum(args.out)
+    print(f"Curriculum version {manifest['version']} -> {args.out}")
+    for name, entry in manifest["bundles"].items():
+        sizes = ", ".join(f"{encoding} {variant['bytes']} B" for encoding, variant in entry["encodings"].items())
+        print(f"  {entry['file']:<40} {entry['bytes']:>7} B ({sizes})")
@@ -3,14 +3,7 @@
 import { useState, useEffect } from 'react';
 import { useRouter } from 'next/navigation';
 import Link from 'next/link';
-
-type Question = {
-  id: number;
-  question: string;
-  options: string[];
-  correctAnswer: number;
-  explanation: string;
-};
+import { quizAPI, QuizQuestions, QuizResult } from '../../../lib/api';
 
 type User = {
   id: string;
@@ -23,50 +16,13 @@ export default function QuizPage() {
   const router = useRouter();
   const [user, setUser] = useState<User | null>(null);
   const [isLoading, setIsLoading] = useState(true);
+  const [quiz, setQuiz] = useState<QuizQuestions | null>(null);
+  const [errorMessage, setErrorMessage] = useState<string | null>(null);
   const [currentQuestion, setCurrentQuestion] = useState(0);
   const [selectedAnswer, setSelectedAnswer] = useState<number | null>(null);
-  const [showResult, setShowResult] = useState(false);
-  const [score, setScore] = useState(0);
-  const [quizCompleted, setQuizCompleted] = useState(false);
   const [answers, setAnswers] = useState<number[]>([]);
-
-  const questions: Question[] = [
-    {
-      id: 1,
-      question: "What is the correct way to create a variable in Python?",
-      options: ["var x = 5", "x = 5", "int x = 5", "let x = 5"],
-      correctAnswer: 1,
-      explanation: "In Python, you create variables by simply assigning a value. No keyword like 'var', 'let', or type declaration is needed."
-    },
-    {
-      id: 2,
-      question: "Which of the following is a valid Python list?",
-      options: ["[1, 2, 3]", "{1, 2, 3}", "(1, 2, 3)", "<1, 2, 3>"],
-      correctAnswer: 0,
-      explanation: "Lists in Python are created using square brackets []. Curly braces {} create sets or dicts, and parentheses () create tuples."
-    },
-    {
-      id: 3,
-      question: "What does the 'len()' function do?",
-      options: ["Converts to lowercase", "Returns the length of an object", "Creates a new list", "Removes an item"],
-      correctAnswer: 1,
-      explanation: "The len() function returns the number of items in an object like a string, list, tuple, etc."
-    },
-    {
-      id: 4,
-      question: "How do you start a for loop in Python?",
-      options: ["for (i = 0; i < 10; i++)", "for i in range(10):", "foreach i in range(10)", "loop i from 0 to 10"],
-      correctAnswer: 1,
-      explanation: "Python uses 'for item in iterable:' syntax. The range() function generates a sequence of numbers."
-    },
-    {
-      id: 5,
-      question: "What will print(type(5.0)) output?",
-      options: ["<class 'int'>", "<class 'float'>", "<class 'number'>", "<class 'decimal'>"],
-      correctAnswer: 1,
-      explanation: "5.0 is a floating-point number in Python, so type() returns <class 'float'>."
-    }
-  ];
+  const [isSubmitting, setIsSubmitting] = useState(false);
+  const [result, setResult] = useState<QuizResult | null>(null);
 
   useEffect(() => {
     const currentUser = localStorage.getItem('learnflow_current_user');
@@ -82,44 +38,57 @@ export default function QuizPage() {
     }
 
     setUser(parsedUser);
-    setIsLoading(false);
+
+    // Questions come without their answers; the gateway grades the submission
+    quizAPI.list()
+      .then((quizzes) => {
+        if (quizzes.length === 0) {
+          throw new Error('No quizzes available');
+        }
+        return quizAPI.get(quizzes[0].quiz_id);
+      })
+      .then(setQuiz)
+      .catch((error) => {
+        console.error('Failed to load quiz:', error);
+        setErrorMessage('Could not load the quiz. Please try again later.');
+      })
+      .finally(() => setIsLoading(false));
   }, [router]);
 
   const handleAnswerSelect = (answerIndex: number) => {
-    if (showResult) return;
+    if (isSubmitting) return;
     setSelectedAnswer(answerIndex);
   };
 
-  const handleSubmitAnswer = () => {
-    if (selectedAnswer === null) return;
+  const handleNextQuestion = async () => {
+    if (!quiz || selectedAnswer === null) return;
 
     const newAnswers = [...answers, selectedAnswer];
-    setAnswers(newAnswers);
-
-    if (selectedAnswer === questions[currentQuestion].correctAnswer) {
-      setScore(score + 1);
+    if (currentQuestion < quiz.items.length - 1) {
+      setAnswers(newAnswers);
+      setSelectedAnswer(null);
+      setCurrentQuestion(currentQuestion + 1);
+      return;
     }
 
-    setShowResult(true);
-  };
-
-  const handleNextQuestion = () => {
-    if (currentQuestion < questions.length - 1) {
-      setCurrentQuestion(currentQuestion + 1);
-      setSelectedAnswer(null);
-      setShowResult(false);
-    } else {
-      setQuizCompleted(true);
+    setIsSubmitting(true);
+    setErrorMessage(null);
+    try {
+      setResult(await quizAPI.submit(quiz.quiz_id, newAnswers));
+    } catch (error) {
+      console.error('Failed to submit quiz:', error);
+      setErrorMessage('Could not submit your answers. Please try again.');
+    } finally {
+      setIsSubmitting(false);
     }
   };
 
   const handleRestartQuiz = () => {
     setCurrentQuestion(0);
     setSelectedAnswer(null);
-    setShowResult(false);
-    setScore(0);
-    setQuizCompleted(false);
     setAnswers([]);
+    setResult(null);
+    setErrorMessage(null);
   };
 
   if (isLoading) {
@@ -133,8 +102,24 @@ export default function QuizPage() {
     );
   }
 
-  if (quizCompleted) {
-    const percentage = Math.round((score / questions.length) * 100);
+  if (!quiz) {
+    return (
+      <div className="min-h-screen bg-gradient-to-br from-blue-50 to-indigo-100 flex items-center justify-center">
+        <div className="bg-white rounded-2xl shadow-xl p-8 text-center">
+          <p className="text-gray-600 mb-6">{errorMessage}</p>
+          <Link
+            href="/student/dashboard"
+            className="bg-gray-200 hover:bg-gray-300 text-gray-800 px-6 py-3 rounded-lg font-medium transition-colors"
+          >
+            Back to Dashboard
+          </Link>
+        </div>
+      </div>
+    );
+  }
+
+  if (result) {
+    const percentage = Math.round(result.score * 100);
     return (
       <div className="min-h-screen bg-gradient-to-br from-blue-50 to-indigo-100">
         <header className="bg-white/80 backdrop-blur-md shadow-lg border-b border-white/20 sticky top-0 z-10">
@@ -162,7 +147,7 @@ export default function QuizPage() {
 
             <h2 className="text-2xl font-bold text-gray-900 mb-2">Quiz Completed!</h2>
             <p className="text-gray-600 mb-6">
-              You scored {score} out of {questions.length} questions correctly.
+              You scored {result.correct} out of {result.total} questions correctly.
             </p>
 
             <div className={`p-4 rounded-lg mb-8 ${
@@ -175,6 +160,23 @@ export default function QuizPage() {
                "Keep learning! Review the material and try again."}
             </div>
 
+            <div className="space-y-3 mb-8 text-left">
+              {result.feedback.map((item, index) => (
+                <div
+                  key={item.id}
+                  className={`p-4 rounded-lg ${item.correct ? 'bg-green-50 text-green-800' : 'bg-red-50 text-red-800'}`}
+                >
+                  <p className="font-medium mb-1">
+                    {index + 1}. {quiz.items[index].question}
+                  </p>
+                  <p className="text-sm mb-1">
+                    {item.correct ? 'Correct!' : `Incorrect. The answer is ${String.fromCharCode(65 + item.answer)}: ${quiz.items[index].options[item.answer]}`}
+                  </p>
+                  <p className="text-sm">{item.explanation}</p>
+                </div>
+              ))}
+            </div>
+
             <div className="flex gap-4 justify-center">
               <button
                 onClick={handleRestartQuiz}
@@ -195,7 +197,8 @@ export default function QuizPage() {
     );
   }
 
-  const question = questions[currentQuestion];
+  const question = quiz.items[currentQuestion];
+  const isLastQuestion = currentQuestion === quiz.items.length - 1;
 
   return (
     <div className="min-h-screen bg-gradient-to-br from-blue-50 to-indigo-100">
@@ -206,10 +209,10 @@ export default function QuizPage() {
               <div className="w-10 h-10 bg-gradient-to-r from-blue-500 to-purple-600 rounded-lg flex items-center justify-center">
                 <span className="text-white font-bold text-sm">LF</span>
               </div>
-              <span className="text-xl font-bold text-gray-900">LearnFlow Quiz</span>
+              <span className="text-xl font-bold text-gray-900">{quiz.title}</span>
             </Link>
             <div className="text-sm text-gray-600">
-              Question {currentQuestion + 1} of {questions.length}
+              Question {currentQuestion + 1} of {quiz.items.length}
             </div>
           </div>
         </div>
@@ -221,7 +224,7 @@ export default function QuizPage() {
           <div className="w-full bg-gray-200 rounded-full h-2">
             <div
               className="bg-blue-500 h-2 rounded-full transition-all duration-300"
-              style={{ width: `${((currentQuestion + 1) / questions.length) * 100}%` }}
+              style={{ width: `${((currentQuestion + 1) / quiz.items.length) * 100}%` }}
             ></div>
           </div>
         </div>
@@ -234,30 +237,16 @@ export default function QuizPage() {
               <button
                 key={index}
                 onClick={() => handleAnswerSelect(index)}
-                disabled={showResult}
+                disabled={isSubmitting}
                 className={`w-full p-4 text-left rounded-lg border-2 transition-all ${
-                  showResult
-                    ? index === question.correctAnswer
-                      ? 'border-green-500 bg-green-50'
-                      : index === selectedAnswer
-                        ? 'border-red-500 bg-red-50'
-                        : 'border-gray-200'
-                    : selectedAnswer === index
-                      ? 'border-blue-500 bg-blue-50'
-                      : 'border-gray-200 hover:border-blue-300 hover:bg-blue-50'
+                  selectedAnswer === index
+                    ? 'border-blue-500 bg-blue-50'
+                    : 'border-gray-200 hover:border-blue-300 hover:bg-blue-50'
                 }`}
               >
                 <div className="flex items-center">
                   <span className={`w-8 h-8 rounded-full flex items-center justify-center mr-3 text-sm font-medium ${
-                    showResult
-                      ? index === question.correctAnswer
-                        ? 'bg-green-500 text-white'
-                        : index === selectedAnswer
-                          ? 'bg-red-500 text-white'
-                          : 'bg-gray-200 text-gray-600'
-                      : selectedAnswer === index
-                        ? 'bg-blue-500 text-white'
-                        : 'bg-gray-200 text-gray-600'
+                    selectedAnswer === index ? 'bg-blue-500 text-white' : 'bg-gray-200 text-gray-600'
                   }`}>
                     {String.fromCharCode(65 + index)}
                   </span>
@@ -267,14 +256,9 @@ export default function QuizPage() {
             ))}
           </div>
 
-          {showResult && (
-            <div className={`p-4 rounded-lg mb-6 ${
-              selectedAnswer === question.correctAnswer ? 'bg-green-50 text-green-800' : 'bg-red-50 text-red-800'
-            }`}>
-              <p className="font-medium mb-1">
-                {selectedAnswer === question.correctAnswer ? 'Correct!' : 'Incorrect!'}
-              </p>
-              <p className="text-sm">{question.explanation}</p>
+          {errorMessage && (
+            <div className="p-4 rounded-lg mb-6 bg-red-50 text-red-800">
+              <p className="text-sm">{errorMessage}</p>
             </div>
           )}
 
@@ -286,22 +270,13 @@ export default function QuizPage() {
               Exit Quiz
             </Link>
 
-            {!showResult ? (
-              <button
-                onClick={handleSubmitAnswer}
-                disabled={selectedAnswer === null}
-                className="bg-blue-500 hover:bg-blue-600 disabled:bg-gray-300 disabled:cursor-not-allowed text-white px-6 py-2 rounded-lg font-medium transition-colors"
-              >
-                Submit Answer
-              </button>
-            ) : (
-              <button
-                onClick={handleNextQuestion}
-                className="bg-blue-500 hover:bg-blue-600 text-white px-6 py-2 rounded-lg font-medium transition-colors"
-              >
-                {currentQuestion < questions.length - 1 ? 'Next Question' : 'See Results'}
-              </button>
-            )}
+            <button
+              onClick={handleNextQuestion}
+              disabled={selectedAnswer === null || isSubmitting}
+              className="bg-blue-500 hover:bg-blue-600 disabled:bg-gray-300 disabled:cursor-not-allowed text-white px-6 py-2 rounded-lg font-medium transition-colors"
+            >
+              {isLastQuestion ? (isSubmitting ? 'Submitting...' : 'Submit Quiz') : 'Next Question'}
+            </button>
           </div>
         </div>
       </main>
@@ -3,6 +3,7 @@
 import { useState, useEffect } from 'react';
 import Link from 'next/link';
 import { useRouter } from 'next/navigation';
+import { dashboardAPI, DashboardData } from '../../../lib/api';
 
 type Module = {
   id: string;
@@ -20,83 +21,64 @@ type User = {
   role: string;
 };
 
+type Activity = {
+  id: number;
+  activity: string;
+  timestamp: string;
+  score?: number;
+  result?: string;
+};
+
+// Mastery at which a module counts as completed (the gateway's PROFICIENT_MASTERY)
+const PROFICIENT_MASTERY = 70;
+
+const MODULE_DESCRIPTIONS: Record<string, string> = {
+  'Basics': 'Variables, data types, operators, input/output',
+  'Control Flow': 'Conditional statements, loops, break/continue',
+  'Functions': 'Defining functions, parameters, return values',
+};
+
+// Modules in curriculum order: proficient ones are completed, the first one
+// below proficiency and any already started are in progress, the rest locked
+function toModules(progress: DashboardData['progress']): Module[] {
+  if (!progress) return [];
+  let reachedCurrent = false;
+  return Object.entries(progress.modules).map(([name, mastery]) => {
+    const masteryLevel = Math.round(mastery);
+    let status: Module['status'] = 'completed';
+    if (masteryLevel < PROFICIENT_MASTERY) {
+      status = reachedCurrent && masteryLevel === 0 ? 'locked' : 'in-progress';
+      reachedCurrent = true;
+    }
+    return {
+      id: name,
+      name,
+      description: MODULE_DESCRIPTIONS[name] || '',
+      masteryLevel,
+      progress: masteryLevel,
+      status
+    };
+  });
+}
+
+function toActivities(events: DashboardData['recent_activity']): Activity[] {
+  return (events || []).map((event, index) => ({
+    id: index,
+    activity: `${event.activity_type === 'quiz' ? 'Completed a quiz on' : 'Practiced'} "${(event.topic || '').replace(/_/g, ' ')}" in ${event.module}`,
+    timestamp: event.timestamp.replace('T', ' ').slice(0, 16),
+    score: Math.round(event.score * 100)
+  }));
+}
+
 export default function StudentDashboard() {
   const router = useRouter();
   const [user, setUser] = useState<User | null>(null);
   const [isLoading, setIsLoading] = useState(true);
 
-  const [modules, setModules] = useState<Module[]>([
-    {
-      id: 'mod1',
-      name: 'Python Basics',
-      description: 'Variables, data types, operators, input/output',
-      masteryLevel: 85,
-      progress: 100,
-      status: 'completed'
-    },
-    {
-      id: 'mod2',
-      name: 'Control Flow',
-      description: 'Conditional statements, loops, break/continue',
-      masteryLevel: 65,
-      progress: 75,
-      status: 'in-progress'
-    },
-    {
-      id: 'mod3',
-      name: 'Functions',
-      description: 'Defining functions, parameters, return values',
-      masteryLevel: 30,
-      progress: 40,
-      status: 'in-progress'
-    },
-    {
-      id: 'mod4',
-      name: 'Data Structures',
-      description: 'Lists, tuples, dictionaries, sets',
-      masteryLevel: 0,
-      progress: 0,
-      status: 'locked'
-    },
-    {
-      id: 'mod5',
-      name: 'Object-Oriented Programming',
-      description: 'Classes, objects, inheritance, polymorphism',
-      masteryLevel: 0,
-      progress: 0,
-      status: 'locked'
-    },
-    {
-      id: 'mod6',
-      name: 'File Operations',
-      description: 'Reading/writing files, CSV, JSON',
-      masteryLevel: 0,
-      progress: 0,
-      status: 'locked'
-    },
-    {
-      id: 'mod7',
-      name: 'Error Handling',
-      description: 'Try/except blocks, exception types, debugging',
-      masteryLevel: 0,
-      progress: 0,
-      status: 'locked'
-    },
-    {
-      id: 'mod8',
-      name: 'Libraries & APIs',
-      description: 'Installing packages, using APIs, virtual environments',
-      masteryLevel: 0,
-      progress: 0,
-      status: 'locked'
-    }
-  ]);
-
-  const [recentActivities, setRecentActivities] = useState([
-    { id: 1, activity: 'Completed "Loops in Python" quiz', timestamp: '2026-01-15 14:30', score: 85 },
-    { id: 2, activity: 'Submitted "Function Practice" exercise', timestamp: '2026-01-15 12:15', result: 'Passed' },
-    { id: 3, activity: 'Asked "How do I use list comprehensions?"', timestamp: '2026-01-15 10:45', response: 'Explained' }
-  ]);
+  const [modules, setModules] = useState<Module[]>([]);
+  const [recentActivities, setRecentActivities] = useState<Activity[]>([]);
+  const [overallMastery, setOverallMastery] = useState(0);
+  const [nextTopic, setNextTopic] = useState<DashboardData['next_topic']>(null);
 
   useEffect(() => {
     // Check if user is logged in
@@ -113,7 +95,17 @@ export default function StudentDashboard() {
     }
 
     setUser(parsedUser);
-    setIsLoading(false);
+
+    // Profile, progress, next topic and activity come back in one request
+    dashboardAPI.get()
+      .then((data) => {
+        setModules(toModules(data.progress));
+        setOverallMastery(Math.round(data.progress?.overall_mastery || 0));
+        setNextTopic(data.next_topic);
+        setRecentActivities(toActivities(data.recent_activity));
+      })
+      .catch((error) => console.error('Failed to load dashboard:', error))
+      .finally(() => setIsLoading(false));
   }, [router]);
 
   const handleLogout = () => {
@@ -121,6 +113,8 @@ export default function StudentDashboard() {
     router.push('/');
   };
 
+  const nextMastery = nextTopic ? Math.round(nextTopic.mastery_score) : 100;
+
   if (isLoading) {
     return (
       <div className="min-h-screen bg-gradient-to-br from-blue-50 to-indigo-100 flex items-center justify-center">
@@ -211,7 +205,7 @@ export default function StudentDashboard() {
                     <div className="flex items-center justify-between">
                       <div>
                         <p className="text-xs sm:text-sm font-semibold text-blue-800">Overall Mastery</p>
-                        <p className="text-xl sm:text-2xl md:text-3xl font-bold text-blue-600 mt-0.5 sm:mt-1">72%</p>
+                        <p className="text-xl sm:text-2xl md:text-3xl font-bold text-blue-600 mt-0.5 sm:mt-1">{overallMastery}%</p>
                       </div>
                       <div className="w-8 h-8 sm:w-10 sm:h-10 md:w-12 md:h-12 bg-blue-500/20 rounded-full flex items-center justify-center flex-shrink-0">
                         <svg className="w-4 h-4 sm:w-5 sm:h-5 md:w-6 md:h-6 text-blue-600" fill="none" stroke="currentColor" viewBox="0 0 24 24">
@@ -225,7 +219,7 @@ export default function StudentDashboard() {
                     <div className="flex items-center justify-between">
                       <div>
                         <p className="text-xs sm:text-sm font-semibold text-green-800">Modules Completed</p>
-                        <p className="text-xl sm:text-2xl md:text-3xl font-bold text-green-600 mt-0.5 sm:mt-1">2/8</p>
+                        <p className="text-xl sm:text-2xl md:text-3xl font-bold text-green-600 mt-0.5 sm:mt-1">{modules.filter((module) => module.status === 'completed').length}/{modules.length}</p>
                       </div>
                       <div className="w-8 h-8 sm:w-10 sm:h-10 md:w-12 md:h-12 bg-green-500/20 rounded-full flex items-center justify-center flex-shrink-0">
                         <svg className="w-4 h-4 sm:w-5 sm:h-5 md:w-6 md:h-6 text-green-600" fill="none" stroke="currentColor" viewBox="0 0 24 24">
@@ -325,7 +319,7 @@ export default function StudentDashboard() {
                         </div>
 
                         <Link
-                          href={`/student/learn?module=${module.id}`}
+                          href={`/student/learn?module=${encodeURIComponent(module.id)}`}
                           className={`w-full sm:w-auto sm:ml-4 px-3 sm:px-4 py-2 rounded-lg text-sm font-medium transition-all duration-300 transform hover:scale-105 text-center ${
                             module.status === 'locked'
                               ? 'bg-gray-300 text-gray-500 cursor-not-allowed'
@@ -410,14 +404,14 @@ export default function StudentDashboard() {
                   Continue Learning
                 </h3>
                 <div className="bg-white/20 backdrop-blur-sm rounded-lg sm:rounded-xl p-3 sm:p-4 mb-3 sm:mb-4">
-                  <p className="font-semibold text-sm sm:text-base">Control Flow Module</p>
-                  <p className="text-xs sm:text-sm opacity-90 mt-1">75% complete • 65% mastery</p>
+                  <p className="font-semibold text-sm sm:text-base">{nextTopic ? `${nextTopic.module}: ${nextTopic.topic.replace(/_/g, ' ')}` : 'All topics proficient'}</p>
+                  <p className="text-xs sm:text-sm opacity-90 mt-1">{nextMastery}% mastery</p>
                   <div className="w-full bg-white/30 rounded-full h-1.5 sm:h-2 mt-2 sm:mt-3">
-                    <div className="bg-white h-1.5 sm:h-2 rounded-full" style={{ width: '75%' }}></div>
+                    <div className="bg-white h-1.5 sm:h-2 rounded-full" style={{ width: `${nextMastery}%` }}></div>
                   </div>
                 </div>
                 <Link
-                  href="/student/learn?module=mod2"
+                  href={nextTopic ? `/student/learn?module=${encodeURIComponent(nextTopic.module)}` : '/student/learn'}
                   className="w-full bg-white text-blue-600 hover:bg-gray-100 font-semibold py-2.5 sm:py-3 px-4 rounded-lg text-sm sm:text-base transition-all duration-300 transform hover:scale-105 block text-center"
                   prefetch={false}
                 >
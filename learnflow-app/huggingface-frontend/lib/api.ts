@@ -312,6 +312,114 @@ export const progressAPI = {
   },
 };
 
+// ==================== DASHBOARD API ====================
+
+export interface DashboardData {
+  user: AuthResponse['user'] | null;
+  progress: {
+    overall_mastery: number;
+    current_module: string;
+    modules: Record<string, number>;
+  } | null;
+  next_topic: { module: string; topic: string; mastery_score: number } | null;
+  recent_activity: Array<{
+    activity_type: string;
+    module: string;
+    topic: string;
+    score: number;
+    timestamp: string;
+  }> | null;
+  partial: boolean;
+  missing: Record<string, string>;
+}
+
+export const dashboardAPI = {
+  get: async (): Promise<DashboardData> => {
+    return apiFetch<DashboardData>(`${API_BASE_URL}/dashboard`);
+  },
+};
+
+// ==================== CURRICULUM BUNDLES ====================
+
+// Static curriculum bundles produced by export_curriculum.py
+const CURRICULUM_URL = process.env.NEXT_PUBLIC_CURRICULUM_URL || '/curriculum';
+
+export interface CurriculumManifest {
+  version: string;
+  bundles: Record<string, { file: string; sha256: string; bytes: number }>;
+}
+
+let curriculumManifest: Promise<CurriculumManifest> | null = null;
+
+export const curriculumAPI = {
+  manifest: async (): Promise<CurriculumManifest> => {
+    if (!curriculumManifest) {
+      curriculumManifest = fetch(`${CURRICULUM_URL}/manifest.json`, { cache: 'no-cache' }).then((response) => {
+        if (!response.ok) {
+          curriculumManifest = null;
+          throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        return response.json();
+      });
+    }
+    return curriculumManifest;
+  },
+
+  // Bundle files are content-hashed, so the browser can cache them indefinitely
+  bundle: async <T = unknown>(name: string): Promise<T> => {
+    const manifest = await curriculumAPI.manifest();
+    const entry = manifest.bundles[name];
+    if (!entry) {
+      throw new Error(`Unknown curriculum bundle: ${name}`);
+    }
+    const response = await fetch(`${CURRICULUM_URL}/${entry.file}`);
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    return response.json();
+  },
+};
+
+// ==================== QUIZ API ====================
+
+export interface QuizSummary {
+  quiz_id: string;
+  title: string;
+  questions: number;
+  modules: string[];
+}
+
+export interface QuizQuestions extends QuizSummary {
+  items: Array<{ id: string; question: string; options: string[]; module: string; topic: string }>;
+}
+
+export interface QuizResult {
+  user_id: string;
+  quiz_id: string;
+  correct: number;
+  total: number;
+  score: number;
+  topics: Record<string, Record<string, number>>;
+  feedback: Array<{ id: string; correct: boolean; answer: number; explanation: string }>;
+}
+
+export const quizAPI = {
+  list: async (): Promise<QuizSummary[]> => {
+    return apiFetch<QuizSummary[]>(`${API_BASE_URL}/quizzes`);
+  },
+
+  get: async (quizId: string): Promise<QuizQuestions> => {
+    return apiFetch<QuizQuestions>(`${API_BASE_URL}/quizzes/${quizId}`);
+  },
+
+  submit: async (quizId: string, answers: Array<number | null>): Promise<QuizResult> => {
+    return apiFetch<QuizResult>(`${API_BASE_URL}/quizzes/${quizId}/submit`, {
+      method: 'POST',
+      body: JSON.stringify({ answers }),
+    });
+  },
+};
+
 // ==================== AI CHAT API ====================
 
 export interface ChatMessage {
@@ -1,16 +1,117 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, EmailStr
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, EmailStr, ValidationError
 from typing import Optional, List
+import pydantic_core
 import os
 import jwt
 import httpx
 import hashlib
 import json
+import asyncio
+import codecs
+import csv
+import tempfile
+import time
+import logging
+import re
+import zlib
+import heapq
+import gc
+import pickle
+import struct
+import copy
+import functools
+import importlib
+import inspect
+import sys
+import types
+import itertools
+import numpy as np
+from collections import deque, OrderedDict
+from abc import ABC, abstractmethod
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta
 
+# Sibling services, and the shared modules in services/shared; set where the
+# layout differs (the all-in-one and Hugging Face images)
+AGENT_SERVICES_DIR = os.getenv(
+    "AGENT_SERVICES_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+)
+sys.path.insert(0, AGENT_SERVICES_DIR)
+from shared.bounded_store import BoundedStore  # noqa: E402
+
+# ==================== FAST JSON ROUTES ====================
+
+class FastJSONRequest(Request):
+    """Request whose JSON body is parsed by pydantic-core's Rust parser instead of json.loads"""
+
+    async def json(self):
+        if not hasattr(self, "_json"):
+            body = await self.body()
+            try:
+                self._json = pydantic_core.from_json(body)
+            except ValueError as e:
+                # FastAPI turns JSONDecodeError into its usual 422 json_invalid response
+                raise json.JSONDecodeError(str(e), body.decode("utf-8", "replace"), 0) from e
+        return self._json
+
+class FastJSONRoute(APIRoute):
+    """
+    Route class for the JSON endpoints. Request bodies are parsed with
+    pydantic-core, and when an endpoint returns an instance of exactly its
+    declared response_model it is written straight to JSON bytes with the
+    model's compiled serializer, skipping FastAPI's re-validation and
+    jsonable_encoder pass. Models, validation and OpenAPI are unchanged.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        response_model = kwargs.get("response_model")
+        plain = (
+            isinstance(response_model, type) and issubclass(response_model, BaseModel)
+            and isinstance(kwargs.get("response_class"), DefaultPlaceholder)
+            and not any(kwargs.get(option) for option in (
+                "response_model_include", "response_model_exclude", "response_model_exclude_unset",
+                "response_model_exclude_defaults", "response_model_exclude_none"))
+        )
+        if plain and inspect.iscoroutinefunction(endpoint):
+            endpoint = self._serialize_directly(endpoint, response_model)
+        super().__init__(path, endpoint, **kwargs)
+
+    @staticmethod
+    def _serialize_directly(endpoint, response_model):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            result = await endpoint(*args, **kwargs)
+            if type(result) is not response_model:
+                return result
+            response = Response(result.__pydantic_serializer__.to_json(result, by_alias=True),
+                                media_type="application/json")
+            # Carry over status and headers set on an injected Response parameter
+            for value in kwargs.values():
+                if isinstance(value, Response):
+                    if value.status_code:
+                        response.status_code = value.status_code
+                    response.headers.raw.extend(value.headers.raw)
+            return response
+        return wrapper
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def fast_handler(request: Request):
+            return await handler(FastJSONRequest(request.scope, request.receive))
+        return fast_handler
+
 app = FastAPI(title="LearnFlow API Gateway")
+app.router.route_class = FastJSONRoute
+
+logger = logging.getLogger(__name__)
 
 # CORS configuration
 app.add_middleware(
@@ -25,10 +126,104 @@ app.add_middleware(
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "learnflow-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
+CLASS_INVITE_EXPIRE_HOURS = int(os.getenv("CLASS_INVITE_EXPIRE_HOURS", "168"))
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
 LLM_MODEL = os.getenv("LLM_MODEL", "openai/gpt-3.5-turbo")
+LLM_TIMEOUT_SECONDS = 30.0
+
+# Model tiers for complexity-based routing; every tier defaults to LLM_MODEL
+MODEL_TIERS = {
+    "fast": {
+        "model": os.getenv("LLM_MODEL_FAST", LLM_MODEL),
+        "max_tokens": int(os.getenv("LLM_MAX_TOKENS_FAST", "500")),
+        "cost_per_1k_tokens": float(os.getenv("LLM_COST_PER_1K_FAST", "0.0015")),
+    },
+    "code": {
+        "model": os.getenv("LLM_MODEL_CODE", LLM_MODEL),
+        "max_tokens": int(os.getenv("LLM_MAX_TOKENS_CODE", "1000")),
+        "cost_per_1k_tokens": float(os.getenv("LLM_COST_PER_1K_CODE", "0.0015")),
+    },
+    "deep": {
+        "model": os.getenv("LLM_MODEL_DEEP", LLM_MODEL),
+        "max_tokens": int(os.getenv("LLM_MAX_TOKENS_DEEP", "1500")),
+        "cost_per_1k_tokens": float(os.getenv("LLM_COST_PER_1K_DEEP", "0.0015")),
+    },
+}
+
+# Per-route choice of tier (and optional token budget override) for each request category
+MODEL_ROUTING_POLICY = json.loads(os.getenv("MODEL_ROUTING_POLICY", "null")) or {
+    "chat": {
+        "short_factual": {"tier": "fast"},
+        "code_debugging": {"tier": "code"},
+        "long_explanation": {"tier": "deep"},
+    },
+    "explain": {
+        "short_factual": {"tier": "fast", "max_tokens": 800},
+        "code_debugging": {"tier": "code", "max_tokens": 800},
+        "long_explanation": {"tier": "deep"},
+    },
+}
+
+# Adaptive concurrency limit on OpenRouter calls
+LLM_LIMITER_INITIAL = int(os.getenv("LLM_LIMITER_INITIAL", "10"))
+LLM_LIMITER_MIN = int(os.getenv("LLM_LIMITER_MIN", "1"))
+LLM_LIMITER_MAX = int(os.getenv("LLM_LIMITER_MAX", "100"))
+LLM_LIMITER_LATENCY_TARGET_SECONDS = float(os.getenv("LLM_LIMITER_LATENCY_TARGET_SECONDS", "10"))
+LLM_LIMITER_MAX_QUEUE_SECONDS = float(os.getenv("LLM_LIMITER_MAX_QUEUE_SECONDS", "2"))
+
+# Circuit breaker around the OpenRouter upstream
+CIRCUIT_WINDOW_SIZE = int(os.getenv("CIRCUIT_WINDOW_SIZE", "20"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_SLOW_CALL_RATE = float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "0.5"))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "10"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "3"))
+
+# End-to-end request deadlines
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+DEFAULT_REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "35"))
+MAX_REQUEST_TIMEOUT_SECONDS = float(os.getenv("MAX_REQUEST_TIMEOUT_SECONDS", "120"))
+
+# Sandbox limits
+SANDBOX_TIMEOUT_SECONDS = 5
+STREAM_CHUNK_SIZE = 4096
+# Output chunks buffered between the sandbox pipes and a /execute/stream
+# client; once full, the pipes stop being read and the sandbox blocks on write
+STREAM_QUEUE_MAX_CHUNKS = int(os.getenv("STREAM_QUEUE_MAX_CHUNKS", "64"))
+
+# Persistent per-session kernels for notebook-style /execute
+KERNEL_MAX_PER_NODE = int(os.getenv("KERNEL_MAX_PER_NODE", "16"))
+KERNEL_IDLE_SECONDS = float(os.getenv("KERNEL_IDLE_SECONDS", "600"))
+KERNEL_MEMORY_LIMIT_MB = int(os.getenv("KERNEL_MEMORY_LIMIT_MB", "256"))
+
+# Bulk roster import (/auth/register/bulk)
+ROSTER_MAX_ROWS = int(os.getenv("ROSTER_MAX_ROWS", "2000"))
+ROSTER_BATCH_SIZE = int(os.getenv("ROSTER_BATCH_SIZE", "100"))
+
+# Aggregated /dashboard payload
+DASHBOARD_PART_TIMEOUT_SECONDS = float(os.getenv("DASHBOARD_PART_TIMEOUT_SECONDS", "2"))
+RECENT_ACTIVITY_LIMIT = int(os.getenv("RECENT_ACTIVITY_LIMIT", "20"))
+RECENT_ACTIVITY_MAX_USERS = int(os.getenv("RECENT_ACTIVITY_MAX_USERS", "10000"))
+
+# Memory budgets for the in-memory stores; colder entries spill to disk
+USERS_STORE_MEMORY_MB = float(os.getenv("USERS_STORE_MEMORY_MB", "64"))
+PROGRESS_STORE_MEMORY_MB = float(os.getenv("PROGRESS_STORE_MEMORY_MB", "128"))
+STORE_SPILL_DIR = os.getenv("STORE_SPILL_DIR") or None
+
+# Periodic state snapshots for warm restarts (disabled unless a path is set)
+STATE_SNAPSHOT_PATH = os.getenv("STATE_SNAPSHOT_PATH", "")
+STATE_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("STATE_SNAPSHOT_INTERVAL_SECONDS", "60"))
+
+# /explain answer cache, warmed in the background for each student's next topics
+EXPLANATION_CACHE_SIZE = int(os.getenv("EXPLANATION_CACHE_SIZE", "500"))
+EXPLANATION_CACHE_TTL_SECONDS = float(os.getenv("EXPLANATION_CACHE_TTL_SECONDS", "86400"))
+EXPLAIN_PREFETCH_ENABLED = os.getenv("EXPLAIN_PREFETCH_ENABLED", "true").lower() == "true"
+EXPLAIN_PREFETCH_DEPTH = int(os.getenv("EXPLAIN_PREFETCH_DEPTH", "2"))
+EXPLAIN_PREFETCH_BUDGET_PER_HOUR = int(os.getenv("EXPLAIN_PREFETCH_BUDGET_PER_HOUR", "200"))
+EXPLAIN_PREFETCH_MAX_QUEUED = int(os.getenv("EXPLAIN_PREFETCH_MAX_QUEUED", "100"))
 
 # Service URLs
 SERVICES = {
@@ -40,8 +235,45 @@ SERVICES = {
     "progress": os.getenv("PROGRESS_URL", "http://localhost:8006"),
 }
 
+# All-in-one mode: agents are mounted into this process instead of called over HTTP
+ALL_IN_ONE = os.getenv("ALL_IN_ONE", "false").lower() == "true"
+
+# Write-behind sync of progress updates into progress-agent
+PROGRESS_SYNC_ENABLED = os.getenv(
+    "PROGRESS_SYNC_ENABLED", "true" if "PROGRESS_URL" in os.environ or ALL_IN_ONE else "false"
+).lower() == "true"
+PROGRESS_SYNC_FLUSH_SIZE = int(os.getenv("PROGRESS_SYNC_FLUSH_SIZE", "50"))
+PROGRESS_SYNC_FLUSH_SECONDS = float(os.getenv("PROGRESS_SYNC_FLUSH_SECONDS", "2"))
+PROGRESS_SYNC_MAX_PENDING = int(os.getenv("PROGRESS_SYNC_MAX_PENDING", "10000"))
+PROGRESS_SYNC_MAX_RETRIES = int(os.getenv("PROGRESS_SYNC_MAX_RETRIES", "3"))
+
+# Fair scheduling of expensive gateway work across classes
+WORK_SLOTS = int(os.getenv("WORK_SLOTS", "32"))
+WORK_MAX_QUEUED_PER_TENANT = int(os.getenv("WORK_MAX_QUEUED_PER_TENANT", "64"))
+# JSON map of tenant id to weight, e.g. {"class-7a": 2}
+WORK_TENANT_WEIGHTS = json.loads(os.getenv("WORK_TENANT_WEIGHTS", "{}"))
+
+# Idempotency-Key replay store for POST /progress and /execute
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+
+# Semantic answer cache for /chat
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.7"))
+SEMANTIC_CACHE_CAPACITY = int(os.getenv("SEMANTIC_CACHE_CAPACITY", "2000"))
+SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "1024"))
+
+# ==================== BOUNDED STORES ====================
+
 # In-memory user store (replace with PostgreSQL in production)
-users_db = {}
+users_db = BoundedStore("users", int(USERS_STORE_MEMORY_MB * 1024 * 1024), STORE_SPILL_DIR)
+
+# User id -> email, since users_db is keyed by email
+user_emails: dict = {}
+
+def find_user(user_id: str) -> Optional[dict]:
+    email = user_emails.get(user_id)
+    return users_db.get(email) if email else None
 
 security = HTTPBearer()
 
@@ -52,6 +284,9 @@ class UserRegister(BaseModel):
     email: EmailStr
     password: str
     role: str = "student"
+    # Set by teachers in roster imports; self-registration joins a class with an invite
+    class_id: Optional[str] = None
+    invite: Optional[str] = None
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -83,6 +318,8 @@ class ChatResponse(BaseModel):
 class CodeExecuteRequest(BaseModel):
     code: str
     user_id: Optional[str] = None
+    # When set, the code runs in the user's long-lived kernel for this session
+    session_id: Optional[str] = None
 
 class CodeExecuteResponse(BaseModel):
     output: str
@@ -98,7 +335,7 @@ class ExplainRequest(BaseModel):
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
-def create_token(user_id: str, email: str, role: str) -> str:
+def create_token(user_id: str, email: str, role: str, class_id: Optional[str] = None) -> str:
     expire = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
     payload = {
         "sub": user_id,
@@ -106,8 +343,24 @@ def create_token(user_id: str, email: str, role: str) -> str:
         "role": role,
         "exp": expire
     }
+    if class_id:
+        payload["class_id"] = class_id
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
+def create_class_invite(class_id: str) -> str:
+    expire = datetime.utcnow() + timedelta(hours=CLASS_INVITE_EXPIRE_HOURS)
+    return jwt.encode({"class_id": class_id, "purpose": "class_invite", "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+
+def read_class_invite(invite: str) -> str:
+    """The class an invite is for; 403 if it is invalid or expired"""
+    try:
+        payload = jwt.decode(invite, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=403, detail="Invalid or expired class invite")
+    if payload.get("purpose") != "class_invite" or not payload.get("class_id"):
+        raise HTTPException(status_code=403, detail="Invalid or expired class invite")
+    return payload["class_id"]
+
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
@@ -117,12 +370,153 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# ==================== CONDITIONAL REQUESTS ====================
+
+# Version counters live in this process and restart with it, so validators
+# also carry a per-boot epoch: a tag from an earlier boot or another replica
+# never matches
+ETAG_EPOCH = os.urandom(6).hex()
+
+def make_etag(kind: str, record_id: str, version: int) -> str:
+    """Strong validator derived from a record's version counter"""
+    return f'"{kind}-{record_id}-{ETAG_EPOCH}-v{version}"'
+
+def without_version(record: dict) -> dict:
+    """A stored record as served: its version counter only goes out in the ETag"""
+    return {key: value for key, value in record.items() if key != "version"}
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag[2:] == etag if tag.startswith("W/") else tag == etag for tag in candidates)
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+# ==================== IDEMPOTENCY KEYS ====================
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+class IdempotencyKeyConflict(Exception):
+    """Raised when an Idempotency-Key is reused with a different request body"""
+
+class IdempotentAttemptFailed(Exception):
+    """Handed to duplicates waiting on an original request that did not complete"""
+
+class IdempotencyStore:
+    """
+    Remembers the first result for each idempotency key for a limited time
+    (bounded by entry count, oldest evicted first) and replays it for
+    duplicates. A duplicate that arrives while the original is still running
+    waits for it; if the original fails, nothing is stored and the duplicate
+    runs the work itself.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600.0, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, fingerprint, result)
+        self.in_flight: dict = {}  # key -> (fingerprint, future)
+        self.stats = {"stored": 0, "replayed": 0, "joined_in_flight": 0, "conflicts": 0, "evicted": 0}
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        while self.entries:
+            key, (expires_at, _, _) = next(iter(self.entries.items()))
+            if expires_at > now:
+                break
+            self.entries.popitem(last=False)
+
+    def _check(self, key: str, expected: str, fingerprint: str):
+        if expected != fingerprint:
+            self.stats["conflicts"] += 1
+            raise IdempotencyKeyConflict(f"{IDEMPOTENCY_HEADER} '{key.rsplit(':', 1)[-1]}' was used with a different request")
+
+    async def run(self, key: str, fingerprint: str, handler) -> tuple:
+        """Return (result, replayed) for the request identified by key"""
+        while True:
+            self._purge_expired()
+
+            entry = self.entries.get(key)
+            if entry is not None:
+                self._check(key, entry[1], fingerprint)
+                self.stats["replayed"] += 1
+                return copy.deepcopy(entry[2]), True
+
+            pending = self.in_flight.get(key)
+            if pending is None:
+                break
+
+            self._check(key, pending[0], fingerprint)
+            self.stats["joined_in_flight"] += 1
+            try:
+                result = await asyncio.shield(pending[1])
+                return copy.deepcopy(result), True
+            except IdempotentAttemptFailed:
+                continue
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = (fingerprint, future)
+        try:
+            result = await handler()
+        except BaseException:
+            del self.in_flight[key]
+            future.set_exception(IdempotentAttemptFailed())
+            future.exception()  # mark retrieved when nobody is waiting
+            raise
+
+        del self.in_flight[key]
+        # Store a copy so later changes to live documents don't alter the replay
+        stored = copy.deepcopy(result)
+        self.entries[key] = (time.monotonic() + self.ttl_seconds, fingerprint, stored)
+        self.stats["stored"] += 1
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evicted"] += 1
+        future.set_result(stored)
+        return result, False
+
+    def snapshot(self) -> dict:
+        return {"keys": len(self.entries), "in_flight": len(self.in_flight), **self.stats}
+
+idempotency_store = IdempotencyStore(ttl_seconds=IDEMPOTENCY_TTL_SECONDS, max_entries=IDEMPOTENCY_MAX_KEYS)
+
+def request_fingerprint(body) -> str:
+    if isinstance(body, BaseModel):
+        body = body.model_dump()
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+
+async def run_idempotent(request: Request, response: Response, payload: dict, body, handler):
+    """Run handler once per Idempotency-Key, replaying the stored result for duplicates"""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        return await handler()
+    if len(key) > 255:
+        raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} must be at most 255 characters")
+
+    scoped_key = f"{payload['sub']}:{request.url.path}:{key}"
+    result, replayed = await idempotency_store.run(scoped_key, request_fingerprint(body), handler)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+@app.exception_handler(IdempotencyKeyConflict)
+async def idempotency_conflict_handler(request: Request, exc: IdempotencyKeyConflict):
+    return JSONResponse(status_code=422, content={"detail": str(exc)})
+
 # ==================== AUTH ENDPOINTS ====================
 
 @app.post("/auth/register", response_model=AuthResponse)
 async def register(data: UserRegister):
     if data.email in users_db:
         raise HTTPException(status_code=400, detail="Email already registered")
+    if data.class_id is not None:
+        raise HTTPException(status_code=403, detail="Join a class with an invite from its teacher")
+    class_id = read_class_invite(data.invite) if data.invite else None
 
     user_id = hashlib.md5(data.email.encode()).hexdigest()[:12]
     hashed_password = hash_password(data.password)
@@ -133,10 +527,13 @@ async def register(data: UserRegister):
         "email": data.email,
         "password": hashed_password,
         "role": data.role,
-        "created_at": datetime.utcnow().isoformat()
+        "class_id": class_id,
+        "created_at": datetime.utcnow().isoformat(),
+        "version": 1
     }
+    user_emails[user_id] = data.email
 
-    token = create_token(user_id, data.email, data.role)
+    token = create_token(user_id, data.email, data.role, class_id)
 
     return AuthResponse(
         token=token,
@@ -155,7 +552,7 @@ async def login(data: UserLogin):
     if not user or user["password"] != hash_password(data.password):
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
-    token = create_token(user["id"], user["email"], user["role"])
+    token = create_token(user["id"], user["email"], user["role"], user.get("class_id"))
 
     return AuthResponse(
         token=token,
@@ -168,11 +565,16 @@ async def login(data: UserLogin):
     )
 
 @app.get("/auth/me", response_model=UserResponse)
-async def get_current_user(payload: dict = Depends(verify_token)):
+async def get_current_user(request: Request, response: Response, payload: dict = Depends(verify_token)):
     user = users_db.get(payload["email"])
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
+    etag = make_etag("user", user["id"], user.get("version", 1))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+
     return UserResponse(
         id=user["id"],
         name=user["name"],
@@ -180,36 +582,591 @@ async def get_current_user(payload: dict = Depends(verify_token)):
         role=user["role"]
     )
 
-# ==================== AI CHAT ENDPOINT ====================
+@app.post("/auth/invites")
+async def create_invite(payload: dict = Depends(verify_token)):
+    """Invite for students to join the teacher's class, passed as `invite` to /auth/register"""
+    if payload.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can invite students")
+    if not payload.get("class_id"):
+        raise HTTPException(status_code=422, detail="Your account has no class to invite students to")
+    return {
+        "class_id": payload["class_id"],
+        "invite": create_class_invite(payload["class_id"]),
+        "expires_in_hours": CLASS_INVITE_EXPIRE_HOURS,
+    }
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat_with_ai(data: ChatRequest, payload: dict = Depends(verify_token)):
+# ==================== BULK ROSTER IMPORT ====================
+
+def hash_passwords(passwords: List[str]) -> List[str]:
     """
-    Chat with AI tutor using OpenRouter API
+    Hash a batch of passwords inline: one SHA-256 is about a microsecond, far
+    less than handing the batch to a worker would cost
     """
-    if not OPENROUTER_API_KEY:
-        # Fallback to simulated response if no API key
-        return ChatResponse(
-            response=get_simulated_response(data.messages[-1].content if data.messages else ""),
-            agent_used="simulated"
-        )
+    return [hash_password(password) for password in passwords]
+
+async def iter_body_lines(request: Request):
+    """Yield lines of the request body as it arrives, without buffering all of it"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+async def iter_roster_rows(request: Request, fmt: str):
+    """Yield (row_number, record) from a CSV (header row first) or NDJSON roster; record is None if unparseable"""
+    header = None
+    row = 0
+    async for line in iter_body_lines(request):
+        if not line.strip():
+            continue
+        if fmt == "csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [column.strip().lower() for column in values]
+                continue
+            row += 1
+            yield row, dict(zip(header, (value.strip() for value in values)))
+        else:
+            row += 1
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = None
+            yield row, record if isinstance(record, dict) else None
+
+def write_roster_batch(entries: List[tuple], hashes: List[str]) -> List[dict]:
+    """Insert a hashed batch into the user store and return one result per row"""
+    results = []
+    created_at = datetime.utcnow().isoformat()
+    for (row, data), hashed_password in zip(entries, hashes):
+        if data.email in users_db:
+            results.append({"row": row, "email": data.email, "status": "error", "detail": "Email already registered"})
+            continue
+
+        user_id = hashlib.md5(data.email.encode()).hexdigest()[:12]
+        users_db[data.email] = {
+            "id": user_id,
+            "name": data.name,
+            "email": data.email,
+            "password": hashed_password,
+            "role": data.role,
+            "class_id": data.class_id,
+            "created_at": created_at,
+            "version": 1
+        }
+        user_emails[user_id] = data.email
+        results.append({
+            "row": row,
+            "email": data.email,
+            "status": "created",
+            "user_id": user_id,
+            "token": create_token(user_id, data.email, data.role, data.class_id)
+        })
+    return results
 
+@app.post("/auth/register/bulk")
+async def register_bulk(request: Request, class_id: Optional[str] = None, payload: dict = Depends(verify_token)):
+    """
+    Register a class roster in one request (teachers only). Send CSV with a
+    header row (name,email,password[,class_id]) as text/csv, or one JSON
+    object per line as NDJSON. Every row is registered as a student in the
+    teacher's own class; rows (or a class_id parameter) naming another class
+    are rejected. Results stream back as NDJSON, one line per row, followed
+    by a summary line.
+    """
+    if payload.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can import rosters")
+    teacher_class = payload.get("class_id")
+    if not teacher_class:
+        raise HTTPException(status_code=422, detail="Your account has no class to import students into")
+    if class_id is not None and class_id != teacher_class:
+        raise HTTPException(status_code=403, detail="Rosters can only be imported into your own class")
+
+    fmt = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+
+    # Parse and validate while the body streams in; hashing and writes happen in batches below
+    rejected: List[dict] = []
+    batches: List[List[tuple]] = [[]]
+    rows = 0
+    async for row, record in iter_roster_rows(request, fmt):
+        rows += 1
+        if rows > ROSTER_MAX_ROWS:
+            raise HTTPException(status_code=413, detail=f"Rosters are limited to {ROSTER_MAX_ROWS} rows")
+        if record is None:
+            rejected.append({"row": row, "status": "error", "detail": "Row is not a JSON object"})
+            continue
+        if record.get("class_id") not in (None, "", teacher_class):
+            rejected.append({"row": row, "email": record.get("email"), "status": "error",
+                             "detail": "class_id: rows can only join your own class"})
+            continue
+        try:
+            fields = {k: v for k, v in record.items() if v != ""}
+            data = UserRegister(**{**fields, "class_id": teacher_class, "role": "student"})
+        except ValidationError as e:
+            rejected.append({"row": row, "email": record.get("email"), "status": "error",
+                             "detail": "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())})
+            continue
+        if len(batches[-1]) >= ROSTER_BATCH_SIZE:
+            batches.append([])
+        batches[-1].append((row, data))
+    batches = [batch for batch in batches if batch]
+
+    async def results():
+        created = 0
+        for result in rejected:
+            yield format_ndjson_event(result)
+
+        async with work_scheduler.slot(tenant_for(payload), "batch", cost=max(1, len(batches))):
+            for batch in batches:
+                for result in write_roster_batch(batch, hash_passwords([data.password for _, data in batch])):
+                    created += result["status"] == "created"
+                    yield format_ndjson_event(result)
+
+        yield format_ndjson_event({"event": "summary", "rows": rows, "created": created, "failed": rows - created})
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+# ==================== REQUEST DEADLINES ====================
+
+class DeadlineExceeded(Exception):
+    """Raised when the caller's deadline has passed and the work should be abandoned"""
+
+# Absolute time.monotonic() deadline of the request being handled
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+def parse_timeout_header(value: Optional[str]) -> float:
+    """Read the caller's remaining budget from the deadline header, in seconds"""
+    if value is None:
+        return DEFAULT_REQUEST_TIMEOUT_SECONDS
     try:
-        async with httpx.AsyncClient() as client:
-            # Build system prompt for Python tutor
-            system_prompt = """You are a friendly and knowledgeable Python programming tutor.
-Your goal is to help students learn Python effectively.
-- Explain concepts clearly with examples
-- When students share code, provide constructive feedback
-- If they have errors, help them understand why and how to fix them
-- Encourage good coding practices
-- Keep responses concise but informative
-- Use code blocks for code examples"""
+        budget = int(value) / 1000
+    except ValueError:
+        return DEFAULT_REQUEST_TIMEOUT_SECONDS
+    return max(0.0, min(budget, MAX_REQUEST_TIMEOUT_SECONDS))
+
+def remaining_seconds() -> Optional[float]:
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+def timeout_for(limit: float) -> float:
+    """
+    Size a downstream timeout to the smaller of its own limit and the time
+    left before the request deadline
+    """
+    remaining = remaining_seconds()
+    if remaining is None:
+        return limit
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(limit, remaining)
+
+def deadline_headers() -> dict:
+    """Headers carrying the remaining budget to the next hop"""
+    remaining = remaining_seconds()
+    if remaining is None:
+        return {}
+    return {DEADLINE_HEADER: str(max(0, int(remaining * 1000)))}
+
+@app.middleware("http")
+async def enforce_deadline(request: Request, call_next):
+    budget = parse_timeout_header(request.headers.get(DEADLINE_HEADER))
+    token = request_deadline.set(time.monotonic() + budget)
+    try:
+        return await asyncio.wait_for(call_next(request), timeout=budget)
+    except asyncio.TimeoutError:
+        return JSONResponse(status_code=504, content={"detail": "Request deadline exceeded"})
+    finally:
+        request_deadline.reset(token)
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+# ==================== FAIR WORK SCHEDULER ====================
+
+class QueueFullError(Exception):
+    """Raised when a tenant already has too much work waiting"""
+
+class FairScheduler:
+    """
+    Admits expensive work into a fixed number of slots. Waiting work is kept
+    in strict-priority lanes (interactive before batch), and within a lane
+    tenants are served by start-time fair queueing: each request is tagged
+    with a virtual start time that advances by cost / weight per tenant, so a
+    busy class cannot crowd out the others.
+    """
+
+    LANES = ("interactive", "batch")
+
+    def __init__(self, slots: int = 32, weights: Optional[dict] = None, max_queued_per_tenant: int = 64):
+        for tenant, weight in (weights or {}).items():
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)) or not weight > 0:
+                raise ValueError(f"Weight for tenant {tenant!r} must be a positive number, got {weight!r}")
+        self.slots = slots
+        self.weights = weights or {}
+        self.max_queued_per_tenant = max_queued_per_tenant
+
+        self.in_use = 0
+        self.virtual_time = 0.0
+        self.last_finish: dict = {}
+        self.queues = {lane: [] for lane in self.LANES}
+        self.sequence = itertools.count()
+        self.tenants: dict = {}
+
+    def _tenant_stats(self, tenant: str) -> dict:
+        if tenant not in self.tenants:
+            self.tenants[tenant] = {"queued": 0, "running": 0, "served": 0, "rejected": 0,
+                                    "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+        return self.tenants[tenant]
+
+    def _tag(self, tenant: str, cost: float) -> float:
+        start = max(self.virtual_time, self.last_finish.get(tenant, 0.0))
+        self.last_finish[tenant] = start + cost / self.weights.get(tenant, 1.0)
+        return start
+
+    def _has_waiting(self) -> bool:
+        return any(self.queues[lane] for lane in self.LANES)
+
+    def _dispatch(self):
+        while self.in_use < self.slots:
+            lane = next((lane for lane in self.LANES if self.queues[lane]), None)
+            if lane is None:
+                return
+            start_tag, _, tenant, waiter = heapq.heappop(self.queues[lane])
+            self._tenant_stats(tenant)["queued"] -= 1
+            if waiter.done():
+                continue  # caller gave up while waiting
+            self.virtual_time = max(self.virtual_time, start_tag)
+            self.in_use += 1
+            waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, tenant: str, lane: str = "interactive", cost: float = 1.0):
+        stats = self._tenant_stats(tenant)
+        start_time = time.monotonic()
+
+        if self.in_use < self.slots and not self._has_waiting():
+            self.virtual_time = max(self.virtual_time, self._tag(tenant, cost))
+            self.in_use += 1
+        else:
+            if stats["queued"] >= self.max_queued_per_tenant:
+                stats["rejected"] += 1
+                raise QueueFullError(f"Too much work queued for '{tenant}'")
+
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.queues[lane], (self._tag(tenant, cost), next(self.sequence), tenant, waiter))
+            stats["queued"] += 1
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.in_use -= 1
+                    self._dispatch()
+                raise
+
+        waited_ms = (time.monotonic() - start_time) * 1000
+        stats["total_wait_ms"] += waited_ms
+        stats["max_wait_ms"] = max(stats["max_wait_ms"], waited_ms)
+        stats["running"] += 1
+        try:
+            yield
+        finally:
+            stats["running"] -= 1
+            stats["served"] += 1
+            self.in_use -= 1
+            self._dispatch()
+
+    def snapshot(self) -> dict:
+        return {
+            "slots": self.slots,
+            "in_use": self.in_use,
+            "queued": {lane: len(self.queues[lane]) for lane in self.LANES},
+            "tenants": {
+                tenant: {**stats, "avg_wait_ms": stats["total_wait_ms"] / stats["served"] if stats["served"] else 0.0}
+                for tenant, stats in self.tenants.items()
+            },
+        }
+
+work_scheduler = FairScheduler(
+    slots=WORK_SLOTS,
+    weights=WORK_TENANT_WEIGHTS,
+    max_queued_per_tenant=WORK_MAX_QUEUED_PER_TENANT,
+)
+
+def tenant_for(payload: dict) -> str:
+    """Scheduling tenant for a caller: their class, else their teacher, else themselves"""
+    return payload.get("class_id") or payload.get("teacher_id") or payload["sub"]
+
+def lane_for(payload: dict) -> str:
+    """Teacher-triggered work runs behind students' interactive requests"""
+    return "batch" if payload.get("role") == "teacher" else "interactive"
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+# ==================== UPSTREAM LLM CLIENT ====================
+
+class UpstreamError(Exception):
+    """Raised when OpenRouter answers with a non-success status"""
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker rejects a call without contacting upstream"""
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open circuit breaker over a sliding window of recent calls.
+    Trips when either the failure rate or the slow-call rate crosses its threshold,
+    stays open for a cool-down period, then lets a few probe calls through.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        window_size: int = 20,
+        min_calls: int = 5,
+        failure_rate_threshold: float = 0.5,
+        slow_call_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 3,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = self.CLOSED
+        self.outcomes = deque(maxlen=window_size)  # (failed, slow) per call
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        self.rejected_calls = 0
+        self.times_opened = 0
+
+    def allow_request(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                self.rejected_calls += 1
+                return False
+            self.state = self.HALF_OPEN
+            self.probes_in_flight = 0
+            self.probe_successes = 0
+
+        if self.state == self.HALF_OPEN:
+            if self.probes_in_flight >= self.half_open_probes:
+                self.rejected_calls += 1
+                return False
+            self.probes_in_flight += 1
+
+        return True
+
+    def record(self, duration: float, failed: bool):
+        slow = duration >= self.slow_call_seconds
+
+        if self.state == self.HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            if failed or slow:
+                self._trip()
+            else:
+                self.probe_successes += 1
+                if self.probe_successes >= self.half_open_probes:
+                    self.state = self.CLOSED
+                    self.outcomes.clear()
+            return
+
+        if self.state == self.OPEN:
+            # Late result of a call that started before the breaker tripped
+            return
+
+        self.outcomes.append((failed, slow))
+        if len(self.outcomes) < self.min_calls:
+            return
+
+        failure_rate = sum(1 for f, _ in self.outcomes if f) / len(self.outcomes)
+        slow_rate = sum(1 for _, sl in self.outcomes if sl) / len(self.outcomes)
+        if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_call_rate_threshold:
+            self._trip()
+
+    def release(self):
+        """Give back a permit for a call that ended without a verdict"""
+        if self.state == self.HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+
+    def _trip(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        self.outcomes.clear()
+
+    def snapshot(self) -> dict:
+        calls = len(self.outcomes)
+        return {
+            "name": self.name,
+            "state": self.state,
+            "window_calls": calls,
+            "failure_rate": sum(1 for f, _ in self.outcomes if f) / calls if calls else 0.0,
+            "slow_call_rate": sum(1 for _, sl in self.outcomes if sl) / calls if calls else 0.0,
+            "rejected_calls": self.rejected_calls,
+            "times_opened": self.times_opened,
+        }
+
+openrouter_breaker = CircuitBreaker(
+    "openrouter",
+    window_size=CIRCUIT_WINDOW_SIZE,
+    min_calls=CIRCUIT_MIN_CALLS,
+    failure_rate_threshold=CIRCUIT_FAILURE_RATE,
+    slow_call_rate_threshold=CIRCUIT_SLOW_CALL_RATE,
+    slow_call_seconds=CIRCUIT_SLOW_CALL_SECONDS,
+    open_seconds=CIRCUIT_OPEN_SECONDS,
+    half_open_probes=CIRCUIT_HALF_OPEN_PROBES,
+)
+
+class ConcurrencyLimitExceeded(Exception):
+    """Raised when a call waited too long for an upstream concurrency slot"""
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD limit on in-flight upstream calls. Each fast success raises the limit
+    by about one per window of calls; a 429, 5xx or timeout halves it (at most
+    once per cool-down). Calls over the limit wait in a FIFO queue for a
+    bounded time instead of failing straight away.
+    """
+
+    def __init__(self, initial_limit: int = 10, min_limit: int = 1, max_limit: int = 100,
+                 latency_target: float = 10.0, backoff_ratio: float = 0.5,
+                 decrease_cooldown: float = 1.0, max_queue: int = 200):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.decrease_cooldown = decrease_cooldown
+        self.max_queue = max_queue
+
+        self.in_flight = 0
+        self.waiters: deque = deque()
+        self.last_decrease = 0.0
+        self.stats = {"acquired": 0, "queued": 0, "rejected": 0, "total_queue_ms": 0.0,
+                      "max_queue_ms": 0.0, "increases": 0, "decreases": 0}
+
+    async def acquire(self, timeout: float) -> float:
+        """Wait for a slot and return the time spent queueing, in seconds"""
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            self.stats["acquired"] += 1
+            return 0.0
+
+        if len(self.waiters) >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise ConcurrencyLimitExceeded("Upstream queue is full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.stats["queued"] += 1
+        start_time = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, timeout=timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected"] += 1
+            raise ConcurrencyLimitExceeded(f"No upstream slot within {timeout:.1f}s")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled; pass it on
+                self.release(0.0, overloaded=False, succeeded=False)
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+        queued = time.monotonic() - start_time
+        self.stats["acquired"] += 1
+        self.stats["total_queue_ms"] += queued * 1000
+        self.stats["max_queue_ms"] = max(self.stats["max_queue_ms"], queued * 1000)
+        return queued
+
+    def release(self, latency: float, overloaded: bool, succeeded: bool):
+        self.in_flight = max(0, self.in_flight - 1)
+
+        now = time.monotonic()
+        if overloaded:
+            if now - self.last_decrease >= self.decrease_cooldown:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                self.last_decrease = now
+                self.stats["decreases"] += 1
+        elif succeeded and latency <= self.latency_target and self.in_flight + 1 >= int(self.limit):
+            # Only grow when the current limit is actually being used
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.stats["increases"] += 1
+
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def snapshot(self) -> dict:
+        queued = self.stats["queued"]
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queue_length": len(self.waiters),
+            "avg_queue_ms": self.stats["total_queue_ms"] / queued if queued else 0.0,
+            **self.stats,
+        }
+
+llm_limiter = AdaptiveConcurrencyLimiter(
+    initial_limit=LLM_LIMITER_INITIAL,
+    min_limit=LLM_LIMITER_MIN,
+    max_limit=LLM_LIMITER_MAX,
+    latency_target=LLM_LIMITER_LATENCY_TARGET_SECONDS,
+)
+
+async def call_openrouter(messages: List[dict], max_tokens: int, temperature: Optional[float] = None,
+                          model: Optional[str] = None) -> str:
+    """
+    Send a chat completion request to OpenRouter through the circuit breaker
+    and the adaptive concurrency limiter. Returns the assistant message content.
+    """
+    timeout = timeout_for(LLM_TIMEOUT_SECONDS)
+    if not openrouter_breaker.allow_request():
+        raise CircuitOpenError(f"Circuit '{openrouter_breaker.name}' is open")
 
-            messages = [{"role": "system", "content": system_prompt}]
-            for msg in data.messages:
-                messages.append({"role": msg.role, "content": msg.content})
+    try:
+        queued_seconds = await llm_limiter.acquire(timeout=min(LLM_LIMITER_MAX_QUEUE_SECONDS, timeout))
+    except BaseException:
+        openrouter_breaker.release()
+        raise
+    timeout = max(0.001, timeout - queued_seconds)
+
+    body = {
+        "model": model or LLM_MODEL,
+        "messages": messages,
+        "max_tokens": max_tokens
+    }
+    if temperature is not None:
+        body["temperature"] = temperature
 
+    start_time = time.monotonic()
+    failed: Optional[bool] = True
+    # Only rate limiting, server errors and upstream timeouts shrink the concurrency limit
+    overloaded = False
+    try:
+        async with httpx.AsyncClient() as client:
             response = await client.post(
                 f"{OPENROUTER_BASE_URL}/chat/completions",
                 headers={
@@ -218,31 +1175,400 @@ Your goal is to help students learn Python effectively.
                     "HTTP-Referer": "http://localhost:3000",
                     "X-Title": "LearnFlow Python Tutor"
                 },
-                json={
-                    "model": LLM_MODEL,
-                    "messages": messages,
-                    "max_tokens": 1000,
-                    "temperature": 0.7
-                },
-                timeout=30.0
+                json=body,
+                timeout=timeout
             )
 
-            if response.status_code == 200:
-                result = response.json()
-                ai_response = result["choices"][0]["message"]["content"]
-                return ChatResponse(
-                    response=ai_response,
-                    agent_used="openrouter"
-                )
-            else:
-                # Fallback to simulated
-                return ChatResponse(
-                    response=get_simulated_response(data.messages[-1].content if data.messages else ""),
-                    agent_used="simulated-fallback"
-                )
-    except Exception as e:
+        if response.status_code != 200:
+            # Client errors other than rate limiting say nothing about upstream health
+            failed = overloaded = response.status_code >= 500 or response.status_code == 429
+            raise UpstreamError(f"OpenRouter returned {response.status_code}")
+
+        content = response.json()["choices"][0]["message"]["content"]
+        failed = False
+        return content
+    except asyncio.CancelledError:
+        # The caller went away (client disconnect, shutdown): no verdict on upstream health
+        openrouter_breaker.release()
+        failed = None
+        raise
+    except httpx.TimeoutException:
+        if timeout < LLM_TIMEOUT_SECONDS:
+            # Cut short by the caller's deadline, not a verdict on upstream health
+            openrouter_breaker.release()
+            failed = None
+            raise DeadlineExceeded("Request deadline exceeded while waiting for OpenRouter")
+        overloaded = True
+        raise
+    finally:
+        latency = time.monotonic() - start_time
+        if failed is not None:
+            openrouter_breaker.record(latency, failed)
+        llm_limiter.release(latency, overloaded=overloaded, succeeded=failed is False)
+
+# ==================== MODEL ROUTING ====================
+
+CODE_PATTERN = re.compile(r"```|^\s*(def|class|for|while|if|import|from|print)\b|Traceback|\w+Error\b", re.MULTILINE)
+DEBUG_KEYWORDS = ("error", "bug", "fix", "traceback", "exception", "crash", "not working", "doesn't work", "broken", "wrong output")
+DEPTH_KEYWORDS = ("in detail", "in depth", "step by step", "walk me through", "difference between", "compare",
+                  "pros and cons", "when should", "best practice", "under the hood", "why does", "how does")
+
+class ModelRouter:
+    """
+    Picks a model tier and token budget for each LLM call from a cheap
+    heuristic classification of the request, and keeps latency and
+    estimated cost statistics per tier
+    """
+
+    CATEGORIES = ("short_factual", "code_debugging", "long_explanation")
+
+    def __init__(self, tiers: dict, policy: dict):
+        self.tiers = tiers
+        self.policy = policy
+        self.category_counts = {(route, category): 0 for route in policy for category in self.CATEGORIES}
+        self.tier_stats = {
+            tier: {"requests": 0, "failures": 0, "total_latency_ms": 0.0, "max_latency_ms": 0.0,
+                   "estimated_tokens": 0, "estimated_cost": 0.0}
+            for tier in tiers
+        }
+
+    def classify(self, text: str, turns: int = 1) -> str:
+        lowered = text.lower()
+        if CODE_PATTERN.search(text) or any(keyword in lowered for keyword in DEBUG_KEYWORDS):
+            return "code_debugging"
+        if len(text) > 280 or turns > 4 or text.count("?") > 1 or any(keyword in lowered for keyword in DEPTH_KEYWORDS):
+            return "long_explanation"
+        return "short_factual"
+
+    def route(self, route: str, text: str, turns: int = 1, category: Optional[str] = None) -> dict:
+        category = category or self.classify(text, turns)
+        rule = self.policy.get(route, {}).get(category, {"tier": "deep"})
+        tier = rule["tier"]
+        self.category_counts[(route, category)] = self.category_counts.get((route, category), 0) + 1
+        return {
+            "route": route,
+            "category": category,
+            "tier": tier,
+            "model": self.tiers[tier]["model"],
+            "max_tokens": rule.get("max_tokens", self.tiers[tier]["max_tokens"]),
+        }
+
+    async def complete(self, decision: dict, messages: List[dict], temperature: Optional[float] = None) -> str:
+        start_time = time.monotonic()
+        content = None
+        try:
+            content = await call_openrouter(
+                messages,
+                max_tokens=decision["max_tokens"],
+                temperature=temperature,
+                model=decision["model"]
+            )
+            return content
+        finally:
+            prompt_chars = sum(len(m["content"]) for m in messages)
+            self._record(decision["tier"], (time.monotonic() - start_time) * 1000, prompt_chars, content)
+
+    def _record(self, tier: str, latency_ms: float, prompt_chars: int, content: Optional[str]):
+        stats = self.tier_stats[tier]
+        stats["requests"] += 1
+        if content is None:
+            stats["failures"] += 1
+            return
+        stats["total_latency_ms"] += latency_ms
+        stats["max_latency_ms"] = max(stats["max_latency_ms"], latency_ms)
+        # Roughly four characters per token for English text and code
+        tokens = (prompt_chars + len(content)) // 4
+        stats["estimated_tokens"] += tokens
+        stats["estimated_cost"] += tokens / 1000 * self.tiers[tier]["cost_per_1k_tokens"]
+
+    def snapshot(self) -> dict:
+        tiers = {}
+        for tier, stats in self.tier_stats.items():
+            succeeded = stats["requests"] - stats["failures"]
+            tiers[tier] = {
+                "model": self.tiers[tier]["model"],
+                "avg_latency_ms": stats["total_latency_ms"] / succeeded if succeeded else 0.0,
+                **stats,
+            }
+        categories = {f"{route}.{category}": count for (route, category), count in self.category_counts.items()}
+        return {"tiers": tiers, "categories": categories}
+
+model_router = ModelRouter(MODEL_TIERS, MODEL_ROUTING_POLICY)
+
+# ==================== SEMANTIC ANSWER CACHE ====================
+
+# Question filler words that carry no topic; Python keywords such as "for" are kept
+QUESTION_STOP_WORDS = {
+    "a", "an", "the", "how", "do", "doe", "does", "did", "what", "whats", "is", "are", "was",
+    "explain", "me", "please", "can", "you", "i", "in", "python", "work", "about", "tell",
+    "of", "to", "show", "use", "using", "my", "why", "when", "where", "which", "should",
+    "could", "would", "help", "understand", "mean", "meant", "some", "example",
+    "explanation", "explained",
+}
+
+# Words naming which form of a construct is meant ("for loop", "if statement");
+# a question can leave one out and still ask the same thing
+VARIANT_WORDS = {"for", "while", "if", "try", "with"}
+
+def same_question(first: tuple, second: tuple) -> bool:
+    """
+    Whether two questions' content words can ask the same thing: the same
+    words in the same order, except that one side may add a variant word
+    ("loops" vs "for loops"). Swapped or substituted words ("string to int"
+    vs "int to string", "append vs extend" vs "append vs insert") never do.
+    """
+    if first == second:
+        return True
+    shorter, longer = sorted((first, second), key=len)
+    if len(longer) != len(shorter) + 1:
+        return False
+    return any(word in VARIANT_WORDS and longer[:i] + longer[i + 1:] == shorter for i, word in enumerate(longer))
+
+class HashedNgramVectorizer:
+    """
+    Embeds short questions without a vocabulary: word, word-bigram and
+    character n-gram features are hashed with CRC32 into a fixed number of
+    signed buckets and the result is L2-normalised
+    """
+
+    def __init__(self, dim: int = 1024, char_ngrams: tuple = (3, 4, 5)):
+        self.dim = dim
+        self.char_ngrams = char_ngrams
+
+    def content_words(self, text: str) -> tuple:
+        """The question's words, plural-folded, without question stop words"""
+        words = [self._singular(w) for w in re.findall(r"[a-z0-9_]+", text.lower())]
+        return tuple(w for w in words if w not in QUESTION_STOP_WORDS) or tuple(words)
+
+    def features(self, text: str) -> List[str]:
+        content = self.content_words(text)
+
+        features = []
+        for word in content:
+            features.append("w:" + word)
+            padded = f" {word} "
+            for n in self.char_ngrams:
+                features.extend("c:" + padded[i:i + n] for i in range(len(padded) - n + 1))
+        for first, second in zip(content, content[1:]):
+            features.append(f"b:{first} {second}")
+        return features
+
+    @staticmethod
+    def _singular(word: str) -> str:
+        """Cheap plural folding so "loops" and "loop" share features"""
+        if len(word) > 4 and word.endswith("ies"):
+            return word[:-3] + "y"
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            return word[:-1]
+        return word
+
+    def transform(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self.features(text):
+            h = zlib.crc32(feature.encode())
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+class SemanticCache:
+    """
+    Fixed-capacity answer cache keyed by question meaning. Vectors live in one
+    preallocated NumPy matrix used as a ring buffer. Lookups in large caches go
+    through random-hyperplane LSH tables, probing each bucket and its Hamming
+    neighbours, and rank only those candidates by exact cosine similarity.
+    Similar-looking questions can ask opposite things ("string to int" vs
+    "int to string"), so a hit above the threshold must also pass
+    same_question on the content words.
+    """
+
+    def __init__(self, vectorizer: HashedNgramVectorizer, capacity: int = 2000,
+                 threshold: float = 0.7, tables: int = 8, bits: int = 10,
+                 brute_force_limit: int = 1024, seed: int = 7):
+        self.vectorizer = vectorizer
+        self.capacity = capacity
+        self.threshold = threshold
+        self.tables = tables
+        self.bits = bits
+        self.brute_force_limit = brute_force_limit
+
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((tables * bits, vectorizer.dim)).astype(np.float32)
+        self.bit_weights = 1 << np.arange(bits)
+        self.buckets: List[dict] = [{} for _ in range(tables)]
+
+        self.matrix = np.zeros((capacity, vectorizer.dim), dtype=np.float32)
+        self.answers: List[Optional[str]] = [None] * capacity
+        self.questions: List[Optional[str]] = [None] * capacity
+        self.contents: List[Optional[tuple]] = [None] * capacity
+        self.slot_codes: List[Optional[List[int]]] = [None] * capacity
+        self.size = 0
+        self.next_slot = 0
+        self.stats = {"hits": 0, "misses": 0, "inserts": 0, "evictions": 0, "candidates_scanned": 0}
+
+    def _codes(self, vector: np.ndarray) -> List[int]:
+        signs = (self.planes @ vector > 0).reshape(self.tables, self.bits)
+        return [int(code) for code in signs @ self.bit_weights]
+
+    def _candidates(self, codes: List[int]) -> np.ndarray:
+        slots = set()
+        for table, code in enumerate(codes):
+            bucket = self.buckets[table]
+            slots.update(bucket.get(code, ()))
+            for bit in range(self.bits):
+                slots.update(bucket.get(code ^ (1 << bit), ()))
+        return np.fromiter(slots, dtype=np.int64, count=len(slots))
+
+    def lookup(self, question: str) -> Optional[tuple]:
+        """Return (answer, similarity) of the closest cached question above the threshold"""
+        if self.size == 0:
+            self.stats["misses"] += 1
+            return None
+
+        vector = self.vectorizer.transform(question)
+        if self.size <= self.brute_force_limit:
+            candidates = np.arange(self.size)
+        else:
+            candidates = self._candidates(self._codes(vector))
+        self.stats["candidates_scanned"] += len(candidates)
+
+        if len(candidates) == 0:
+            self.stats["misses"] += 1
+            return None
+
+        scores = self.matrix[candidates] @ vector
+        content = self.vectorizer.content_words(question)
+        for best in np.argsort(-scores):
+            if scores[best] < self.threshold:
+                break
+            slot = int(candidates[best])
+            if same_question(self.contents[slot], content):
+                self.stats["hits"] += 1
+                return self.answers[slot], float(scores[best])
+
+        self.stats["misses"] += 1
+        return None
+
+    def insert(self, question: str, answer: str):
+        vector = self.vectorizer.transform(question)
+        slot = self.next_slot
+
+        old_codes = self.slot_codes[slot]
+        if old_codes is not None:
+            for table, code in enumerate(old_codes):
+                self.buckets[table][code].discard(slot)
+            self.stats["evictions"] += 1
+
+        codes = self._codes(vector)
+        for table, code in enumerate(codes):
+            self.buckets[table].setdefault(code, set()).add(slot)
+
+        self.matrix[slot] = vector
+        self.answers[slot] = answer
+        self.questions[slot] = question
+        self.contents[slot] = self.vectorizer.content_words(question)
+        self.slot_codes[slot] = codes
+        self.next_slot = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.stats["inserts"] += 1
+
+    def entries(self) -> List[tuple]:
+        """Cached (question, answer) pairs, oldest first"""
+        if self.size < self.capacity:
+            order = range(self.size)
+        else:
+            order = [(self.next_slot + i) % self.capacity for i in range(self.capacity)]
+        return [(self.questions[slot], self.answers[slot]) for slot in order]
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "enabled": SEMANTIC_CACHE_ENABLED,
+            "size": self.size,
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            **self.stats,
+        }
+
+semantic_cache = SemanticCache(
+    HashedNgramVectorizer(dim=SEMANTIC_CACHE_DIM),
+    capacity=SEMANTIC_CACHE_CAPACITY,
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+)
+
+def is_standalone_question(data: ChatRequest) -> bool:
+    """Only first-turn questions without extra context can share answers"""
+    return len(data.messages) == 1 and data.messages[0].role == "user" and not data.context
+
+# ==================== AI CHAT ENDPOINT ====================
+
+TUTOR_SYSTEM_PROMPT = """You are a friendly and knowledgeable Python programming tutor.
+Your goal is to help students learn Python effectively.
+- Explain concepts clearly with examples
+- When students share code, provide constructive feedback
+- If they have errors, help them understand why and how to fix them
+- Encourage good coding practices
+- Keep responses concise but informative
+- Use code blocks for code examples"""
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_with_ai(data: ChatRequest, payload: dict = Depends(verify_token)):
+    """
+    Chat with AI tutor using OpenRouter API
+    """
+    last_message = data.messages[-1].content if data.messages else ""
+
+    if not OPENROUTER_API_KEY:
+        # Fallback to simulated response if no API key
+        return ChatResponse(
+            response=get_simulated_response(last_message),
+            agent_used="simulated"
+        )
+
+    cacheable = SEMANTIC_CACHE_ENABLED and is_standalone_question(data)
+    if cacheable:
+        cached = semantic_cache.lookup(last_message)
+        if cached is not None:
+            return ChatResponse(
+                response=cached[0],
+                agent_used="semantic-cache"
+            )
+
+    messages = [{"role": "system", "content": TUTOR_SYSTEM_PROMPT}]
+    for msg in data.messages:
+        messages.append({"role": msg.role, "content": msg.content})
+
+    decision = model_router.route("chat", last_message, turns=len(data.messages))
+
+    try:
+        async with work_scheduler.slot(tenant_for(payload), "interactive"):
+            ai_response = await model_router.complete(decision, messages, temperature=0.7)
+        if cacheable:
+            semantic_cache.insert(last_message, ai_response)
         return ChatResponse(
-            response=get_simulated_response(data.messages[-1].content if data.messages else ""),
+            response=ai_response,
+            agent_used="openrouter"
+        )
+    except DeadlineExceeded:
+        raise
+    except CircuitOpenError:
+        return ChatResponse(
+            response=get_simulated_response(last_message),
+            agent_used="simulated-circuit-open"
+        )
+    except (ConcurrencyLimitExceeded, QueueFullError):
+        return ChatResponse(
+            response=get_simulated_response(last_message),
+            agent_used="simulated-overloaded"
+        )
+    except UpstreamError:
+        return ChatResponse(
+            response=get_simulated_response(last_message),
+            agent_used="simulated-fallback"
+        )
+    except Exception:
+        return ChatResponse(
+            response=get_simulated_response(last_message),
             agent_used="simulated-error"
         )
 
@@ -375,61 +1701,646 @@ What would you like to learn about? Try asking:
 # ==================== CODE EXECUTION ENDPOINT ====================
 
 @app.post("/execute", response_model=CodeExecuteResponse)
-async def execute_code(data: CodeExecuteRequest, payload: dict = Depends(verify_token)):
+async def execute_code(data: CodeExecuteRequest, request: Request, response: Response,
+                       payload: dict = Depends(verify_token)):
     """
-    Execute Python code in a sandboxed environment
+    Execute Python code in a sandboxed environment. Retries carrying the same
+    Idempotency-Key get the first run's result instead of running again.
     """
+    return await run_idempotent(request, response, payload, data, lambda: run_code(data, payload))
+
+async def run_code(data: CodeExecuteRequest, payload: dict) -> CodeExecuteResponse:
     import subprocess
-    import tempfile
-    import time
 
-    try:
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-            f.write(data.code)
-            temp_file = f.name
+    if data.session_id:
+        async with work_scheduler.slot(tenant_for(payload), lane_for(payload)):
+            limit = timeout_for(SANDBOX_TIMEOUT_SECONDS)
+            return await kernel_manager.execute(kernel_key(payload, data.session_id), data.code, limit)
 
-        start_time = time.time()
+    async with work_scheduler.slot(tenant_for(payload), lane_for(payload)):
+        limit = timeout_for(SANDBOX_TIMEOUT_SECONDS)
 
-        # Execute with timeout
-        result = subprocess.run(
-            ['python3', temp_file],
-            capture_output=True,
-            text=True,
-            timeout=5  # 5 second timeout
-        )
+        try:
+            # Create temporary file
+            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
+                f.write(data.code)
+                temp_file = f.name
+
+            start_time = time.time()
+
+            # Execute with timeout, off the event loop so queued work keeps moving
+            result = await asyncio.to_thread(
+                subprocess.run,
+                ['python3', temp_file],
+                capture_output=True,
+                text=True,
+                timeout=limit
+            )
 
-        execution_time = int((time.time() - start_time) * 1000)
+            execution_time = int((time.time() - start_time) * 1000)
 
-        # Cleanup
-        os.unlink(temp_file)
+            # Cleanup
+            os.unlink(temp_file)
+
+            if result.returncode == 0:
+                return CodeExecuteResponse(
+                    output=result.stdout,
+                    error=None,
+                    execution_time_ms=execution_time
+                )
+            else:
+                return CodeExecuteResponse(
+                    output=result.stdout,
+                    error=result.stderr,
+                    execution_time_ms=execution_time
+                )
 
-        if result.returncode == 0:
+        except subprocess.TimeoutExpired:
+            os.unlink(temp_file)
             return CodeExecuteResponse(
-                output=result.stdout,
-                error=None,
-                execution_time_ms=execution_time
+                output="",
+                error=f"Execution timed out ({limit:.1f} second limit)",
+                execution_time_ms=int(limit * 1000)
             )
-        else:
+        except Exception as e:
             return CodeExecuteResponse(
-                output=result.stdout,
-                error=result.stderr,
-                execution_time_ms=execution_time
+                output="",
+                error=str(e),
+                execution_time_ms=0
             )
 
-    except subprocess.TimeoutExpired:
-        os.unlink(temp_file)
-        return CodeExecuteResponse(
-            output="",
-            error="Execution timed out (5 second limit)",
-            execution_time_ms=5000
+async def _pump_stream(stream, name: str, queue: asyncio.Queue):
+    """
+    Forward chunks from a subprocess pipe into the shared output queue,
+    waiting while it is full so a slow client slows the reader down
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        chunk = await stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        text = decoder.decode(chunk)
+        if text:
+            await queue.put((name, text))
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        await queue.put((name, tail))
+    await queue.put((name, None))
+
+async def _stop_sandbox(process, pumps: list):
+    """
+    Stop the pumps and kill the sandbox. Its pipes are drained to EOF, since
+    process.wait() doesn't return while a paused pipe still holds output.
+    """
+    for pump in pumps:
+        pump.cancel()
+    await asyncio.gather(*pumps, return_exceptions=True)
+    if process.returncode is None:
+        process.kill()
+    await process.communicate()
+
+async def stream_execution(code: str, limit: float = SANDBOX_TIMEOUT_SECONDS):
+    """
+    Run code in the sandbox and yield output events as they are produced,
+    finishing with an exit event carrying the status and timing
+    """
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
+        f.write(code)
+        temp_file = f.name
+
+    start_time = time.time()
+    process = None
+    pumps = []
+    try:
+        process = await asyncio.create_subprocess_exec(
+            'python3', '-u', temp_file,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
         )
-    except Exception as e:
-        return CodeExecuteResponse(
-            output="",
-            error=str(e),
-            execution_time_ms=0
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_MAX_CHUNKS)
+        pumps = [
+            asyncio.create_task(_pump_stream(process.stdout, "stdout", queue)),
+            asyncio.create_task(_pump_stream(process.stderr, "stderr", queue)),
+        ]
+
+        deadline = start_time + limit
+        open_streams = len(pumps)
+        timed_out = False
+        while open_streams:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                timed_out = True
+                break
+            try:
+                name, text = await asyncio.wait_for(queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                timed_out = True
+                break
+            if text is None:
+                open_streams -= 1
+                continue
+            yield {"event": "output", "stream": name, "data": text}
+
+        if timed_out:
+            await _stop_sandbox(process, pumps)
+        else:
+            await process.wait()
+
+        yield {
+            "event": "exit",
+            "exit_code": process.returncode,
+            "timed_out": timed_out,
+            "error": f"Execution timed out ({limit:.1f} second limit)" if timed_out else None,
+            "execution_time_ms": int((time.time() - start_time) * 1000)
+        }
+    finally:
+        # Runs on normal completion and when the client disconnects mid-stream
+        if process is not None and process.returncode is None:
+            await _stop_sandbox(process, pumps)
+        os.unlink(temp_file)
+
+def format_ndjson_event(event: dict) -> str:
+    return json.dumps(event) + "\n"
+
+def format_sse_event(event: dict) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+@app.post("/execute/stream")
+async def execute_code_stream(
+    data: CodeExecuteRequest,
+    request: Request,
+    format: Optional[str] = None,
+    payload: dict = Depends(verify_token)
+):
+    """
+    Execute Python code and stream stdout/stderr chunks as they are produced.
+    Responds with Server-Sent Events when `format=sse` or the client accepts
+    `text/event-stream`, otherwise with newline-delimited JSON.
+    """
+    use_sse = format == "sse" or (
+        format is None and "text/event-stream" in request.headers.get("accept", "")
+    )
+    formatter = format_sse_event if use_sse else format_ndjson_event
+    media_type = "text/event-stream" if use_sse else "application/x-ndjson"
+
+    async def event_stream():
+        try:
+            async with work_scheduler.slot(tenant_for(payload), lane_for(payload)):
+                # Sized once the slot is held, so time spent queued comes out of the run's budget
+                limit = timeout_for(SANDBOX_TIMEOUT_SECONDS)
+                async for event in stream_execution(data.code, limit):
+                    yield formatter(event)
+        except (QueueFullError, DeadlineExceeded) as e:
+            yield formatter({"event": "exit", "exit_code": None, "timed_out": False,
+                             "error": str(e), "execution_time_ms": 0})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ==================== SESSION KERNELS ====================
+
+# Runs inside each kernel process: reads one JSON request per line, executes it
+# in a namespace that persists between requests, and answers with one JSON line.
+# The protocol uses private copies of stdin/stdout so user code can't corrupt it.
+# The kernel caps its own address space (argv[1] bytes) before running anything,
+# rather than through a preexec_fn, which isn't safe in a threaded server.
+KERNEL_SOURCE = r'''
+import contextlib, io, json, os, sys, traceback
+try:
+    import resource
+    resource.setrlimit(resource.RLIMIT_AS, (int(sys.argv[1]), int(sys.argv[1])))
+except (ImportError, ValueError, OSError):
+    pass
+commands = os.fdopen(os.dup(0), "r")
+replies = os.fdopen(os.dup(1), "w")
+devnull = os.open(os.devnull, os.O_RDWR)
+os.dup2(devnull, 0)
+os.dup2(devnull, 1)
+namespace = {"__name__": "__main__"}
+for line in commands:
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            exec(compile(json.loads(line)["code"], "<cell>", "exec"), namespace)
+        except BaseException:
+            etype, value, tb = sys.exc_info()
+            traceback.print_exception(etype, value, tb.tb_next)
+    replies.write(json.dumps({"output": out.getvalue(), "error": err.getvalue() or None}) + "\n")
+    replies.flush()
+'''
+
+class Kernel:
+    """
+    One long-lived interpreter process holding a session's state. Starting
+    one blocks on fork/exec, so do it off the event loop (see KernelManager).
+    """
+
+    def __init__(self, memory_limit_bytes: int):
+        import subprocess
+
+        self.process = subprocess.Popen(
+            ['python3', '-c', KERNEL_SOURCE, str(memory_limit_bytes)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
         )
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        self.executions = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _roundtrip(self, code: str) -> Optional[dict]:
+        try:
+            self.process.stdin.write(json.dumps({"code": code}) + "\n")
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except (BrokenPipeError, ValueError):
+            return None
+        return json.loads(line) if line else None
+
+    async def run(self, code: str, limit: float) -> Optional[dict]:
+        """Execute code, returning None if the kernel died while running it"""
+        self.last_used = time.monotonic()
+        self.executions += 1
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(self._roundtrip, code), timeout=limit)
+        finally:
+            self.last_used = time.monotonic()
+
+    def kill(self):
+        if self.alive:
+            self.process.kill()
+        # Unblocks any reader thread and reaps the process
+        self.process.wait()
+
+class KernelManager:
+    """
+    Per-session kernels on this node: created on first use, reaped after
+    KERNEL_IDLE_SECONDS without activity, and capped at KERNEL_MAX_PER_NODE with
+    the least recently used idle kernel evicted to make room. A kernel that
+    times out, is cancelled or crashes (e.g. hitting its memory cap) is
+    discarded, so the next call for that session starts fresh.
+    """
+
+    def __init__(self, max_kernels: int = 16, idle_seconds: float = 600.0, memory_limit_bytes: int = 256 * 1024 * 1024):
+        self.max_kernels = max_kernels
+        self.idle_seconds = idle_seconds
+        self.memory_limit_bytes = memory_limit_bytes
+        self.kernels: "OrderedDict[str, Kernel]" = OrderedDict()
+        self.stats = {"started": 0, "evicted": 0, "reaped": 0, "reset": 0, "crashed": 0, "timed_out": 0}
+        self._task: Optional[asyncio.Task] = None
+        # Serializes kernel starts, so concurrent first calls for a session share one kernel
+        self._start_lock = asyncio.Lock()
+
+    def _discard(self, key: str, kernel: Kernel):
+        if self.kernels.get(key) is kernel:
+            del self.kernels[key]
+        kernel.kill()
+
+    def _live(self, key: str) -> Optional[Kernel]:
+        kernel = self.kernels.get(key)
+        if kernel is not None and kernel.alive:
+            self.kernels.move_to_end(key)
+            return kernel
+        if kernel is not None:
+            self._discard(key, kernel)
+        return None
+
+    async def _acquire(self, key: str) -> Kernel:
+        kernel = self._live(key)
+        if kernel is not None:
+            return kernel
+
+        async with self._start_lock:
+            kernel = self._live(key)
+            if kernel is not None:
+                return kernel
+            return await self._start(key)
+
+    async def _start(self, key: str) -> Kernel:
+        while len(self.kernels) >= self.max_kernels:
+            victim = next((k for k, kern in self.kernels.items() if not kern.lock.locked()), None)
+            if victim is None:
+                raise HTTPException(status_code=503, detail="All session kernels are busy, try again shortly")
+            self._discard(victim, self.kernels[victim])
+            self.stats["evicted"] += 1
+
+        kernel = await asyncio.to_thread(Kernel, self.memory_limit_bytes)
+        self.kernels[key] = kernel
+        self.stats["started"] += 1
+        return kernel
+
+    async def execute(self, key: str, code: str, limit: float) -> CodeExecuteResponse:
+        kernel = await self._acquire(key)
+        async with kernel.lock:
+            start_time = time.time()
+            try:
+                reply = await kernel.run(code, limit)
+            except asyncio.TimeoutError:
+                self._discard(key, kernel)
+                self.stats["timed_out"] += 1
+                return CodeExecuteResponse(
+                    output="",
+                    error=f"Execution timed out ({limit:.1f} second limit); the session was reset",
+                    execution_time_ms=int(limit * 1000)
+                )
+            except BaseException:
+                # Cancelled mid-run: the reply would arrive out of step, so drop the kernel
+                self._discard(key, kernel)
+                raise
+
+            execution_time = int((time.time() - start_time) * 1000)
+            if reply is None:
+                self._discard(key, kernel)
+                self.stats["crashed"] += 1
+                return CodeExecuteResponse(
+                    output="",
+                    error="The session kernel exited (memory limit exceeded?); the session was reset",
+                    execution_time_ms=execution_time
+                )
+            return CodeExecuteResponse(output=reply["output"], error=reply["error"], execution_time_ms=execution_time)
+
+    def reset(self, key: str) -> bool:
+        kernel = self.kernels.get(key)
+        if kernel is None:
+            return False
+        self._discard(key, kernel)
+        self.stats["reset"] += 1
+        return True
+
+    def reap_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        for key, kernel in list(self.kernels.items()):
+            if not kernel.lock.locked() and (kernel.last_used < cutoff or not kernel.alive):
+                self._discard(key, kernel)
+                self.stats["reaped"] += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(min(self.idle_seconds / 4, 30))
+            self.reap_idle()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for key, kernel in list(self.kernels.items()):
+            self._discard(key, kernel)
+
+    def snapshot(self) -> dict:
+        return {
+            "kernels": len(self.kernels),
+            "busy": sum(1 for kernel in self.kernels.values() if kernel.lock.locked()),
+            "max_kernels": self.max_kernels,
+            **self.stats,
+        }
+
+kernel_manager = KernelManager(
+    max_kernels=KERNEL_MAX_PER_NODE,
+    idle_seconds=KERNEL_IDLE_SECONDS,
+    memory_limit_bytes=KERNEL_MEMORY_LIMIT_MB * 1024 * 1024,
+)
+
+def kernel_key(payload: dict, session_id: str) -> str:
+    # Sessions are scoped to the caller so one user can't reach another's kernel
+    return f"{payload['sub']}:{session_id}"
+
+@app.delete("/execute/sessions/{session_id}")
+async def reset_session(session_id: str, payload: dict = Depends(verify_token)):
+    """Discard the session's kernel; the next /execute call starts from a clean state"""
+    return {"session_id": session_id, "reset": kernel_manager.reset(kernel_key(payload, session_id))}
+
+@app.on_event("startup")
+async def start_kernel_reaper():
+    kernel_manager.start()
+
+@app.on_event("shutdown")
+async def stop_kernels():
+    await kernel_manager.stop()
+
+# ==================== EXPLANATION CACHE & PREFETCH ====================
+
+# How curriculum topics from the progress document are phrased for /explain
+CURRICULUM_TOPIC_LABELS = {
+    ("Functions", "basic"): "functions",
+    ("Functions", "advanced"): "advanced functions",
+}
+
+def curriculum_topic_label(module: str, topic: str) -> str:
+    return CURRICULUM_TOPIC_LABELS.get((module, topic), topic.replace("_", " "))
+
+class ExplanationCache:
+    """
+    LRU cache of generated explanations keyed by (topic, level), with a TTL.
+    Entries written by the prefetcher are flagged so the cache can report how
+    many of them were later served to a student before expiring.
+    """
+
+    def __init__(self, capacity: int = 500, ttl_seconds: float = 86400.0):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "prefetch_hits": 0, "prefetch_unused": 0}
+
+    @staticmethod
+    def key(topic: str, level: str) -> tuple:
+        return " ".join(topic.lower().replace("_", " ").split()), level
+
+    def _drop(self, key: tuple):
+        entry = self.entries.pop(key)
+        if entry["prefetched"]:
+            self.stats["prefetch_unused"] += 1
+
+    def __contains__(self, key: tuple) -> bool:
+        entry = self.entries.get(key)
+        return entry is not None and entry["expires_at"] > time.monotonic()
+
+    def get(self, topic: str, level: str) -> Optional[str]:
+        key = self.key(topic, level)
+        entry = self.entries.get(key)
+        if entry is not None and entry["expires_at"] <= time.monotonic():
+            self._drop(key)
+            entry = None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        if entry["prefetched"]:
+            # Count each prefetched explanation once, on its first use
+            entry["prefetched"] = False
+            self.stats["prefetch_hits"] += 1
+        return entry["explanation"]
+
+    def put(self, topic: str, level: str, explanation: str, prefetched: bool = False):
+        key = self.key(topic, level)
+        if key in self.entries:
+            self._drop(key)
+        self.entries[key] = {
+            "explanation": explanation,
+            "expires_at": time.monotonic() + self.ttl_seconds,
+            "prefetched": prefetched,
+        }
+        while len(self.entries) > self.capacity:
+            self._drop(next(iter(self.entries)))
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            **self.stats,
+        }
+
+explanation_cache = ExplanationCache(capacity=EXPLANATION_CACHE_SIZE, ttl_seconds=EXPLANATION_CACHE_TTL_SECONDS)
+
+async def generate_explanation(topic: str, level: str) -> str:
+    category = "long_explanation" if level == "advanced" else None
+    decision = model_router.route("explain", topic, category=category)
+    return await model_router.complete(
+        decision,
+        [
+            {"role": "system", "content": f"You are a Python tutor. Explain concepts at a {level} level with examples."},
+            {"role": "user", "content": f"Explain {topic} in Python"}
+        ]
+    )
+
+class ExplanationPrefetcher:
+    """
+    Warms the explanation cache for the topics a student is likely to open
+    next: the first topics below proficiency in curriculum order. Jobs run one
+    at a time in the scheduler's batch lane, are skipped while the upstream
+    circuit is not closed, and are capped at `budget_per_hour` generations.
+    """
+
+    def __init__(self, cache: ExplanationCache, generate, depth: int = 2,
+                 budget_per_hour: int = 200, max_queued: int = 100):
+        self.cache = cache
+        self.generate = generate
+        self.depth = depth
+        self.budget_per_hour = budget_per_hour
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        self.pending: set = set()
+        self.recent: deque = deque()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"scheduled": 0, "completed": 0, "failed": 0, "skipped_budget": 0,
+                      "skipped_circuit": 0, "dropped_queue_full": 0}
+
+    def predict(self, progress: dict) -> List[str]:
+        return [curriculum_topic_label(t["module"], t["topic"]) for t in upcoming_topics(progress, limit=self.depth)]
+
+    def schedule(self, tenant: str, progress: dict, level: str) -> int:
+        """Queue the student's predicted next topics that aren't cached yet"""
+        queued = 0
+        for topic in self.predict(progress):
+            key = self.cache.key(topic, level)
+            if key in self.cache or key in self.pending:
+                continue
+            try:
+                self.queue.put_nowait((tenant, topic, level))
+            except asyncio.QueueFull:
+                self.stats["dropped_queue_full"] += 1
+                break
+            self.pending.add(key)
+            self.stats["scheduled"] += 1
+            queued += 1
+        return queued
+
+    def _within_budget(self) -> bool:
+        cutoff = time.monotonic() - 3600
+        while self.recent and self.recent[0] < cutoff:
+            self.recent.popleft()
+        return len(self.recent) < self.budget_per_hour
+
+    async def prefetch(self, tenant: str, topic: str, level: str):
+        key = self.cache.key(topic, level)
+        try:
+            if key in self.cache:
+                return
+            if openrouter_breaker.state != CircuitBreaker.CLOSED:
+                self.stats["skipped_circuit"] += 1
+                return
+            if not self._within_budget():
+                self.stats["skipped_budget"] += 1
+                return
+            self.recent.append(time.monotonic())
+            async with work_scheduler.slot(tenant, "batch"):
+                explanation = await self.generate(topic, level)
+            self.cache.put(topic, level, explanation, prefetched=True)
+            self.stats["completed"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.info("explanation prefetch for %r failed: %s", topic, e)
+        finally:
+            self.pending.discard(key)
+
+    async def _run(self):
+        while True:
+            job = await self.queue.get()
+            await self.prefetch(*job)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> dict:
+        completed = self.stats["completed"]
+        return {
+            "enabled": EXPLAIN_PREFETCH_ENABLED and bool(OPENROUTER_API_KEY),
+            "queued": self.queue.qsize(),
+            "budget_per_hour": self.budget_per_hour,
+            "used_last_hour": len(self.recent),
+            "prefetch_hit_rate": self.cache.stats["prefetch_hits"] / completed if completed else 0.0,
+            **self.stats,
+        }
+
+explanation_prefetcher = ExplanationPrefetcher(
+    explanation_cache,
+    generate_explanation,
+    depth=EXPLAIN_PREFETCH_DEPTH,
+    budget_per_hour=EXPLAIN_PREFETCH_BUDGET_PER_HOUR,
+    max_queued=EXPLAIN_PREFETCH_MAX_QUEUED,
+)
+
+def prefetch_next_explanations(payload: dict, user_id: str, level: str = "intermediate"):
+    if EXPLAIN_PREFETCH_ENABLED and OPENROUTER_API_KEY and user_id:
+        explanation_prefetcher.schedule(tenant_for(payload), ensure_progress(user_id), level)
+
+@app.on_event("startup")
+async def start_explanation_prefetch():
+    if EXPLAIN_PREFETCH_ENABLED and OPENROUTER_API_KEY:
+        explanation_prefetcher.start()
+
+@app.on_event("shutdown")
+async def stop_explanation_prefetch():
+    await explanation_prefetcher.stop()
 
 # ==================== CONCEPTS ENDPOINT ====================
 
@@ -439,33 +2350,28 @@ async def explain_concept(data: ExplainRequest, payload: dict = Depends(verify_t
     Get explanation for a Python concept
     """
     if OPENROUTER_API_KEY:
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{OPENROUTER_BASE_URL}/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                        "Content-Type": "application/json",
-                    },
-                    json={
-                        "model": LLM_MODEL,
-                        "messages": [
-                            {"role": "system", "content": f"You are a Python tutor. Explain concepts at a {data.level} level with examples."},
-                            {"role": "user", "content": f"Explain {data.topic} in Python"}
-                        ],
-                        "max_tokens": 800
-                    },
-                    timeout=30.0
-                )
+        cached = explanation_cache.get(data.topic, data.level)
+        if cached is not None:
+            prefetch_next_explanations(payload, payload["sub"], data.level)
+            return {
+                "topic": data.topic,
+                "explanation": cached,
+                "level": data.level
+            }
 
-                if response.status_code == 200:
-                    result = response.json()
-                    return {
-                        "topic": data.topic,
-                        "explanation": result["choices"][0]["message"]["content"],
-                        "level": data.level
-                    }
-        except:
+        try:
+            async with work_scheduler.slot(tenant_for(payload), lane_for(payload)):
+                explanation = await generate_explanation(data.topic, data.level)
+            explanation_cache.put(data.topic, data.level, explanation)
+            prefetch_next_explanations(payload, payload["sub"], data.level)
+            return {
+                "topic": data.topic,
+                "explanation": explanation,
+                "level": data.level
+            }
+        except DeadlineExceeded:
+            raise
+        except Exception:
             pass
 
     # Fallback
@@ -478,11 +2384,17 @@ async def explain_concept(data: ExplainRequest, payload: dict = Depends(verify_t
 # ==================== PROGRESS ENDPOINTS ====================
 
 # In-memory progress store
-progress_db = {}
+progress_db = BoundedStore("progress", int(PROGRESS_STORE_MEMORY_MB * 1024 * 1024), STORE_SPILL_DIR)
 
-@app.get("/progress/{user_id}")
-async def get_progress(user_id: str, payload: dict = Depends(verify_token)):
-    """Get user's learning progress"""
+# Curriculum modules in order, with their topics
+CURRICULUM_MODULES = {
+    "Basics": ["variables", "operators"],
+    "Control Flow": ["if_statements", "loops"],
+    "Functions": ["basic", "advanced"],
+}
+
+def ensure_progress(user_id: str) -> dict:
+    """Return the user's progress document, creating the default one if needed"""
     if user_id not in progress_db:
         progress_db[user_id] = {
             "user_id": user_id,
@@ -490,26 +2402,83 @@ async def get_progress(user_id: str, payload: dict = Depends(verify_token)):
             "modules_completed": 0,
             "current_module": "Basics",
             "modules": {
-                "Basics": {"variables": {"mastery_score": 0}, "operators": {"mastery_score": 0}},
-                "Control Flow": {"if_statements": {"mastery_score": 0}, "loops": {"mastery_score": 0}},
-                "Functions": {"basic": {"mastery_score": 0}, "advanced": {"mastery_score": 0}},
+                module: {topic: {"mastery_score": 0} for topic in topics}
+                for module, topics in CURRICULUM_MODULES.items()
             },
             "quiz_scores": [],
-            "total_time_spent": 0
+            "total_time_spent": 0,
+            "version": 1
         }
 
     return progress_db[user_id]
 
+# Curriculum order, and the mastery at which a topic counts as done ("Proficient" on the dashboard)
+MODULE_ORDER = list(CURRICULUM_MODULES)
+PROFICIENT_MASTERY = 70
+
+# Most recent progress events per user, newest last. Users are kept in
+# order of their last event and the least recently active are dropped past
+# RECENT_ACTIVITY_MAX_USERS.
+recent_activity: "OrderedDict[str, deque]" = OrderedDict()
+
+def activity_for(user_id: str) -> deque:
+    """The user's activity deque, marked most recently used"""
+    if user_id not in recent_activity:
+        recent_activity[user_id] = deque(maxlen=RECENT_ACTIVITY_LIMIT)
+    recent_activity.move_to_end(user_id)
+    while len(recent_activity) > RECENT_ACTIVITY_MAX_USERS:
+        recent_activity.popitem(last=False)
+    return recent_activity[user_id]
+
+def record_activity(user_id: str, event: dict):
+    activity_for(user_id).append({**event, "timestamp": datetime.utcnow().isoformat()})
+
+def upcoming_topics(progress: dict, limit: int = 1) -> List[dict]:
+    """The next topics below proficiency, in curriculum order"""
+    modules = progress["modules"]
+    ordered = [m for m in MODULE_ORDER if m in modules] + [m for m in modules if m not in MODULE_ORDER]
+    topics = []
+    for module in ordered:
+        for topic, data in modules[module].items():
+            if data["mastery_score"] < PROFICIENT_MASTERY:
+                topics.append({"module": module, "topic": topic, "mastery_score": data["mastery_score"]})
+                if len(topics) >= limit:
+                    return topics
+    return topics
+
+@app.get("/progress/{user_id}")
+async def get_progress(user_id: str, request: Request, response: Response, payload: dict = Depends(verify_token)):
+    """Get user's learning progress"""
+    progress = ensure_progress(user_id)
+
+    etag = make_etag("progress", user_id, progress["version"])
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+
+    return without_version(progress)
+
 @app.post("/progress")
-async def update_progress(data: dict, payload: dict = Depends(verify_token)):
-    """Update user's learning progress"""
+async def update_progress(data: dict, request: Request, response: Response, payload: dict = Depends(verify_token)):
+    """
+    Update user's learning progress. Retries carrying the same Idempotency-Key
+    are replayed rather than applied to the weighted average again.
+    """
+    async def apply():
+        return apply_progress_update(data)
+
+    progress = await run_idempotent(request, response, payload, data, apply)
+    response.headers["ETag"] = make_etag("progress", progress["user_id"], progress["version"])
+    prefetch_next_explanations(payload, progress["user_id"])
+    return without_version(progress)
+
+def apply_progress_update(data: dict) -> dict:
     user_id = data.get("user_id")
     module = data.get("module")
     topic = data.get("topic")
     score = data.get("score", 0)
 
-    if user_id not in progress_db:
-        await get_progress(user_id, payload)
+    ensure_progress(user_id)
 
     # Update module/topic score
     if module in progress_db[user_id]["modules"]:
@@ -527,9 +2496,739 @@ async def update_progress(data: dict, payload: dict = Depends(verify_token)):
             count += 1
 
     progress_db[user_id]["overall_mastery"] = total_score / count if count > 0 else 0
+    progress_db[user_id]["version"] += 1
+
+    activity_type = data.get("activity_type", "quiz")
+    record_activity(user_id, {"activity_type": activity_type, "module": module, "topic": topic, "score": score})
+
+    # Progress-agent is updated asynchronously; the local document above serves reads
+    if PROGRESS_SYNC_ENABLED and module and topic:
+        progress_sync.enqueue({
+            "user_id": user_id,
+            "module": module,
+            "topic": topic,
+            "activity_type": ACTIVITY_TYPE_ALIASES.get(activity_type, activity_type),
+            "score": score,
+            "details": {"source": "api-gateway"}
+        })
 
     return progress_db[user_id]
 
+# ==================== AGENT CLIENTS & ALL-IN-ONE MODE ====================
+
+# SERVICES key -> (service directory, mount prefix in all-in-one mode)
+AGENT_MOUNTS = {
+    "triage": ("triage-agent", "/agents/triage"),
+    "concepts": ("concepts-agent", "/agents/concepts"),
+    "code_review": ("code-review-agent", "/agents/code-review"),
+    "debug": ("debug-agent", "/agents/debug"),
+    "exercise": ("exercise-agent", "/agents/exercise"),
+    "progress": ("progress-agent", "/agents/progress"),
+}
+
+class AgentClient(ABC):
+    """How the gateway calls agents; see HTTPAgentClient and InProcessAgentClient"""
+
+    @abstractmethod
+    async def post(self, agent: str, path: str, payload: dict, timeout: float = 10.0) -> dict:
+        """
+        POST payload to the agent's path and return the decoded JSON response;
+        the call is bounded by, and tells the agent, the time left before the
+        request deadline
+        """
+
+class HTTPAgentClient(AgentClient):
+    """Calls each agent's own service over HTTP"""
+
+    def __init__(self, urls: dict):
+        self.urls = urls
+
+    async def post(self, agent: str, path: str, payload: dict, timeout: float = 10.0) -> dict:
+        async with httpx.AsyncClient() as client:
+            response = await client.post(f"{self.urls[agent]}{path}", json=payload,
+                                         timeout=timeout_for(timeout), headers=deadline_headers())
+            response.raise_for_status()
+            return response.json()
+
+class InProcessAgentClient(AgentClient):
+    """
+    Calls agents loaded in this process by passing the request straight to
+    each agent's ASGI app: no socket, connection pool or network hop, but the
+    same validation, middleware and error handling as over HTTP.
+    """
+
+    def __init__(self, agent_apps: dict):
+        self.clients = {
+            agent: httpx.AsyncClient(transport=httpx.ASGITransport(app=agent_app), base_url=f"http://{agent}")
+            for agent, agent_app in agent_apps.items()
+        }
+
+    async def post(self, agent: str, path: str, payload: dict, timeout: float = 10.0) -> dict:
+        response = await self.clients[agent].post(path, json=payload,
+                                                  timeout=timeout_for(timeout), headers=deadline_headers())
+        response.raise_for_status()
+        return response.json()
+
+class TokenGuard:
+    """
+    ASGI wrapper that lets a request through to `asgi_app` only with a valid
+    bearer token, like verify_token; agents have no auth of their own.
+    """
+
+    def __init__(self, asgi_app):
+        self.asgi_app = asgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scheme, _, token = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1").partition(" ")
+            try:
+                if scheme.lower() != "bearer":
+                    raise jwt.InvalidTokenError("Missing bearer token")
+                jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            except jwt.ExpiredSignatureError:
+                return await JSONResponse({"detail": "Token expired"}, status_code=401)(scope, receive, send)
+            except jwt.InvalidTokenError:
+                return await JSONResponse({"detail": "Invalid token"}, status_code=401)(scope, receive, send)
+        await self.asgi_app(scope, receive, send)
+
+def load_agent_app(service_dir: str, alias: str) -> FastAPI:
+    """
+    Import an agent's app.main and return its FastAPI app. Every agent lives in
+    a package called `app` (so does this gateway under uvicorn), so that name
+    is pointed at the agent just for the import; afterwards the agent's
+    modules are kept under `alias` and the previous `app` modules restored.
+    """
+    def take_app_modules() -> dict:
+        modules = {name: module for name, module in sys.modules.items() if name == "app" or name.startswith("app.")}
+        for name in modules:
+            del sys.modules[name]
+        return modules
+
+    saved = take_app_modules()
+    try:
+        package = types.ModuleType("app")
+        package.__path__ = [os.path.join(service_dir, "app")]
+        sys.modules["app"] = package
+        agent_app = importlib.import_module("app.main").app
+    finally:
+        for name, module in take_app_modules().items():
+            sys.modules[alias + name[len("app"):]] = module
+        sys.modules.update(saved)
+    return agent_app
+
+def mount_agents(target: FastAPI, services_dir: str) -> dict:
+    """
+    Mount every agent's app in target under its /agents/... prefix, behind
+    TokenGuard. Each agent keeps its own middleware and exception handlers,
+    and its lifespan (startup/shutdown handlers included) is chained into
+    target's: agents start before target's own startup and stop after its
+    shutdown.
+    """
+    agent_apps = {}
+    for key, (directory, prefix) in AGENT_MOUNTS.items():
+        agent_app = load_agent_app(os.path.join(services_dir, directory), f"learnflow_agents.{key}")
+        target.mount(prefix, TokenGuard(agent_app))
+        agent_apps[key] = agent_app
+
+    # Mounted apps get no lifespan events of their own
+    target_lifespan = target.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan(app):
+        async with AsyncExitStack() as agent_lifespans:
+            for agent_app in agent_apps.values():
+                await agent_lifespans.enter_async_context(agent_app.router.lifespan_context(agent_app))
+            async with target_lifespan(app) as state:
+                yield state
+
+    target.router.lifespan_context = lifespan
+    return agent_apps
+
+if ALL_IN_ONE:
+    mounted_agents = mount_agents(app, AGENT_SERVICES_DIR)
+    agent_client: AgentClient = InProcessAgentClient(mounted_agents)
+else:
+    mounted_agents = {}
+    agent_client = HTTPAgentClient(SERVICES)
+
+# ==================== PROGRESS SYNC ====================
+
+# Gateway activity names that differ from progress-agent's
+ACTIVITY_TYPE_ALIASES = {"lesson": "concept_learning"}
+
+class ProgressWriteBehind:
+    """
+    Write-behind buffer for progress-agent. Updates to the same
+    (user, module, topic, activity) are coalesced while they wait, and the
+    buffer is flushed in batches once it reaches `flush_size` or every
+    `flush_seconds`. Failed batches are retried with backoff and then put back;
+    when the backlog is full the oldest pending update is dropped.
+    """
+
+    def __init__(self, send, flush_size: int = 50, flush_seconds: float = 2.0,
+                 max_pending: int = 10000, max_retries: int = 3, retry_backoff: float = 0.5):
+        self.send = send
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self.pending: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"enqueued": 0, "coalesced": 0, "flushed": 0, "batches": 0,
+                      "retries": 0, "failed_batches": 0, "dropped": 0}
+
+    def enqueue(self, update: dict):
+        self.stats["enqueued"] += 1
+        self._merge(update)
+        if len(self.pending) >= self.flush_size:
+            self.wakeup.set()
+
+    def _merge(self, update: dict):
+        key = (update["user_id"], update["module"], update["topic"], update["activity_type"])
+        existing = self.pending.get(key)
+        if existing is not None:
+            # progress-agent keeps the best score and counts repeated activity
+            existing["score"] = max(existing["score"], update["score"])
+            existing["occurrences"] += update.get("occurrences", 1)
+            self.stats["coalesced"] += 1
+            return
+
+        if len(self.pending) >= self.max_pending:
+            self.pending.popitem(last=False)
+            self.stats["dropped"] += 1
+        self.pending[key] = {**update, "occurrences": update.get("occurrences", 1)}
+
+    async def flush(self):
+        while self.pending:
+            batch = []
+            while self.pending and len(batch) < self.flush_size:
+                batch.append(self.pending.popitem(last=False)[1])
+
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await self.send(batch)
+                    self.stats["flushed"] += len(batch)
+                    self.stats["batches"] += 1
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        logger.warning(f"Progress sync failed after {attempt + 1} attempts: {e}")
+                        self.stats["failed_batches"] += 1
+                        # Put the batch back so the next flush retries it
+                        for update in batch:
+                            self._merge(update)
+                        return
+                    self.stats["retries"] += 1
+                    await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self.task is None:
+            self.stopping = False
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # Let the loop finish the batch it may be sending rather than cancelling it mid-send
+        if self.task is not None:
+            self.stopping = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+        await self.flush()
+
+    def snapshot(self) -> dict:
+        return {"enabled": PROGRESS_SYNC_ENABLED, "pending": len(self.pending), **self.stats}
+
+async def send_progress_batch(updates: List[dict]):
+    await agent_client.post("progress", "/track/batch", {"updates": updates})
+
+progress_sync = ProgressWriteBehind(
+    send_progress_batch,
+    flush_size=PROGRESS_SYNC_FLUSH_SIZE,
+    flush_seconds=PROGRESS_SYNC_FLUSH_SECONDS,
+    max_pending=PROGRESS_SYNC_MAX_PENDING,
+    max_retries=PROGRESS_SYNC_MAX_RETRIES,
+)
+
+@app.on_event("startup")
+async def start_progress_sync():
+    if PROGRESS_SYNC_ENABLED:
+        progress_sync.start()
+
+@app.on_event("shutdown")
+async def stop_progress_sync():
+    if PROGRESS_SYNC_ENABLED:
+        await progress_sync.stop()
+
+# ==================== QUIZ ENGINE ====================
+
+QUIZ_QUESTIONS = {
+    "b1": {"module": "Basics", "topic": "variables",
+           "question": "What is the correct way to create a variable in Python?",
+           "options": ["var x = 5", "x = 5", "int x = 5", "let x = 5"], "answer": 1,
+           "explanation": "In Python, you create variables by simply assigning a value. No keyword like 'var', 'let', or type declaration is needed."},
+    "b2": {"module": "Basics", "topic": "variables",
+           "question": "What will print(type(5.0)) output?",
+           "options": ["<class 'int'>", "<class 'float'>", "<class 'number'>", "<class 'decimal'>"], "answer": 1,
+           "explanation": "5.0 is a floating-point number in Python, so type() returns <class 'float'>."},
+    "b3": {"module": "Basics", "topic": "operators",
+           "question": "What is the result of 7 // 2?",
+           "options": ["3.5", "3", "4", "1"], "answer": 1,
+           "explanation": "// is floor division: it divides and rounds down to the nearest whole number."},
+    "b4": {"module": "Basics", "topic": "operators",
+           "question": "Which operator checks whether two values are equal?",
+           "options": ["=", "==", "!=", "is not"], "answer": 1,
+           "explanation": "== compares values; a single = assigns a value to a variable."},
+    "c1": {"module": "Control Flow", "topic": "if_statements",
+           "question": "Which keyword adds another condition to an if statement?",
+           "options": ["else if", "elif", "elseif", "then"], "answer": 1,
+           "explanation": "Python uses elif for additional conditions after an if."},
+    "c2": {"module": "Control Flow", "topic": "if_statements",
+           "question": "What does `if x:` do when x is an empty list?",
+           "options": ["Runs the block", "Skips the block", "Raises an error", "Loops over x"], "answer": 1,
+           "explanation": "Empty containers are falsy, so the if block is skipped."},
+    "c3": {"module": "Control Flow", "topic": "loops",
+           "question": "How do you start a for loop in Python?",
+           "options": ["for (i = 0; i < 10; i++)", "for i in range(10):", "foreach i in range(10)", "loop i from 0 to 10"], "answer": 1,
+           "explanation": "Python uses 'for item in iterable:' syntax. The range() function generates a sequence of numbers."},
+    "c4": {"module": "Control Flow", "topic": "loops",
+           "question": "Which statement exits a loop immediately?",
+           "options": ["continue", "pass", "break", "return"], "answer": 2,
+           "explanation": "break ends the loop; continue skips to the next iteration."},
+    "f1": {"module": "Functions", "topic": "basic",
+           "question": "Which keyword defines a function?",
+           "options": ["function", "def", "fun", "define"], "answer": 1,
+           "explanation": "Functions are defined with def name(parameters):"},
+    "f2": {"module": "Functions", "topic": "basic",
+           "question": "What does a function return if it has no return statement?",
+           "options": ["0", "None", "An empty string", "It raises an error"], "answer": 1,
+           "explanation": "A function without a return statement returns None."},
+    "f3": {"module": "Functions", "topic": "advanced",
+           "question": "What does *args collect in a function definition?",
+           "options": ["Keyword arguments as a dict", "Extra positional arguments as a tuple", "Only the first argument", "Default values"], "answer": 1,
+           "explanation": "*args gathers any extra positional arguments into a tuple; **kwargs gathers keyword arguments."},
+    "f4": {"module": "Functions", "topic": "advanced",
+           "question": "What does `lambda x: x * 2` create?",
+           "options": ["A list", "An anonymous function", "A generator", "A class"], "answer": 1,
+           "explanation": "lambda creates a small anonymous function in a single expression."},
+}
+
+QUIZZES = {
+    "basics": {"title": "Python Basics", "questions": ["b1", "b2", "b3", "b4"]},
+    "control-flow": {"title": "Control Flow", "questions": ["c1", "c2", "c3", "c4"]},
+    "functions": {"title": "Functions", "questions": ["f1", "f2", "f3", "f4"]},
+    "python-fundamentals": {"title": "Python Fundamentals", "questions": list(QUIZ_QUESTIONS)},
+}
+
+class QuizSubmitRequest(BaseModel):
+    # Index of the chosen option per question, null when unanswered
+    answers: List[Optional[int]]
+
+class QuizSubmission(BaseModel):
+    user_id: str
+    answers: List[Optional[int]]
+
+class QuizBatchRequest(BaseModel):
+    submissions: List[QuizSubmission]
+
+class CompiledQuiz:
+    """
+    A quiz prepared for vectorized grading: the answer key as an array, and a
+    question-by-topic one-hot matrix so per-topic scores for a whole class come
+    from a single matrix product.
+    """
+
+    def __init__(self, quiz_id: str, title: str, question_ids: List[str]):
+        self.quiz_id = quiz_id
+        self.title = title
+        self.question_ids = question_ids
+        self.questions = [QUIZ_QUESTIONS[qid] for qid in question_ids]
+        self.answer_key = np.array([q["answer"] for q in self.questions], dtype=np.int16)
+        self.option_counts = [len(q["options"]) for q in self.questions]
+
+        self.topics = list(dict.fromkeys((q["module"], q["topic"]) for q in self.questions))
+        self.topic_matrix = np.zeros((len(self.questions), len(self.topics)), dtype=np.float32)
+        for row, q in enumerate(self.questions):
+            self.topic_matrix[row, self.topics.index((q["module"], q["topic"]))] = 1.0
+        self.topic_sizes = self.topic_matrix.sum(axis=0)
+
+    def answer_matrix(self, rows: List[List[Optional[int]]]) -> np.ndarray:
+        """Stack submissions into a (students, questions) array, -1 marking unanswered"""
+        expected = len(self.questions)
+        for row in rows:
+            if len(row) != expected:
+                raise HTTPException(status_code=422, detail=f"Quiz '{self.quiz_id}' expects {expected} answers, got {len(row)}")
+            for number, (answer, options) in enumerate(zip(row, self.option_counts), start=1):
+                if answer is not None and not 0 <= answer < options:
+                    raise HTTPException(status_code=422, detail=f"Answer {answer} to question {number} is not one of its {options} options")
+        return np.array([[-1 if a is None else a for a in row] for row in rows], dtype=np.int16).reshape(len(rows), expected)
+
+    def grade(self, answers: np.ndarray) -> tuple:
+        """Return (correct, totals, topic_scores) for a (students, questions) answer array"""
+        correct = answers == self.answer_key
+        totals = correct.sum(axis=1)
+        topic_scores = (correct.astype(np.float32) @ self.topic_matrix) / self.topic_sizes
+        return correct, totals, topic_scores
+
+    def summary(self) -> dict:
+        return {"quiz_id": self.quiz_id, "title": self.title, "questions": len(self.questions),
+                "modules": list(dict.fromkeys(module for module, _ in self.topics))}
+
+compiled_quizzes = {quiz_id: CompiledQuiz(quiz_id, quiz["title"], quiz["questions"]) for quiz_id, quiz in QUIZZES.items()}
+
+def get_quiz(quiz_id: str) -> CompiledQuiz:
+    quiz = compiled_quizzes.get(quiz_id)
+    if quiz is None:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+    return quiz
+
+def record_quiz_results(quiz: CompiledQuiz, user_ids: List[str], totals: np.ndarray, topic_scores: np.ndarray) -> List[dict]:
+    """Apply per-topic scores to each student's progress (synced onward in batches) and return their summaries"""
+    results = []
+    total = len(quiz.questions)
+    timestamp = datetime.utcnow().isoformat()
+    for row, user_id in enumerate(user_ids):
+        topics: dict = {}
+        for column, (module, topic) in enumerate(quiz.topics):
+            score = float(topic_scores[row, column])
+            topics.setdefault(module, {})[topic] = score
+            apply_progress_update({"user_id": user_id, "module": module, "topic": topic,
+                                   "score": score, "activity_type": "quiz"})
+
+        correct = int(totals[row])
+        progress_db[user_id].setdefault("quiz_scores", []).append(
+            {"quiz_id": quiz.quiz_id, "correct": correct, "total": total, "timestamp": timestamp})
+        results.append({"user_id": user_id, "quiz_id": quiz.quiz_id, "correct": correct,
+                        "total": total, "score": correct / total, "topics": topics})
+    return results
+
+@app.get("/quizzes")
+async def list_quizzes(payload: dict = Depends(verify_token)):
+    return [quiz.summary() for quiz in compiled_quizzes.values()]
+
+@app.get("/quizzes/{quiz_id}")
+async def get_quiz_questions(quiz_id: str, payload: dict = Depends(verify_token)):
+    """Quiz questions without their answers"""
+    quiz = get_quiz(quiz_id)
+    return {
+        **quiz.summary(),
+        "items": [{"id": qid, "question": q["question"], "options": q["options"], "module": q["module"], "topic": q["topic"]}
+                  for qid, q in zip(quiz.question_ids, quiz.questions)],
+    }
+
+@app.post("/quizzes/{quiz_id}/submit")
+async def submit_quiz(quiz_id: str, data: QuizSubmitRequest, payload: dict = Depends(verify_token)):
+    """Grade the caller's answers, record them in their progress and return per-question feedback"""
+    quiz = get_quiz(quiz_id)
+    correct, totals, topic_scores = quiz.grade(quiz.answer_matrix([data.answers]))
+    result = record_quiz_results(quiz, [payload["sub"]], totals, topic_scores)[0]
+    result["feedback"] = [
+        {"id": qid, "correct": bool(is_correct), "answer": q["answer"], "explanation": q["explanation"]}
+        for qid, q, is_correct in zip(quiz.question_ids, quiz.questions, correct[0])
+    ]
+    return result
+
+@app.post("/quizzes/{quiz_id}/submit/batch")
+async def submit_quiz_batch(quiz_id: str, data: QuizBatchRequest, payload: dict = Depends(verify_token)):
+    """
+    Grade a whole class's submissions in one vectorized pass (teachers only)
+    and record every student's per-topic results. Every student must be in
+    the teacher's class.
+    """
+    if payload.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can submit quizzes for a class")
+
+    quiz = get_quiz(quiz_id)
+    class_id = payload.get("class_id")
+    unknown, other_class = [], []
+    for submission in data.submissions:
+        student = find_user(submission.user_id)
+        if student is None:
+            unknown.append(submission.user_id)
+        elif not class_id or student.get("class_id") != class_id:
+            other_class.append(submission.user_id)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown users: {', '.join(unknown)}")
+    if other_class:
+        raise HTTPException(status_code=403, detail=f"Not in your class: {', '.join(other_class)}")
+
+    if not data.submissions:
+        return {"quiz_id": quiz_id, "students": [], "question_stats": []}
+
+    user_ids = [submission.user_id for submission in data.submissions]
+    correct, totals, topic_scores = quiz.grade(quiz.answer_matrix([submission.answers for submission in data.submissions]))
+    correct_rates = correct.mean(axis=0)
+    return {
+        "quiz_id": quiz_id,
+        "students": record_quiz_results(quiz, user_ids, totals, topic_scores),
+        "question_stats": [{"id": qid, "correct_rate": float(rate)} for qid, rate in zip(quiz.question_ids, correct_rates)],
+    }
+
+# ==================== DASHBOARD ====================
+
+async def gather_parts(parts: dict, timeout: float) -> tuple:
+    """
+    Run the named coroutines concurrently, each bounded by timeout. Returns
+    (results, errors): a part that timed out or failed is None in results and
+    named in errors, so callers can serve what did arrive.
+    """
+    outcomes = await asyncio.gather(
+        *(asyncio.wait_for(part, timeout=timeout) for part in parts.values()),
+        return_exceptions=True
+    )
+    results, errors = {}, {}
+    for name, outcome in zip(parts, outcomes):
+        if isinstance(outcome, asyncio.TimeoutError):
+            results[name], errors[name] = None, "timeout"
+        elif isinstance(outcome, Exception):
+            logger.warning("dashboard part %s failed: %s", name, outcome)
+            results[name], errors[name] = None, "unavailable"
+        else:
+            results[name] = outcome
+    return results, errors
+
+async def dashboard_user(email: str) -> dict:
+    user = users_db.get(email)
+    if not user:
+        raise LookupError("user not found")
+    return {"id": user["id"], "name": user["name"], "role": user["role"]}
+
+async def dashboard_progress(user_id: str) -> dict:
+    progress = ensure_progress(user_id)
+    return {
+        "overall_mastery": progress["overall_mastery"],
+        "current_module": progress["current_module"],
+        "modules": {
+            module: sum(t["mastery_score"] for t in topics.values()) / len(topics) if topics else 0
+            for module, topics in progress["modules"].items()
+        },
+    }
+
+async def dashboard_next_topic(user_id: str) -> Optional[dict]:
+    topics = upcoming_topics(ensure_progress(user_id))
+    return topics[0] if topics else None
+
+async def dashboard_activity(user_id: str) -> List[dict]:
+    return list(reversed(recent_activity.get(user_id, ())))
+
+@app.get("/dashboard")
+async def dashboard(payload: dict = Depends(verify_token)):
+    """
+    Everything the student dashboard needs in one round trip: profile,
+    progress summary, recommended next topic and recent activity. Parts are
+    fetched concurrently; any that miss their timeout come back as null and
+    are listed under "missing".
+    """
+    user_id = payload["sub"]
+    results, errors = await gather_parts({
+        "user": dashboard_user(payload["email"]),
+        "progress": dashboard_progress(user_id),
+        "next_topic": dashboard_next_topic(user_id),
+        "recent_activity": dashboard_activity(user_id),
+    }, timeout=timeout_for(DASHBOARD_PART_TIMEOUT_SECONDS))
+
+    return {**results, "partial": bool(errors), "missing": errors}
+
+# ==================== STATE SNAPSHOTS ====================
+
+SNAPSHOT_MAGIC = b"LFSNAP1\n"
+SNAPSHOT_CHUNK_SIZE = 5000
+
+def pickle_chunk(chunk: list) -> bytes:
+    # Runs off the event loop, so a handler can add a key to a document while
+    # it is being pickled; that raises RuntimeError, and a second try usually wins
+    for _ in range(2):
+        try:
+            return pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL)
+        except RuntimeError:
+            pass
+    return pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL)
+
+def write_snapshot_file(path: str, sections: List[tuple]) -> int:
+    """
+    Pickle and compress each section's (key, value) pairs in chunks of
+    SNAPSHOT_CHUNK_SIZE into a temp file, then atomically replace path
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        for name, items in sections:
+            name_bytes = name.encode()
+            for start in range(0, len(items), SNAPSHOT_CHUNK_SIZE):
+                payload = pickle_chunk(items[start:start + SNAPSHOT_CHUNK_SIZE])
+                data = zlib.compress(payload, 1)
+                f.write(struct.pack("<HI", len(name_bytes), len(data)))
+                f.write(name_bytes)
+                f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+def read_snapshot_file(path: str):
+    """Yield (section, [(key, value), ...], pickled_size) for each chunk of a snapshot file"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise ValueError(f"{path} is not a LearnFlow state snapshot")
+
+    offset = len(SNAPSHOT_MAGIC)
+    while offset < len(data):
+        name_length, size = struct.unpack_from("<HI", data, offset)
+        offset += 6
+        name = data[offset:offset + name_length].decode()
+        offset += name_length
+        payload = zlib.decompress(data[offset:offset + size])
+        offset += size
+        yield name, pickle.loads(payload), len(payload)
+
+@contextmanager
+def gc_paused():
+    """
+    Hold off cyclic GC while building or copying many small containers;
+    collections triggered part-way would walk the whole heap, and dominate
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+def _restore_store(store: BoundedStore):
+    def restore(items, pickled_size):
+        store.load(items, size_hint=pickled_size // max(1, len(items)))
+    return restore
+
+def _restore_users(items, pickled_size):
+    _restore_store(users_db)(items, pickled_size)
+    for email, user in items:
+        user_emails[user["id"]] = email
+
+def _restore_recent_activity(items, pickled_size):
+    for user_id, events in items:
+        activity_for(user_id).extend(events)
+
+def _restore_semantic_cache(items, pickled_size):
+    for question, answer in items:
+        semantic_cache.insert(question, answer)
+
+# name -> (iterator over (key, value) pairs, restore function taking a chunk and its pickled size)
+STATE_SECTIONS = {
+    "users": (lambda: users_db.dump_items(), _restore_users),
+    "progress": (lambda: progress_db.dump_items(), _restore_store(progress_db)),
+    "recent_activity": (lambda: ((k, list(v)) for k, v in list(recent_activity.items())), _restore_recent_activity),
+    "semantic_cache": (lambda: iter(semantic_cache.entries()), _restore_semantic_cache),
+}
+
+class StateSnapshotter:
+    """
+    Periodically writes the gateway's in-memory state to a compact snapshot
+    file and restores it at startup. The event loop only copies each
+    section's (key, value) pairs into a list; pickling, compression and the
+    atomic file replace happen in a worker thread. Values are shared with the
+    live stores, so a document updated mid-write may be captured either way.
+    """
+
+    def __init__(self, path: str, interval_seconds: float = 60.0, sections: Optional[dict] = None):
+        self.path = path
+        self.interval_seconds = interval_seconds
+        self.sections = sections if sections is not None else STATE_SECTIONS
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.stats = {"written": 0, "failures": 0, "last_written_at": None, "last_write_ms": 0.0,
+                      "last_bytes": 0, "last_entries": 0, "restored_entries": 0, "restore_ms": 0.0}
+
+    async def write(self):
+        async with self._lock:
+            start = time.perf_counter()
+            with gc_paused():
+                sections = [(name, list(dump())) for name, (dump, _) in self.sections.items()]
+            entries = sum(len(items) for _, items in sections)
+
+            size = await asyncio.to_thread(write_snapshot_file, self.path, sections)
+            self.stats.update({
+                "written": self.stats["written"] + 1,
+                "last_written_at": datetime.utcnow().isoformat(),
+                "last_write_ms": (time.perf_counter() - start) * 1000,
+                "last_bytes": size,
+                "last_entries": entries,
+            })
+
+    def restore(self) -> int:
+        """Load the snapshot into the live stores; returns the number of entries restored"""
+        if not os.path.exists(self.path):
+            return 0
+        start = time.perf_counter()
+        restored = 0
+        with gc_paused():
+            for name, items, pickled_size in read_snapshot_file(self.path):
+                if name in self.sections:
+                    self.sections[name][1](items, pickled_size)
+                    restored += len(items)
+        self.stats["restored_entries"] = restored
+        self.stats["restore_ms"] = (time.perf_counter() - start) * 1000
+        return restored
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.write()
+            except Exception as e:
+                self.stats["failures"] += 1
+                logger.warning("state snapshot failed: %s", e)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Final snapshot so a planned restart loses nothing
+        await self.write()
+
+    def snapshot(self) -> dict:
+        return {"enabled": bool(self.path), "path": self.path, **self.stats}
+
+state_snapshotter = StateSnapshotter(STATE_SNAPSHOT_PATH, STATE_SNAPSHOT_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def restore_state():
+    if STATE_SNAPSHOT_PATH:
+        try:
+            restored = state_snapshotter.restore()
+            logger.info("restored %d entries from %s in %.0f ms", restored, STATE_SNAPSHOT_PATH,
+                        state_snapshotter.stats["restore_ms"])
+        except Exception as e:
+            logger.warning("could not restore state snapshot %s: %s", STATE_SNAPSHOT_PATH, e)
+        state_snapshotter.start()
+
+@app.on_event("shutdown")
+async def snapshot_state():
+    if STATE_SNAPSHOT_PATH:
+        await state_snapshotter.stop()
+
 # ==================== HEALTH CHECK ====================
 
 @app.get("/health")
@@ -540,6 +3239,24 @@ async def health_check():
         "timestamp": datetime.utcnow().isoformat()
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Gateway resilience and performance gauges"""
+    return {
+        "openrouter_circuit": openrouter_breaker.snapshot(),
+        "openrouter_concurrency": llm_limiter.snapshot(),
+        "work_scheduler": work_scheduler.snapshot(),
+        "idempotency": idempotency_store.snapshot(),
+        "session_kernels": kernel_manager.snapshot(),
+        "stores": {"users": users_db.snapshot(), "progress": progress_db.snapshot()},
+        "state_snapshots": state_snapshotter.snapshot(),
+        "progress_sync": progress_sync.snapshot(),
+        "semantic_cache": semantic_cache.snapshot(),
+        "explanation_cache": explanation_cache.snapshot(),
+        "explanation_prefetch": explanation_prefetcher.snapshot(),
+        "model_routing": model_router.snapshot()
+    }
+
 @app.get("/")
 async def root():
     return {
@@ -0,0 +1,161 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Optional
+
+
+class BoundedStore(MutableMapping):
+    """
+    Dict-like store that keeps at most `memory_budget_bytes` of values in
+    memory. Over budget, the least recently used entries are pickled into a
+    SQLite spill file and reloaded transparently on their next access.
+    Entry sizes are their pickled size, re-measured after a value has been
+    handed out, since callers update documents in place.
+    """
+
+    def __init__(self, name: str, memory_budget_bytes: int, spill_dir: Optional[str] = None):
+        self.name = name
+        self.memory_budget_bytes = memory_budget_bytes
+        self.memory_bytes = 0
+        self._memory: "OrderedDict" = OrderedDict()
+        self._sizes: dict = {}
+        self._dirty: set = set()
+        self._disk_count = 0
+        self.stats = {"hits": 0, "reloads": 0, "evictions": 0}
+
+        self.spill_path = os.path.join(spill_dir or tempfile.gettempdir(), f"learnflow-{name}-{os.getpid()}.sqlite")
+        self._disk = sqlite3.connect(self.spill_path, check_same_thread=False, isolation_level=None)
+        self._disk.execute("PRAGMA synchronous=OFF")
+        # Spilled entries only make sense for the process that wrote them
+        self._disk.execute("DROP TABLE IF EXISTS spill")
+        self._disk.execute("CREATE TABLE spill (key BLOB PRIMARY KEY, value BLOB)")
+
+    @staticmethod
+    def _disk_key(key) -> bytes:
+        return pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+
+    def _measure(self, key):
+        size = len(pickle.dumps(self._memory[key], pickle.HIGHEST_PROTOCOL))
+        self.memory_bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+
+    def _drop_from_disk(self, key) -> bool:
+        if not self._disk_count:
+            return False
+        removed = self._disk.execute("DELETE FROM spill WHERE key = ?", (self._disk_key(key),)).rowcount
+        self._disk_count -= removed
+        return removed > 0
+
+    def _enforce_budget(self, keep):
+        for key in self._dirty:
+            if key in self._memory:
+                self._measure(key)
+        self._dirty.clear()
+
+        while self.memory_bytes > self.memory_budget_bytes and len(self._memory) > 1:
+            key = next(iter(self._memory))
+            if key == keep:
+                self._memory.move_to_end(key)
+                continue
+            value = self._memory.pop(key)
+            self.memory_bytes -= self._sizes.pop(key)
+            self._disk.execute("INSERT OR REPLACE INTO spill VALUES (?, ?)",
+                               (self._disk_key(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+            self._disk_count += 1
+            self.stats["evictions"] += 1
+
+    def __getitem__(self, key):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self._dirty.add(key)
+            self.stats["hits"] += 1
+            return self._memory[key]
+
+        if not self._disk_count:
+            raise KeyError(key)
+        row = self._disk.execute("SELECT value FROM spill WHERE key = ?", (self._disk_key(key),)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        self._drop_from_disk(key)
+        self.stats["reloads"] += 1
+
+        value = pickle.loads(row[0])
+        self._memory[key] = value
+        self._measure(key)
+        self._dirty.add(key)
+        self._enforce_budget(keep=key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self._memory:
+            self._drop_from_disk(key)
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        self._dirty.discard(key)
+        self._measure(key)
+        self._enforce_budget(keep=key)
+
+    def __delitem__(self, key):
+        if key in self._memory:
+            del self._memory[key]
+            self.memory_bytes -= self._sizes.pop(key)
+            self._dirty.discard(key)
+        elif not self._drop_from_disk(key):
+            raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        if key in self._memory:
+            return True
+        return self._disk_count > 0 and self._disk.execute("SELECT 1 FROM spill WHERE key = ?", (self._disk_key(key),)).fetchone() is not None
+
+    def __iter__(self):
+        keys = list(self._memory)
+        if self._disk_count:
+            keys.extend(pickle.loads(key) for (key,) in self._disk.execute("SELECT key FROM spill"))
+        return iter(keys)
+
+    def load(self, items, size_hint: int):
+        """
+        Bulk insert, charging each entry size_hint bytes instead of measuring it
+        (entries are re-measured once they are accessed). Used when restoring.
+        """
+        if self._disk_count:
+            for key, _ in items:
+                self._drop_from_disk(key)
+        replaced = sum(self._sizes.get(key, 0) for key, _ in items)
+        self._memory.update(items)
+        self._sizes.update((key, size_hint) for key, _ in items)
+        self.memory_bytes += size_hint * len(items) - replaced
+        self._enforce_budget(keep=None)
+
+    def __len__(self) -> int:
+        return len(self._memory) + self._disk_count
+
+    def dump_items(self):
+        """
+        Yield every (key, value) without touching recency or reloading spilled
+        entries. Keys are fixed when iteration starts, and each is read from
+        wherever it lives at the time, so this is safe to interleave with writes.
+        """
+        keys = list(self._memory)
+        keys.extend(pickle.loads(key) for (key,) in self._disk.execute("SELECT key FROM spill").fetchall())
+        for key in keys:
+            if key in self._memory:
+                yield key, self._memory[key]
+                continue
+            row = self._disk.execute("SELECT value FROM spill WHERE key = ?", (self._disk_key(key),)).fetchone()
+            if row is not None:
+                yield key, pickle.loads(row[0])
+
+    def snapshot(self) -> dict:
+        self._enforce_budget(keep=None)
+        return {
+            "entries_in_memory": len(self._memory),
+            "entries_on_disk": self._disk_count,
+            "memory_bytes": self.memory_bytes,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            **self.stats,
+        }
@@ -1,12 +1,17 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import os
+import sys
 import subprocess
 import tempfile
 import ast
 import json
 from app.config import settings
 
+# Shared modules live next to the services, in services/shared
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from shared.dispatch import AgentConsumer, DaprBroker, local_broker, request_topic  # noqa: E402
+
 app = FastAPI(title=settings.APP_NAME)
 
 class ReviewRequest(BaseModel):
@@ -86,6 +91,29 @@ async def review_code(request: ReviewRequest):
         summary=summary
     )
 
+# Requests dispatched by triage in pub/sub mode (DISPATCH_MODE=pubsub)
+if settings.ALL_IN_ONE:
+    dispatch_consumer = AgentConsumer(local_broker, settings.APP_NAME, app)
+    dispatch_consumer.subscribe()
+else:
+    dispatch_consumer = AgentConsumer(DaprBroker(settings.DAPR_HTTP_PORT, settings.PUBSUB_NAME), settings.APP_NAME, app)
+
+@app.get("/dapr/subscribe")
+async def dapr_subscribe():
+    """Dapr subscriptions: this agent's dispatch request topic"""
+    return [{"pubsubname": settings.PUBSUB_NAME, "topic": request_topic(settings.APP_NAME), "route": "/dispatch/requests"}]
+
+@app.post("/dispatch/requests")
+async def dispatch_request(event: dict):
+    """Requests from triage delivered by Dapr, wrapped in a CloudEvent; the answer goes to their reply topic"""
+    await dispatch_consumer.handle(event.get("data", event))
+    return {"status": "SUCCESS"}
+
+@app.on_event("shutdown")
+async def close_dispatch_consumer():
+    await dispatch_consumer.close()
+    await dispatch_consumer.broker.close()
+
 @app.get("/health")
 async def health():
     return {"status": "healthy", "service": settings.APP_NAME}
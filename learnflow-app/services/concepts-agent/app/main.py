@@ -1,10 +1,15 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import os
+import sys
 import asyncio
 import json
 from app.config import settings
 
+# Shared modules live next to the services, in services/shared
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from shared.dispatch import AgentConsumer, DaprBroker, local_broker, request_topic  # noqa: E402
+
 app = FastAPI(title=settings.APP_NAME)
 
 class ExplainRequest(BaseModel):
@@ -18,36 +23,68 @@ class ExplanationResponse(BaseModel):
     examples: list[str]
     level: str
 
-@app.post("/explain")
-async def explain_concept(request: ExplainRequest):
+LEVELS = ("beginner", "intermediate", "advanced")
+
+def render_explanation(topic: str, level: str) -> ExplanationResponse:
     """
-    Generate Python concept explanation with examples
+    Render the explanation for a topic at a level. Deterministic, so the
+    curriculum export can pre-render it into static bundles.
     """
     # In a real implementation, this would call an LLM API
     # For now, we'll return a simulated response
 
     # Generate a response based on the requested level
     level_descriptions = {
-        "beginner": f"For beginners, {request.topic} is a fundamental concept in Python. It allows you to {request.topic.replace('_', ' ')} in a simple way.",
-        "intermediate": f"At an intermediate level, {request.topic} involves more complex usage patterns and best practices that help write more efficient code.",
-        "advanced": f"For advanced users, {request.topic} has sophisticated applications including performance optimizations and integration with other Python features."
+        "beginner": f"For beginners, {topic} is a fundamental concept in Python. It allows you to {topic.replace('_', ' ')} in a simple way.",
+        "intermediate": f"At an intermediate level, {topic} involves more complex usage patterns and best practices that help write more efficient code.",
+        "advanced": f"For advanced users, {topic} has sophisticated applications including performance optimizations and integration with other Python features."
     }
 
     level_examples = {
-        "beginner": [f"# Simple example of {request.topic}", f"print('Hello world')"],
-        "intermediate": [f"# Intermediate example of {request.topic}", f"def example():", "    # Implementation here", "    pass"],
-        "advanced": [f"# Advanced example of {request.topic}", f"class AdvancedExample:", "    def __init__(self):", "        # Complex implementation", "        pass"]
+        "beginner": [f"# Simple example of {topic}", f"print('Hello world')"],
+        "intermediate": [f"# Intermediate example of {topic}", f"def example():", "    # Implementation here", "    pass"],
+        "advanced": [f"# Advanced example of {topic}", f"class AdvancedExample:", "    def __init__(self):", "        # Complex implementation", "        pass"]
     }
 
-    # In a real implementation, this would publish to Kafka
-    # For now, we'll return the explanation
     return ExplanationResponse(
-        topic=request.topic,
-        explanation=level_descriptions.get(request.level, level_descriptions["intermediate"]),
-        examples=level_examples.get(request.level, level_examples["intermediate"]),
-        level=request.level
+        topic=topic,
+        explanation=level_descriptions.get(level, level_descriptions["intermediate"]),
+        examples=level_examples.get(level, level_examples["intermediate"]),
+        level=level
     )
 
+@app.post("/explain")
+async def explain_concept(request: ExplainRequest):
+    """
+    Generate Python concept explanation with examples
+    """
+    # In a real implementation, this would publish to Kafka
+    # For now, we'll return the explanation
+    return render_explanation(request.topic, request.level)
+
+# Requests dispatched by triage in pub/sub mode (DISPATCH_MODE=pubsub)
+if settings.ALL_IN_ONE:
+    dispatch_consumer = AgentConsumer(local_broker, settings.APP_NAME, app)
+    dispatch_consumer.subscribe()
+else:
+    dispatch_consumer = AgentConsumer(DaprBroker(settings.DAPR_HTTP_PORT, settings.PUBSUB_NAME), settings.APP_NAME, app)
+
+@app.get("/dapr/subscribe")
+async def dapr_subscribe():
+    """Dapr subscriptions: this agent's dispatch request topic"""
+    return [{"pubsubname": settings.PUBSUB_NAME, "topic": request_topic(settings.APP_NAME), "route": "/dispatch/requests"}]
+
+@app.post("/dispatch/requests")
+async def dispatch_request(event: dict):
+    """Requests from triage delivered by Dapr, wrapped in a CloudEvent; the answer goes to their reply topic"""
+    await dispatch_consumer.handle(event.get("data", event))
+    return {"status": "SUCCESS"}
+
+@app.on_event("shutdown")
+async def close_dispatch_consumer():
+    await dispatch_consumer.close()
+    await dispatch_consumer.broker.close()
+
 @app.get("/health")
 async def health():
     return {"status": "healthy", "service": settings.APP_NAME}
@@ -1,10 +1,15 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-import requests
 import logging
 import json
+import os
+import sys
 from typing import Optional
 
+# Shared modules live next to the services, in services/shared
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from shared.deadlines import DeadlineExceeded, dapr_request, install_deadlines  # noqa: E402
+
 app = FastAPI(title="course-agent", description="FastAPI service with Dapr integration")
 
 # Dapr configuration
@@ -15,6 +20,8 @@ DAPR_PUBSUB_NAME = "pubsub"
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+install_deadlines(app)
+
 
 class Message(BaseModel):
     topic: str
@@ -78,7 +85,7 @@ async def generate_lesson(request: LessonRequest):
             "key": f"lesson_{lesson_id}",
             "value": lesson
         }
-        state_response = requests.post(state_url, json=[state_item])
+        state_response = await dapr_request("POST", state_url, json=[state_item])
 
         if state_response.status_code != 200:
             raise HTTPException(status_code=state_response.status_code, detail="Failed to save lesson to state store")
@@ -92,7 +99,7 @@ async def generate_lesson(request: LessonRequest):
         }
 
         publish_url = f"{DAPR_HTTP_ENDPOINT}/v1.0/publish/{DAPR_PUBSUB_NAME}/lesson-generated"
-        publish_response = requests.post(publish_url, json=event_data)
+        publish_response = await dapr_request("POST", publish_url, json=event_data)
 
         if publish_response.status_code != 200:
             logger.warning(f"Failed to publish lesson-generated event: {publish_response.status_code}")
@@ -108,6 +115,8 @@ async def generate_lesson(request: LessonRequest):
             user_id=request.user_id,
             created_at=datetime.now().isoformat()
         )
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error generating lesson: {e}")
         raise HTTPException(status_code=500, detail=f"Error generating lesson: {str(e)}")
@@ -160,13 +169,15 @@ async def save_state(key: str, value: dict):
             "key": key,
             "value": value
         }
-        response = requests.post(url, json=[state_item])
+        response = await dapr_request("POST", url, json=[state_item])
         
         if response.status_code == 200:
             logger.info(f"State saved: {key}")
             return {"success": True, "key": key}
         else:
             raise HTTPException(status_code=response.status_code, detail="Failed to save state")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error saving state: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -177,7 +188,7 @@ async def get_state(key: str):
     """Get state using Dapr state store"""
     try:
         url = f"{DAPR_HTTP_ENDPOINT}/v1.0/state/{DAPR_STATE_STORE}/{key}"
-        response = requests.get(url)
+        response = await dapr_request("GET", url)
         
         if response.status_code == 200:
             value = response.json()
@@ -187,6 +198,8 @@ async def get_state(key: str):
             return {"key": key, "value": None}
         else:
             raise HTTPException(status_code=response.status_code, detail="Failed to get state")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error getting state: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -198,13 +211,15 @@ async def publish_message(message: Message):
     """Publish a message using Dapr pub/sub"""
     try:
         url = f"{DAPR_HTTP_ENDPOINT}/v1.0/publish/{DAPR_PUBSUB_NAME}/{message.topic}"
-        response = requests.post(url, json=message.data)
+        response = await dapr_request("POST", url, json=message.data)
         
         if response.status_code == 200:
             logger.info(f"Message published to topic: {message.topic}")
             return {"success": True, "topic": message.topic}
         else:
             raise HTTPException(status_code=response.status_code, detail="Failed to publish message")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error publishing message: {e}")
         raise HTTPException(status_code=500, detail=str(e))
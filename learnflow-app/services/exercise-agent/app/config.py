@@ -4,5 +4,10 @@ class Settings:
     APP_NAME: str = os.getenv("APP_NAME", "exercise-agent")
     APP_PORT: int = int(os.getenv("APP_PORT", "8005"))
     DEBUG: bool = os.getenv("DEBUG", "false").lower() == "true"
+    # Dapr sidecar and pub/sub component for requests dispatched by triage
+    DAPR_HTTP_PORT: int = int(os.getenv("DAPR_HTTP_PORT", "3500"))
+    PUBSUB_NAME: str = os.getenv("PUBSUB_NAME", "pubsub")
+    # Mounted in the gateway's process; triage's requests arrive over the in-process broker
+    ALL_IN_ONE: bool = os.getenv("ALL_IN_ONE", "false").lower() == "true"
 
 settings = Settings()
@@ -1,6 +1,7 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import os
+import sys
 import subprocess
 import tempfile
 import json
@@ -12,6 +13,10 @@ except ImportError:
     resource = None  # resource module is not available on Windows
 from app.config import settings
 
+# Shared modules live next to the services, in services/shared
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from shared.dispatch import AgentConsumer, DaprBroker, local_broker, request_topic  # noqa: E402
+
 app = FastAPI(title=settings.APP_NAME)
 
 class ExerciseRequest(BaseModel):
@@ -19,6 +24,7 @@ class ExerciseRequest(BaseModel):
     topic: str
     difficulty: str = "intermediate"  # beginner, intermediate, advanced
     user_id: str = ""
+    context: dict = {}
 
 class SubmissionRequest(BaseModel):
     quiz_id: str
@@ -42,6 +48,37 @@ class GradeResponse(BaseModel):
     passed_tests: int
     total_tests: int
 
+# Exercise statements per module and topic (module keys are lowercase)
+EXERCISES = {
+    "basics": {
+        "variables": {
+            "problem": "Create a variable called 'name' and assign it your name, then print it.",
+            "starter_code": "# Create a variable called 'name' and assign it your name\n# Then print it\n",
+            "test_cases": [
+                {"input": "", "expected_output": "Alice\\n"},
+                {"input": "", "expected_output": "Bob\\n"}
+            ]
+        },
+        "loops": {
+            "problem": "Write a for loop that prints numbers 1 to 5.",
+            "starter_code": "# Write a for loop that prints numbers 1 to 5\n",
+            "test_cases": [
+                {"input": "", "expected_output": "1\\n2\\n3\\n4\\n5\\n"}
+            ]
+        }
+    },
+    "functions": {
+        "basic": {
+            "problem": "Write a function called 'greet' that takes a name and returns 'Hello, {name}!'",
+            "starter_code": "def greet(name):\n    # Your code here\n    pass\n",
+            "test_cases": [
+                {"input": "Alice", "expected_output": "Hello, Alice!\\n"},
+                {"input": "Bob", "expected_output": "Hello, Bob!\\n"}
+            ]
+        }
+    }
+}
+
 @app.post("/generate")
 async def generate_exercise(request: ExerciseRequest):
     """
@@ -50,38 +87,8 @@ async def generate_exercise(request: ExerciseRequest):
     # In a real implementation, this would use an LLM to generate exercises
     # For now, we'll return a simulated exercise based on topic
 
-    exercises_db = {
-        "basics": {
-            "variables": {
-                "problem": "Create a variable called 'name' and assign it your name, then print it.",
-                "starter_code": "# Create a variable called 'name' and assign it your name\n# Then print it\n",
-                "test_cases": [
-                    {"input": "", "expected_output": "Alice\\n"},
-                    {"input": "", "expected_output": "Bob\\n"}
-                ]
-            },
-            "loops": {
-                "problem": "Write a for loop that prints numbers 1 to 5.",
-                "starter_code": "# Write a for loop that prints numbers 1 to 5\n",
-                "test_cases": [
-                    {"input": "", "expected_output": "1\\n2\\n3\\n4\\n5\\n"}
-                ]
-            }
-        },
-        "functions": {
-            "basic": {
-                "problem": "Write a function called 'greet' that takes a name and returns 'Hello, {name}!'",
-                "starter_code": "def greet(name):\n    # Your code here\n    pass\n",
-                "test_cases": [
-                    {"input": "Alice", "expected_output": "Hello, Alice!\\n"},
-                    {"input": "Bob", "expected_output": "Hello, Bob!\\n"}
-                ]
-            }
-        }
-    }
-
     # Find the appropriate exercise
-    module_exercises = exercises_db.get(request.module.lower(), {})
+    module_exercises = EXERCISES.get(request.module.lower(), {})
     topic_exercise = module_exercises.get(request.topic.lower(), None)
 
     if not topic_exercise:
@@ -182,6 +189,29 @@ async def grade_submission(request: SubmissionRequest):
             total_tests=1
         )
 
+# Requests dispatched by triage in pub/sub mode (DISPATCH_MODE=pubsub)
+if settings.ALL_IN_ONE:
+    dispatch_consumer = AgentConsumer(local_broker, settings.APP_NAME, app)
+    dispatch_consumer.subscribe()
+else:
+    dispatch_consumer = AgentConsumer(DaprBroker(settings.DAPR_HTTP_PORT, settings.PUBSUB_NAME), settings.APP_NAME, app)
+
+@app.get("/dapr/subscribe")
+async def dapr_subscribe():
+    """Dapr subscriptions: this agent's dispatch request topic"""
+    return [{"pubsubname": settings.PUBSUB_NAME, "topic": request_topic(settings.APP_NAME), "route": "/dispatch/requests"}]
+
+@app.post("/dispatch/requests")
+async def dispatch_request(event: dict):
+    """Requests from triage delivered by Dapr, wrapped in a CloudEvent; the answer goes to their reply topic"""
+    await dispatch_consumer.handle(event.get("data", event))
+    return {"status": "SUCCESS"}
+
+@app.on_event("shutdown")
+async def close_dispatch_consumer():
+    await dispatch_consumer.close()
+    await dispatch_consumer.broker.close()
+
 @app.get("/health")
 async def health():
     return {"status": "healthy", "service": settings.APP_NAME}
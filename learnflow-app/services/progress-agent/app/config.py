@@ -1,8 +1,13 @@
 import os
+from typing import Optional
 
 class Settings:
     APP_NAME: str = os.getenv("APP_NAME", "progress-agent")
     APP_PORT: int = int(os.getenv("APP_PORT", "8006"))
     DEBUG: bool = os.getenv("DEBUG", "false").lower() == "true"
+    # Memory budgets for the in-memory stores; colder entries spill to disk
+    PROGRESS_STORE_MEMORY_MB: float = float(os.getenv("PROGRESS_STORE_MEMORY_MB", "128"))
+    STRUGGLE_STORE_MEMORY_MB: float = float(os.getenv("STRUGGLE_STORE_MEMORY_MB", "32"))
+    STORE_SPILL_DIR: Optional[str] = os.getenv("STORE_SPILL_DIR") or None
 
 settings = Settings()
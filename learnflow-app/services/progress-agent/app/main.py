@@ -1,12 +1,19 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import os
+import sys
 import json
 import time
 from typing import Dict, List, Optional
 from app.config import settings
+from app.fast_json import FastJSONRoute
+
+# Shared modules live next to the services, in services/shared
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from shared.bounded_store import BoundedStore  # noqa: E402
 
 app = FastAPI(title=settings.APP_NAME)
+app.router.route_class = FastJSONRoute
 
 class ProgressUpdateRequest(BaseModel):
     user_id: str
@@ -15,6 +22,10 @@ class ProgressUpdateRequest(BaseModel):
     activity_type: str  # 'exercise', 'quiz', 'code_review', 'concept_learning'
     score: float  # 0.0 to 1.0
     details: dict = {}
+    occurrences: int = 1  # number of coalesced activities this update stands for
+
+class TrackBatchRequest(BaseModel):
+    updates: List[ProgressUpdateRequest]
 
 class StruggleDetectionRequest(BaseModel):
     user_id: str
@@ -37,9 +48,10 @@ class ClassOverviewResponse(BaseModel):
     student_progress: List[dict]
     struggle_alerts: List[dict]
 
-# In-memory storage (would be PostgreSQL in real implementation)
-student_progress_db: Dict[str, Dict] = {}
-struggle_events_db: List[dict] = []
+# In-memory storage (would be PostgreSQL in real implementation); cold entries spill to disk
+student_progress_db = BoundedStore("student-progress", int(settings.PROGRESS_STORE_MEMORY_MB * 1024 * 1024), settings.STORE_SPILL_DIR)
+# Keyed by event id
+struggle_events_db = BoundedStore("struggle-events", int(settings.STRUGGLE_STORE_MEMORY_MB * 1024 * 1024), settings.STORE_SPILL_DIR)
 
 @app.get("/progress/{user_id}")
 async def get_progress(user_id: str):
@@ -56,10 +68,10 @@ async def get_progress(user_id: str):
             "overall_mastery": 0.0
         }
 
-@app.post("/track")
-async def track_activity(request: ProgressUpdateRequest):
+def apply_progress_update(request: ProgressUpdateRequest) -> dict:
     """
-    Track student learning activities and update progress
+    Apply one activity to the student's topic progress and return the topic entry.
+    Overall mastery is left for the caller to recalculate.
     """
     # Create user entry if not exists
     if request.user_id not in student_progress_db:
@@ -96,7 +108,7 @@ async def track_activity(request: ProgressUpdateRequest):
         topic_progress["code_quality"] = max(topic_progress["code_quality"], request.score)
     elif request.activity_type == "concept_learning":
         # For concept learning, we might just track consistency
-        topic_progress["consistency_score"] = min(1.0, topic_progress["consistency_score"] + 0.1)
+        topic_progress["consistency_score"] = min(1.0, topic_progress["consistency_score"] + 0.1 * max(1, request.occurrences))
 
     # Recalculate mastery score using weighted formula
     # Mastery = (exercise_completion * 0.4) + (quiz_score * 0.3) + (code_quality * 0.2) + (consistency * 0.1)
@@ -108,8 +120,11 @@ async def track_activity(request: ProgressUpdateRequest):
     )
 
     topic_progress["last_updated"] = time.strftime('%Y-%m-%d %H:%M:%S')
+    return topic_progress
 
-    # Calculate overall user mastery (not class mastery)
+def recalculate_overall_mastery(user_id: str):
+    """Calculate overall user mastery (not class mastery)"""
+    user_progress = student_progress_db[user_id]
     all_scores = []
     for module_name, module_data in user_progress["modules"].items():
         for topic_name, topic_data in module_data.items():
@@ -118,6 +133,14 @@ async def track_activity(request: ProgressUpdateRequest):
     if all_scores:
         user_progress["overall_mastery"] = sum(all_scores) / len(all_scores)
 
+@app.post("/track", response_model=ProgressResponse)
+async def track_activity(request: ProgressUpdateRequest):
+    """
+    Track student learning activities and update progress
+    """
+    topic_progress = apply_progress_update(request)
+    recalculate_overall_mastery(request.user_id)
+
     # Return updated progress
     return ProgressResponse(
         user_id=request.user_id,
@@ -131,6 +154,22 @@ async def track_activity(request: ProgressUpdateRequest):
         last_updated=topic_progress["last_updated"]
     )
 
+@app.post("/track/batch")
+async def track_activity_batch(request: TrackBatchRequest):
+    """
+    Apply a batch of (possibly coalesced) activity updates, recalculating
+    each affected student's overall mastery once
+    """
+    touched_users = set()
+    for update in request.updates:
+        apply_progress_update(update)
+        touched_users.add(update.user_id)
+
+    for user_id in touched_users:
+        recalculate_overall_mastery(user_id)
+
+    return {"status": "tracked", "applied": len(request.updates), "users": len(touched_users)}
+
 @app.post("/detect-struggle")
 async def detect_struggle(request: StruggleDetectionRequest):
     """
@@ -145,11 +184,12 @@ async def detect_struggle(request: StruggleDetectionRequest):
         "resolved": False
     }
 
-    struggle_events_db.append(struggle_event)
+    event_id = len(struggle_events_db) + 1
+    struggle_events_db[event_id] = struggle_event
 
     # In a real implementation, this would publish to Kafka
     # For now, we just return success
-    return {"status": "struggle_detected", "event_id": len(struggle_events_db)}
+    return {"status": "struggle_detected", "event_id": event_id}
 
 @app.get("/class-overview")
 async def get_class_overview():
@@ -188,7 +228,7 @@ async def get_class_overview():
         })
 
     # Get unresolved struggle alerts
-    unresolved_alerts = [event for event in struggle_events_db if not event["resolved"]]
+    unresolved_alerts = [event for event in struggle_events_db.values() if not event["resolved"]]
 
     return ClassOverviewResponse(
         class_stats={
@@ -200,6 +240,16 @@ async def get_class_overview():
         struggle_alerts=unresolved_alerts
     )
 
+@app.get("/metrics")
+async def metrics():
+    """Memory usage of the in-memory stores"""
+    return {
+        "stores": {
+            "student_progress": student_progress_db.snapshot(),
+            "struggle_events": struggle_events_db.snapshot(),
+        }
+    }
+
 @app.get("/health")
 async def health():
     return {"status": "healthy", "service": settings.APP_NAME}
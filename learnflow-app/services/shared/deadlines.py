@@ -0,0 +1,87 @@
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Deadline propagation, shared by the Dapr-backed services (course-agent,
+# tutor-agent and user-progress)
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+DEFAULT_REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "10"))
+DAPR_TIMEOUT_SECONDS = float(os.getenv("DAPR_TIMEOUT_SECONDS", "5"))
+
+# Absolute time.monotonic() deadline of the request being handled
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the caller's deadline has passed and the work should be abandoned"""
+
+
+def header_budget(headers) -> Optional[float]:
+    """The caller's remaining budget from the deadline header, in seconds; None without a valid one"""
+    try:
+        return max(0.0, int(headers[DEADLINE_HEADER]) / 1000)
+    except (KeyError, ValueError):
+        return None
+
+
+def install_deadlines(app: FastAPI):
+    """
+    Give every request to app a deadline from the caller's header (or the
+    default budget), answer 504 once it passes, and close the Dapr client on
+    shutdown
+    """
+    @app.middleware("http")
+    async def enforce_deadline(request: Request, call_next):
+        budget = header_budget(request.headers)
+        if budget is None:
+            budget = DEFAULT_REQUEST_TIMEOUT_SECONDS
+        token = request_deadline.set(time.monotonic() + budget)
+        try:
+            return await asyncio.wait_for(call_next(request), timeout=budget)
+        except asyncio.TimeoutError:
+            return JSONResponse(status_code=504, content={"detail": "Request deadline exceeded"})
+        finally:
+            request_deadline.reset(token)
+
+    @app.exception_handler(DeadlineExceeded)
+    async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+        return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+    @app.on_event("shutdown")
+    async def close_dapr_client():
+        await dapr_client.aclose()
+
+
+def dapr_call_options() -> dict:
+    """Timeout and deadline header for a Dapr sidecar call, sized to the remaining budget"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return {"timeout": DAPR_TIMEOUT_SECONDS}
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return {
+        "timeout": min(DAPR_TIMEOUT_SECONDS, remaining),
+        "headers": {DEADLINE_HEADER: str(int(remaining * 1000))},
+    }
+
+
+dapr_client = httpx.AsyncClient()
+
+
+async def dapr_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Call the Dapr sidecar without blocking the event loop, so the call is
+    cancelled with the request when its deadline passes. A sidecar that
+    doesn't answer in time raises DeadlineExceeded.
+    """
+    try:
+        return await dapr_client.request(method, url, **dapr_call_options(), **kwargs)
+    except httpx.TimeoutException as e:
+        raise DeadlineExceeded("Dapr sidecar did not answer within the request deadline") from e
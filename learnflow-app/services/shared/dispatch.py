@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from .deadlines import DEADLINE_HEADER
+
+logger = logging.getLogger(__name__)
+
+CORRELATION_HEADER = "X-Correlation-ID"
+
+
+class DispatchError(Exception):
+    """The target agent failed or answered with an error"""
+
+
+class DispatchTimeout(DispatchError):
+    """The target agent did not answer in time"""
+
+
+def request_topic(agent: str) -> str:
+    return f"{agent}.requests"
+
+
+def deadline_ms(seconds: float) -> str:
+    return str(max(0, int(seconds * 1000)))
+
+
+class HTTPDispatcher:
+    """
+    Invokes agents directly, over one pooled HTTP client kept open for the
+    life of the process so connections to each agent are reused.
+    """
+
+    def __init__(self, agent_urls: Dict[str, str], timeout: float = 30.0, max_connections: int = 100):
+        self.agent_urls = agent_urls
+        self.timeout = timeout
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.stats = {"dispatched": 0, "failed": 0, "timeouts": 0}
+
+    async def dispatch(self, agent: str, path: str, body: dict, correlation_id: str,
+                       timeout: Optional[float] = None) -> dict:
+        """
+        timeout is the caller's remaining budget; it caps this dispatcher's own
+        timeout, and the agent is told what is left in the deadline header
+        """
+        url = self.agent_urls.get(agent)
+        if url is None:
+            raise DispatchError(f"No URL configured for {agent}")
+
+        budget = self.timeout if timeout is None else min(self.timeout, timeout)
+        headers = {CORRELATION_HEADER: correlation_id, DEADLINE_HEADER: deadline_ms(budget)}
+        self.stats["dispatched"] += 1
+        try:
+            response = await self.client.post(f"{url}{path}", json=body, headers=headers, timeout=budget)
+        except httpx.TimeoutException as e:
+            self.stats["timeouts"] += 1
+            raise DispatchTimeout(f"{agent} did not answer in time") from e
+        except httpx.HTTPError as e:
+            self.stats["failed"] += 1
+            raise DispatchError(f"{agent} is unreachable: {e}") from e
+
+        if response.status_code >= 400:
+            self.stats["failed"] += 1
+            raise DispatchError(f"{agent} returned {response.status_code}")
+        return response.json()
+
+    def snapshot(self) -> dict:
+        return {"mode": "http", **self.stats}
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class PubSubDispatcher:
+    """
+    Publishes each request to the agent's topic (`<agent>.requests`) with a
+    correlation id, this instance's reply topic and an absolute deadline, and
+    waits for the reply carrying the same correlation id. Agents drain their topic at their own
+    pace, so bursts queue in the broker instead of piling onto the agents.
+    """
+
+    def __init__(self, broker, reply_topic: str, timeout: float = 30.0):
+        self.broker = broker
+        self.reply_topic = reply_topic
+        self.timeout = timeout
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.stats = {"dispatched": 0, "failed": 0, "timeouts": 0, "late_replies": 0}
+
+    async def dispatch(self, agent: str, path: str, body: dict, correlation_id: str,
+                       timeout: Optional[float] = None) -> dict:
+        budget = self.timeout if timeout is None else min(self.timeout, timeout)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[correlation_id] = future
+        self.stats["dispatched"] += 1
+        try:
+            await self.broker.publish(request_topic(agent), {
+                "correlation_id": correlation_id,
+                "reply_topic": self.reply_topic,
+                # Wall-clock, so time spent queued in the broker counts against it
+                "deadline": time.time() + budget,
+                "path": path,
+                "body": body,
+            })
+            reply = await asyncio.wait_for(future, budget)
+        except asyncio.TimeoutError as e:
+            self.stats["timeouts"] += 1
+            raise DispatchTimeout(f"{agent} did not answer in time") from e
+        except httpx.HTTPError as e:
+            self.stats["failed"] += 1
+            raise DispatchError(f"Could not publish to {request_topic(agent)}: {e}") from e
+        finally:
+            self.pending.pop(correlation_id, None)
+
+        if reply.get("error"):
+            self.stats["failed"] += 1
+            raise DispatchError(reply["error"])
+        return reply.get("result", {})
+
+    async def handle_reply(self, reply: dict):
+        """Complete the waiting dispatch for a reply; replies nobody waits for any more are dropped"""
+        future = self.pending.get(reply.get("correlation_id"))
+        if future is None or future.done():
+            self.stats["late_replies"] += 1
+            return
+        future.set_result(reply)
+
+    def snapshot(self) -> dict:
+        return {"mode": "pubsub", "pending": len(self.pending), **self.stats}
+
+    async def close(self):
+        close = getattr(self.broker, "close", None)
+        if close is not None:
+            await close()
+
+
+class DaprBroker:
+    """
+    Publishes through the Dapr sidecar's pub/sub API (the `pubsub` component
+    in dapr/pubsub.yaml). Messages are delivered to subscribers by Dapr,
+    via the routes they declare in /dapr/subscribe.
+    """
+
+    def __init__(self, dapr_http_port: int = 3500, pubsub_name: str = "pubsub"):
+        self.publish_url = f"http://localhost:{dapr_http_port}/v1.0/publish/{pubsub_name}"
+        self.client = httpx.AsyncClient(timeout=10.0)
+
+    async def publish(self, topic: str, message: dict):
+        response = await self.client.post(f"{self.publish_url}/{topic}", json=message)
+        response.raise_for_status()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class InMemoryBroker:
+    """
+    Process-local stand-in for the Dapr pub/sub component, for tests and
+    single-process setups. Each topic is a queue drained by `concurrency`
+    workers, which hand every message to each of the topic's subscribers.
+    Messages published before anyone subscribes wait in the queue.
+    """
+
+    def __init__(self, concurrency: int = 4):
+        self.concurrency = concurrency
+        self.subscribers: Dict[str, List[Callable[[dict], Awaitable[None]]]] = {}
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.workers: List[asyncio.Task] = []
+
+    def subscribe(self, topic: str, handler: Callable[[dict], Awaitable[None]]):
+        self.subscribers.setdefault(topic, []).append(handler)
+
+    async def publish(self, topic: str, message: dict):
+        if topic not in self.queues:
+            # Workers start on first use so they run on the loop serving requests
+            self.queues[topic] = asyncio.Queue()
+            self.workers += [asyncio.create_task(self._drain(topic)) for _ in range(self.concurrency)]
+        self.queues[topic].put_nowait(message)
+
+    async def _drain(self, topic: str):
+        queue = self.queues[topic]
+        while True:
+            message = await queue.get()
+            for handler in list(self.subscribers.get(topic, [])):
+                try:
+                    await handler(message)
+                except Exception:
+                    logger.exception("Subscriber for %s failed", topic)
+            queue.task_done()
+
+    async def close(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+        self.queues.clear()
+
+
+# Broker for agents running in one process (the all-in-one image): triage
+# publishes requests and agents consume their topics here instead of through Dapr
+local_broker = InMemoryBroker()
+
+
+class AgentConsumer:
+    """
+    Serves an agent's request topic: each message is sent to the agent app
+    in-process at its `path` with the time left before its deadline, and the
+    result (or error) is published to the message's reply topic under the
+    same correlation id. Messages already past their deadline are answered
+    with an error without calling the agent.
+    """
+
+    def __init__(self, broker, agent: str, asgi_app):
+        self.broker = broker
+        self.agent = agent
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi_app), base_url=f"http://{agent}")
+
+    def subscribe(self):
+        self.broker.subscribe(request_topic(self.agent), self.handle)
+
+    async def handle(self, message: dict):
+        reply = {"correlation_id": message["correlation_id"]}
+        headers = {CORRELATION_HEADER: message["correlation_id"]}
+        if message.get("deadline") is not None:
+            remaining = message["deadline"] - time.time()
+            if remaining <= 0:
+                reply["error"] = f"{self.agent} received the request after its deadline"
+                await self.broker.publish(message["reply_topic"], reply)
+                return
+            headers[DEADLINE_HEADER] = deadline_ms(remaining)
+        try:
+            response = await self.client.post(message["path"], json=message["body"], headers=headers)
+            if response.status_code >= 400:
+                reply["error"] = f"{self.agent} returned {response.status_code}"
+            else:
+                reply["result"] = response.json()
+        except Exception as e:
+            reply["error"] = f"{self.agent} failed: {e}"
+        await self.broker.publish(message["reply_topic"], reply)
+
+    async def close(self):
+        await self.client.aclose()
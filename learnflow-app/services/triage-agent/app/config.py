@@ -1,8 +1,39 @@
 import os
+import socket
 
 class Settings:
     APP_NAME: str = os.getenv("APP_NAME", "triage-agent")
     APP_PORT: int = int(os.getenv("APP_PORT", "8001"))
     DEBUG: bool = os.getenv("DEBUG", "false").lower() == "true"
+    # Phrases, weights and target agent for keyword routing
+    ROUTING_TABLE_PATH: str = os.getenv("ROUTING_TABLE_PATH", os.path.join(os.path.dirname(__file__), "routing_table.json"))
+    # Intent classifier artifact (see train_intent_classifier.py); empty disables it
+    INTENT_MODEL_PATH: str = os.getenv("INTENT_MODEL_PATH", os.path.join(os.path.dirname(__file__), "intent_model.json"))
+    # Below this confidence the classifier's answer is ignored and keyword routing decides
+    INTENT_MIN_CONFIDENCE: float = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.35"))
+    QUERY_BATCH_MAX: int = int(os.getenv("QUERY_BATCH_MAX", "1000"))
+    # Routing decisions cached per normalized query; 0 disables the cache
+    ROUTING_CACHE_SIZE: int = int(os.getenv("ROUTING_CACHE_SIZE", "10000"))
+    # Per-user session memory used to route short follow-up questions to the previous agent
+    SESSION_TTL_SECONDS: float = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+    SESSION_MAX_USERS: int = int(os.getenv("SESSION_MAX_USERS", "10000"))
+    FOLLOW_UP_MAX_WORDS: int = int(os.getenv("FOLLOW_UP_MAX_WORDS", "6"))
+    # A follow-up with its own subject only overrides routing the classifier is less sure of than this
+    FOLLOW_UP_MAX_CONFIDENCE: float = float(os.getenv("FOLLOW_UP_MAX_CONFIDENCE", "0.5"))
+    # How /query/dispatch reaches agents: "http" (direct, pooled) or "pubsub" (Dapr topics)
+    DISPATCH_MODE: str = os.getenv("DISPATCH_MODE", "http")
+    # Agents mounted in the same process (the all-in-one image) are dispatched to over the in-process broker
+    ALL_IN_ONE: bool = os.getenv("ALL_IN_ONE", "false").lower() == "true"
+    DISPATCH_TIMEOUT_SECONDS: float = float(os.getenv("DISPATCH_TIMEOUT_SECONDS", "30"))
+    AGENT_URLS: dict = {
+        "concepts-agent": os.getenv("CONCEPTS_URL", "http://localhost:8002"),
+        "code-review-agent": os.getenv("CODE_REVIEW_URL", "http://localhost:8003"),
+        "debug-agent": os.getenv("DEBUG_URL", "http://localhost:8004"),
+        "exercise-agent": os.getenv("EXERCISE_URL", "http://localhost:8005"),
+    }
+    DAPR_HTTP_PORT: int = int(os.getenv("DAPR_HTTP_PORT", "3500"))
+    PUBSUB_NAME: str = os.getenv("PUBSUB_NAME", "pubsub")
+    # Replies must come back to the instance holding the pending request, so each gets its own topic
+    DISPATCH_REPLY_TOPIC: str = os.getenv("DISPATCH_REPLY_TOPIC", f"triage.replies.{socket.gethostname()}")
 
 settings = Settings()
@@ -0,0 +1,70 @@
+import functools
+import inspect
+import json
+
+import pydantic_core
+from fastapi import Request, Response
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+
+class FastJSONRequest(Request):
+    """Request whose JSON body is parsed by pydantic-core's Rust parser instead of json.loads"""
+
+    async def json(self):
+        if not hasattr(self, "_json"):
+            body = await self.body()
+            try:
+                self._json = pydantic_core.from_json(body)
+            except ValueError as e:
+                # FastAPI turns JSONDecodeError into its usual 422 json_invalid response
+                raise json.JSONDecodeError(str(e), body.decode("utf-8", "replace"), 0) from e
+        return self._json
+
+class FastJSONRoute(APIRoute):
+    """
+    Route class for the JSON endpoints. Request bodies are parsed with
+    pydantic-core, and when an endpoint returns an instance of exactly its
+    declared response_model it is written straight to JSON bytes with the
+    model's compiled serializer, skipping FastAPI's re-validation and
+    jsonable_encoder pass. Models, validation and OpenAPI are unchanged.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        response_model = kwargs.get("response_model")
+        plain = (
+            isinstance(response_model, type) and issubclass(response_model, BaseModel)
+            and isinstance(kwargs.get("response_class"), DefaultPlaceholder)
+            and not any(kwargs.get(option) for option in (
+                "response_model_include", "response_model_exclude", "response_model_exclude_unset",
+                "response_model_exclude_defaults", "response_model_exclude_none"))
+        )
+        if plain and inspect.iscoroutinefunction(endpoint):
+            endpoint = self._serialize_directly(endpoint, response_model)
+        super().__init__(path, endpoint, **kwargs)
+
+    @staticmethod
+    def _serialize_directly(endpoint, response_model):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            result = await endpoint(*args, **kwargs)
+            if type(result) is not response_model:
+                return result
+            response = Response(result.__pydantic_serializer__.to_json(result, by_alias=True),
+                                media_type="application/json")
+            # Carry over status and headers set on an injected Response parameter
+            for value in kwargs.values():
+                if isinstance(value, Response):
+                    if value.status_code:
+                        response.status_code = value.status_code
+                    response.headers.raw.extend(value.headers.raw)
+            return response
+        return wrapper
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def fast_handler(request: Request):
+            return await handler(FastJSONRequest(request.scope, request.receive))
+        return fast_handler
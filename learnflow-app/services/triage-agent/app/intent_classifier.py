@@ -0,0 +1,136 @@
+import hashlib
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+
+# Words that say nothing about intent on their own; a query needs at least one
+# known word outside this set to be classified
+STOP_WORDS = {"a", "an", "the", "is", "are", "was", "be", "it", "its", "this", "that", "i", "me", "my", "you",
+              "to", "of", "in", "on", "for", "and", "or", "with", "at", "by", "as", "so", "do", "does",
+              "can", "what", "how", "please", "ok", "okay"}
+
+
+def tokenize(query: str) -> List[str]:
+    """Lowercased word unigrams and bigrams"""
+    words = TOKEN_PATTERN.findall(query.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class IntentClassifier:
+    """
+    TF-IDF features over word unigrams and bigrams, followed by a linear
+    softmax layer mapping them to agents. Trained offline with `train` (see
+    train_intent_classifier.py) and loaded from a JSON artifact. A batch of
+    queries is scored with one matrix multiply.
+    """
+
+    def __init__(self, labels: List[str], vocabulary: List[str], idf, weights, bias, version: str = ""):
+        self.labels = list(labels)
+        self.vocabulary = {term: index for index, term in enumerate(vocabulary)}
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.weights = np.asarray(weights, dtype=np.float32).reshape(len(vocabulary), len(labels))
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.version = version
+
+    @classmethod
+    def from_file(cls, path: str) -> "IntentClassifier":
+        with open(path) as f:
+            artifact = json.load(f)
+        return cls(artifact["labels"], artifact["vocabulary"], artifact["idf"],
+                   artifact["weights"], artifact["bias"], artifact.get("version", ""))
+
+    def to_artifact(self) -> dict:
+        artifact = {
+            "labels": self.labels,
+            "vocabulary": sorted(self.vocabulary, key=self.vocabulary.get),
+            "idf": [round(float(v), 6) for v in self.idf],
+            "weights": [[round(float(v), 6) for v in row] for row in self.weights],
+            "bias": [round(float(v), 6) for v in self.bias],
+        }
+        artifact["version"] = hashlib.sha256(json.dumps(artifact, sort_keys=True).encode()).hexdigest()[:12]
+        return artifact
+
+    def save(self, path: str):
+        artifact = self.to_artifact()
+        self.version = artifact["version"]
+        with open(path, "w") as f:
+            json.dump(artifact, f, separators=(",", ":"))
+
+    def vectorize(self, queries: List[str]) -> np.ndarray:
+        """L2-normalized TF-IDF rows, one per query"""
+        rows, columns = [], []
+        for row, query in enumerate(queries):
+            for token in tokenize(query):
+                column = self.vocabulary.get(token)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+
+        features = np.zeros((len(queries), len(self.vocabulary)), dtype=np.float32)
+        np.add.at(features, (rows, columns), 1.0)
+        features *= self.idf
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        np.divide(features, norms, out=features, where=norms > 0)
+        return features
+
+    def predict_proba(self, queries: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (probabilities per agent, whether the query had any known term) for each query"""
+        features = self.vectorize(queries)
+        logits = features @ self.weights + self.bias
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        return probabilities, features.any(axis=1)
+
+    def informative(self, query: str) -> bool:
+        """Whether the query has a known word that isn't a stop word"""
+        return any(word in self.vocabulary and word not in STOP_WORDS for word in TOKEN_PATTERN.findall(query.lower()))
+
+    def classify(self, queries: List[str], min_confidence: float = 0.0) -> List[Optional[Tuple[str, float, Dict[str, float]]]]:
+        """
+        (agent, confidence, confidence per agent) for each query, or None for
+        a query without an informative known word or whose best confidence is
+        below min_confidence
+        """
+        probabilities, _ = self.predict_proba(queries)
+        best = probabilities.argmax(axis=1)
+        results = []
+        for row, label in enumerate(best):
+            confidence = float(probabilities[row, label])
+            if confidence < min_confidence or not self.informative(queries[row]):
+                results.append(None)
+                continue
+            results.append((self.labels[label], confidence, dict(zip(self.labels, probabilities[row].tolist()))))
+        return results
+
+    @classmethod
+    def train(cls, queries: List[str], labels: List[str], epochs: int = 400,
+              learning_rate: float = 2.0, l2: float = 1e-3, min_df: int = 1) -> "IntentClassifier":
+        """Fit TF-IDF statistics and a softmax regression with full-batch gradient descent"""
+        label_names = sorted(set(labels))
+        documents = [set(tokenize(query)) for query in queries]
+        document_frequency: Dict[str, int] = {}
+        for terms in documents:
+            for term in terms:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        vocabulary = sorted(term for term, count in document_frequency.items() if count >= min_df)
+        idf = [np.log((1 + len(queries)) / (1 + document_frequency[term])) + 1 for term in vocabulary]
+
+        model = cls(label_names, vocabulary, idf, np.zeros((len(vocabulary), len(label_names))), np.zeros(len(label_names)))
+        features = model.vectorize(queries)
+        targets = np.zeros((len(queries), len(label_names)), dtype=np.float32)
+        targets[np.arange(len(queries)), [label_names.index(label) for label in labels]] = 1.0
+
+        for _ in range(epochs):
+            logits = features @ model.weights + model.bias
+            logits -= logits.max(axis=1, keepdims=True)
+            probabilities = np.exp(logits)
+            probabilities /= probabilities.sum(axis=1, keepdims=True)
+            error = (probabilities - targets) / len(queries)
+            model.weights -= learning_rate * (features.T @ error + l2 * model.weights)
+            model.bias -= learning_rate * error.sum(axis=0)
+        return model
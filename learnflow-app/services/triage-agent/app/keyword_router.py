@@ -0,0 +1,104 @@
+import hashlib
+import json
+from collections import deque
+from typing import Dict, List, Tuple
+
+
+class PhraseAutomaton:
+    """
+    Aho-Corasick automaton over a fixed set of phrases. One pass over the text
+    finds every phrase occurring in it (as a substring), so matching cost
+    depends on the length of the text, not on how many phrases there are.
+    """
+
+    def __init__(self, phrases: List[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.outputs: List[Tuple[int, ...]] = [()]
+
+        for index, phrase in enumerate(phrases):
+            state = 0
+            for char in phrase:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append(())
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.outputs[state] += (index,)
+
+        # Breadth-first, so a state's failure link (its longest proper suffix
+        # that is also a phrase prefix) is known before its children need it
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.outputs[child] += self.outputs[self.fail[child]]
+
+    def find(self, text: str) -> set:
+        """Indices of the phrases that occur in text"""
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return found
+
+
+class KeywordRouter:
+    """
+    Routing table (phrases and weights per agent) compiled into a
+    PhraseAutomaton. Each agent scores the summed weight of its distinct
+    phrases found in the query, and confidences are the scores normalized to
+    sum to 1. Ties go to the agent listed first in the table; a query matching
+    nothing goes to the default agent with confidence 0.
+    """
+
+    def __init__(self, table: dict):
+        self.version = hashlib.sha256(json.dumps(table, sort_keys=True).encode()).hexdigest()[:12]
+        self.default_agent = table["default_agent"]
+        self.default_message = table.get("default_message", f"Routing to {self.default_agent}")
+        self.agents = [entry["agent"] for entry in table["agents"]]
+        self.messages = {entry["agent"]: entry.get("message", f"Routing to {entry['agent']}") for entry in table["agents"]}
+
+        phrases, self.phrase_agents, self.phrase_weights = [], [], []
+        for position, entry in enumerate(table["agents"]):
+            for phrase, weight in entry["phrases"].items():
+                phrases.append(phrase.lower())
+                self.phrase_agents.append(position)
+                self.phrase_weights.append(float(weight))
+        self.automaton = PhraseAutomaton(phrases)
+
+    @classmethod
+    def from_file(cls, path: str) -> "KeywordRouter":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def scores(self, query: str) -> List[float]:
+        scores = [0.0] * len(self.agents)
+        for index in self.automaton.find(query.lower()):
+            scores[self.phrase_agents[index]] += self.phrase_weights[index]
+        return scores
+
+    def route(self, query: str) -> Tuple[str, float, Dict[str, float]]:
+        """Return (agent, confidence, confidence per agent) for a query"""
+        scores = self.scores(query)
+        total = sum(scores)
+        if total <= 0:
+            return self.default_agent, 0.0, dict.fromkeys(self.agents, 0.0)
+
+        confidences = {agent: score / total for agent, score in zip(self.agents, scores)}
+        best = max(range(len(scores)), key=scores.__getitem__)
+        return self.agents[best], confidences[self.agents[best]], confidences
+
+    def message(self, agent: str, confidence: float) -> str:
+        return self.messages.get(agent, f"Routing to {agent}") if confidence else self.default_message
@@ -1,11 +1,53 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
+from typing import List
 import os
+import sys
 import json
+import uuid
 import httpx
 from app.config import settings
+from app.fast_json import FastJSONRoute
+from app.intent_classifier import IntentClassifier
+from app.keyword_router import KeywordRouter
+from app.routing_cache import RoutingCache, normalize_query
+from app.session_memory import SessionMemory
+
+# Shared modules live next to the services, in services/shared
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from shared.deadlines import header_budget  # noqa: E402
+from shared.dispatch import DaprBroker, DispatchError, DispatchTimeout, HTTPDispatcher, PubSubDispatcher, local_broker  # noqa: E402
 
 app = FastAPI(title=settings.APP_NAME)
+app.router.route_class = FastJSONRoute
+
+def load_intent_classifier():
+    if settings.INTENT_MODEL_PATH and os.path.exists(settings.INTENT_MODEL_PATH):
+        return IntentClassifier.from_file(settings.INTENT_MODEL_PATH)
+    return None
+
+keyword_router = KeywordRouter.from_file(settings.ROUTING_TABLE_PATH)
+intent_classifier = load_intent_classifier()
+routing_cache = RoutingCache(capacity=settings.ROUTING_CACHE_SIZE)
+session_memory = SessionMemory(ttl_seconds=settings.SESSION_TTL_SECONDS, max_users=settings.SESSION_MAX_USERS,
+                               follow_up_max_words=settings.FOLLOW_UP_MAX_WORDS)
+
+def create_dispatcher():
+    if settings.ALL_IN_ONE:
+        dispatcher = PubSubDispatcher(local_broker, settings.DISPATCH_REPLY_TOPIC, settings.DISPATCH_TIMEOUT_SECONDS)
+        local_broker.subscribe(dispatcher.reply_topic, dispatcher.handle_reply)
+        return dispatcher
+    if settings.DISPATCH_MODE == "pubsub":
+        broker = DaprBroker(settings.DAPR_HTTP_PORT, settings.PUBSUB_NAME)
+        return PubSubDispatcher(broker, settings.DISPATCH_REPLY_TOPIC, settings.DISPATCH_TIMEOUT_SECONDS)
+    return HTTPDispatcher(settings.AGENT_URLS, settings.DISPATCH_TIMEOUT_SECONDS)
+
+dispatcher = create_dispatcher()
+
+def routing_version() -> str:
+    """Identifies the routing table and intent model currently loaded"""
+    model_version = intent_classifier.version if intent_classifier is not None else "none"
+    return f"{model_version}:{keyword_router.version}"
 
 class QueryRequest(BaseModel):
     query: str
@@ -14,40 +56,183 @@ class QueryRequest(BaseModel):
 class RoutingResponse(BaseModel):
     agent: str
     message: str
+    confidence: float = 0.0
+    # Confidence per agent, summing to 1 when the query could be scored
+    confidences: dict = {}
     params: dict = {}
 
-@app.post("/query")
+class DispatchRequest(QueryRequest):
+    # Extra fields for the target agent's request (e.g. code, error_message, level)
+    payload: dict = {}
+
+class DispatchResponse(BaseModel):
+    routing: RoutingResponse
+    correlation_id: str
+    result: dict
+
+class QueryBatchRequest(BaseModel):
+    queries: List[QueryRequest]
+
+class RoutingBatchResponse(BaseModel):
+    results: List[RoutingResponse]
+
+def is_follow_up_to_session(request: QueryRequest, decision: tuple) -> bool:
+    """
+    Whether a query leans on the user's earlier question: short, with a
+    follow-up cue and no routing phrase, and either nothing but cue and filler
+    words ("why?") or not confidently placed by the classifier
+    """
+    if not request.user_id or not session_memory.is_follow_up(request.query):
+        return False
+    if any(keyword_router.scores(normalize_query(request.query))):
+        return False
+    return session_memory.is_bare_follow_up(request.query) or decision[1] < settings.FOLLOW_UP_MAX_CONFIDENCE
+
+def route_queries(requests: List[QueryRequest]) -> List[RoutingResponse]:
+    """
+    Route queries with the intent classifier, scoring the whole batch in one
+    matrix multiply. Queries with no term the classifier knows (or every query,
+    without a model) fall back to keyword routing. Decisions are cached per
+    normalized query, so only cache misses are classified.
+
+    Short follow-ups ("why?", "show me another example") go to the user's
+    previous agent instead, see is_follow_up_to_session.
+    """
+    version = routing_version()
+    keys = [(normalize_query(request.query), version) for request in requests]
+    decisions = [routing_cache.get(key) for key in keys]
+
+    misses = [index for index, decision in enumerate(decisions) if decision is None]
+    if misses:
+        texts = [keys[index][0] for index in misses]
+        predictions = (intent_classifier.classify(texts, min_confidence=settings.INTENT_MIN_CONFIDENCE)
+                       if intent_classifier is not None else [None] * len(texts))
+        for index, text, prediction in zip(misses, texts, predictions):
+            decisions[index] = prediction or keyword_router.route(text)
+            routing_cache.put(keys[index], decisions[index])
+
+    # In order, so a follow-up sees the decisions for the same user's earlier queries in the batch
+    responses = []
+    for index, request in enumerate(requests):
+        params = {"original_query": request.query, "user_id": request.user_id}
+        session = session_memory.follow_up(request.user_id, request.query) if is_follow_up_to_session(request, decisions[index]) else None
+        if session is not None:
+            decisions[index] = session["decision"]
+            params.update(follow_up=True, previous_query=session["topic"], entities=list(session["entities"]))
+        session_memory.record(request.user_id, decisions[index], request.query, follow_up=session is not None)
+
+        agent, confidence, confidences = decisions[index]
+        responses.append(RoutingResponse(
+            agent=agent,
+            message=f"{keyword_router.message(agent, confidence)}: {request.query}",
+            confidence=confidence,
+            confidences=confidences,
+            params=params
+        ))
+    return responses
+
+@app.post("/query", response_model=RoutingResponse)
 async def route_query(request: QueryRequest):
     """
     Analyze query intent and route to appropriate agent
     """
-    query_lower = request.query.lower()
-
-    # Keyword-based routing logic
-    if any(keyword in query_lower for keyword in ["explain", "what is", "how does", "concept", "definition", "meaning"]):
-        agent = "concepts-agent"
-        message = f"Routing to concepts-agent to explain: {request.query}"
-    elif any(keyword in query_lower for keyword in ["error", "bug", "fix", "debug", "problem", "not working"]):
-        agent = "debug-agent"
-        message = f"Routing to debug-agent to help with: {request.query}"
-    elif any(keyword in query_lower for keyword in ["review", "check", "style", "quality", "improve"]):
-        agent = "code-review-agent"
-        message = f"Routing to code-review-agent to review: {request.query}"
-    elif any(keyword in query_lower for keyword in ["quiz", "exercise", "challenge", "practice", "test"]):
-        agent = "exercise-agent"
-        message = f"Routing to exercise-agent for: {request.query}"
-    else:
-        # Default to concepts-agent for general questions
-        agent = "concepts-agent"
-        message = f"Routing to concepts-agent for general question: {request.query}"
-
-    # In a real implementation, this would publish to Kafka
-    # For now, we'll return the routing decision
-    return RoutingResponse(
-        agent=agent,
-        message=message,
-        params={"original_query": request.query, "user_id": request.user_id}
-    )
+    return route_queries([request])[0]
+
+@app.post("/query/batch", response_model=RoutingBatchResponse)
+async def route_query_batch(request: QueryBatchRequest):
+    """
+    Route many queries in one call
+    """
+    if len(request.queries) > settings.QUERY_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {settings.QUERY_BATCH_MAX} queries per batch")
+    return RoutingBatchResponse(results=route_queries(request.queries))
+
+# Endpoint and request body for each agent a query can be dispatched to, built
+# from the question's subject (the earlier question, for follow-ups) and the
+# session context
+AGENT_REQUESTS = {
+    "concepts-agent": ("/explain", lambda subject, r, context: {"topic": subject, "user_context": context, **r.payload}),
+    "debug-agent": ("/debug", lambda subject, r, context: {"code": "", "error_message": subject, "user_id": r.user_id, "context": context, **r.payload}),
+    "code-review-agent": ("/review", lambda subject, r, context: {"code": subject, "user_id": r.user_id, "context": context, **r.payload}),
+    "exercise-agent": ("/generate", lambda subject, r, context: {"module": "basics", "topic": subject, "user_id": r.user_id, "context": context, **r.payload}),
+}
+
+def session_context(routing: RoutingResponse) -> dict:
+    if not routing.params.get("follow_up"):
+        return {}
+    return {
+        "follow_up": routing.params["original_query"],
+        "previous_query": routing.params["previous_query"],
+        "entities": routing.params["entities"],
+    }
+
+@app.post("/query/dispatch", response_model=DispatchResponse)
+async def dispatch_query(request: DispatchRequest, http_request: Request):
+    """
+    Route a query and forward it to the chosen agent, returning the agent's
+    answer with the routing decision. The caller's X-Request-Timeout-Ms, if
+    any, bounds the dispatch and is passed on to the agent.
+    """
+    routing = route_queries([request])[0]
+    if routing.agent not in AGENT_REQUESTS:
+        raise HTTPException(status_code=502, detail=f"No dispatch target for {routing.agent}")
+
+    path, build_request = AGENT_REQUESTS[routing.agent]
+    correlation_id = str(uuid.uuid4())
+    try:
+        context = session_context(routing)
+        subject = context.get("previous_query", request.query)
+        result = await dispatcher.dispatch(routing.agent, path, build_request(subject, request, context), correlation_id,
+                                           timeout=header_budget(http_request.headers))
+    except DispatchTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except DispatchError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return DispatchResponse(routing=routing, correlation_id=correlation_id, result=result)
+
+@app.get("/dapr/subscribe")
+async def dapr_subscribe():
+    """Dapr subscriptions: this instance's dispatch reply topic, in pub/sub mode"""
+    if settings.ALL_IN_ONE or not isinstance(dispatcher, PubSubDispatcher):
+        return []
+    return [{"pubsubname": settings.PUBSUB_NAME, "topic": dispatcher.reply_topic, "route": "/dispatch/replies"}]
+
+@app.post("/dispatch/replies")
+async def dispatch_reply(event: dict):
+    """Agent replies delivered by Dapr, wrapped in a CloudEvent"""
+    if isinstance(dispatcher, PubSubDispatcher):
+        await dispatcher.handle_reply(event.get("data", event))
+    return {"status": "SUCCESS"}
+
+@app.on_event("shutdown")
+async def close_dispatcher():
+    await dispatcher.close()
+
+@app.post("/routing/reload")
+async def reload_routing():
+    """
+    Reload the routing table and intent model from disk and drop cached decisions
+    """
+    global keyword_router, intent_classifier
+    try:
+        new_router = KeywordRouter.from_file(settings.ROUTING_TABLE_PATH)
+        new_classifier = load_intent_classifier()
+    except (OSError, ValueError, KeyError) as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed, keeping current routing: {e}")
+
+    keyword_router, intent_classifier = new_router, new_classifier
+    routing_cache.clear()
+    return {"version": routing_version()}
+
+@app.get("/metrics")
+async def metrics():
+    """Routing cache hit rate, the loaded routing version, session memory and dispatch counters"""
+    return {
+        "routing_version": routing_version(),
+        "routing_cache": routing_cache.snapshot(),
+        "sessions": session_memory.snapshot(),
+        "dispatch": dispatcher.snapshot(),
+    }
 
 @app.get("/health")
 async def health():
@@ -0,0 +1,52 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase and collapse whitespace, so trivially different queries share a decision"""
+    return " ".join(query.lower().split())
+
+
+class RoutingCache:
+    """
+    LRU cache of routing decisions keyed by (normalized query, routing
+    version). The version changes whenever the routing table or intent model
+    is reloaded, so stale decisions are never served; the cache is also
+    cleared on reload to free their space.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self.entries: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key: Tuple[str, str]) -> Optional[tuple]:
+        decision = self.entries.get(key)
+        if decision is None:
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return decision
+
+    def put(self, key: Tuple[str, str], decision: tuple):
+        if self.capacity <= 0:
+            return
+        self.entries[key] = decision
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.stats["invalidations"] += 1
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "entries": len(self.entries),
+            "capacity": self.capacity,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            **self.stats,
+        }
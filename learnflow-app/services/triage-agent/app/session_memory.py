@@ -0,0 +1,101 @@
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+WORD_PATTERN = re.compile(r"[a-z']+")
+# Pronouns like "it" or "this" are left out: they start plenty of fresh questions too
+FOLLOW_UP_WORDS = {"why", "another", "more", "again", "example", "examples", "still", "same",
+                   "continue", "else", "also", "instead"}
+FOLLOW_UP_PHRASES = ("how come", "what about", "go on", "what if")
+# Words that can surround a cue without adding a subject of their own
+FILLER_WORDS = {"a", "an", "the", "me", "show", "give", "please", "one", "can", "could", "you", "i", "do",
+                "does", "is", "what", "how", "come", "about", "go", "on", "if", "and", "so", "but", "ok",
+                "okay", "just", "really", "some", "thanks"}
+
+# Error names, `backticked code` and name() calls
+ENTITY_PATTERN = re.compile(r"\b([A-Z][A-Za-z]*(?:Error|Exception))\b|`([^`]+)`|\b([A-Za-z_][A-Za-z0-9_]*)\(\)")
+
+
+def extract_entities(query: str) -> List[str]:
+    return [next(group for group in match.groups() if group) for match in ENTITY_PATTERN.finditer(query)]
+
+
+class SessionMemory:
+    """
+    Per-user routing context: the last agent, the last question that wasn't a
+    follow-up and recently mentioned entities. Sessions expire `ttl_seconds`
+    after their last update and at most `max_users` are kept, the least
+    recently active being dropped first.
+    """
+
+    def __init__(self, ttl_seconds: float = 1800.0, max_users: int = 10000,
+                 max_entities: int = 5, follow_up_max_words: int = 6):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self.max_entities = max_entities
+        self.follow_up_max_words = follow_up_max_words
+        self.sessions: "OrderedDict[str, dict]" = OrderedDict()
+        self.stats = {"follow_ups": 0, "expired": 0, "evicted": 0}
+
+    def is_follow_up(self, query: str) -> bool:
+        """Short questions leaning on earlier context, like "why?" or "show me another example\""""
+        text = query.lower()
+        words = WORD_PATTERN.findall(text)
+        if not words or len(words) > self.follow_up_max_words:
+            return False
+        return bool(FOLLOW_UP_WORDS.intersection(words)) or any(phrase in text for phrase in FOLLOW_UP_PHRASES)
+
+    def is_bare_follow_up(self, query: str) -> bool:
+        """A follow-up made only of cue and filler words, with no subject of its own"""
+        words = WORD_PATTERN.findall(query.lower())
+        return self.is_follow_up(query) and all(w in FOLLOW_UP_WORDS or w in FILLER_WORDS for w in words)
+
+    def get(self, user_id: str) -> Optional[dict]:
+        session = self.sessions.get(user_id)
+        if session is None:
+            return None
+        if time.monotonic() - session["updated_at"] > self.ttl_seconds:
+            del self.sessions[user_id]
+            self.stats["expired"] += 1
+            return None
+        return session
+
+    def follow_up(self, user_id: str, query: str) -> Optional[dict]:
+        """The user's session, if query is a follow-up to it"""
+        if not user_id or not self.is_follow_up(query):
+            return None
+        session = self.get(user_id)
+        if session is not None:
+            self.stats["follow_ups"] += 1
+        return session
+
+    def record(self, user_id: str, decision: tuple, query: str, follow_up: bool):
+        """Remember the routing decision for the user's next question"""
+        if not user_id or self.max_users <= 0:
+            return
+        session = self.get(user_id) or {"topic": query, "entities": []}
+        if not follow_up:
+            session["topic"] = query
+        entities = [e for e in session["entities"] if e not in extract_entities(query)] + extract_entities(query)
+        session.update(decision=decision, entities=entities[-self.max_entities:], updated_at=time.monotonic())
+
+        self.sessions[user_id] = session
+        self.sessions.move_to_end(user_id)
+        self._evict()
+
+    def _evict(self):
+        # Sessions are ordered by last update, so expired ones are at the front
+        now = time.monotonic()
+        while self.sessions:
+            user_id, session = next(iter(self.sessions.items()))
+            if now - session["updated_at"] > self.ttl_seconds:
+                self.stats["expired"] += 1
+            elif len(self.sessions) > self.max_users:
+                self.stats["evicted"] += 1
+            else:
+                break
+            del self.sessions[user_id]
+
+    def snapshot(self) -> dict:
+        return {"sessions": len(self.sessions), "max_users": self.max_users, **self.stats}
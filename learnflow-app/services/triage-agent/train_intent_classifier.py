@@ -0,0 +1,48 @@
+"""
+Train triage's intent classifier from labelled queries
+
+Reads training/intent_queries.jsonl ({"query": ..., "agent": ...} per line),
+reports accuracy on a held-out fifth of the data, then trains on all of it
+and writes the model artifact loaded by the triage agent at startup.
+
+Run from services/triage-agent: python train_intent_classifier.py
+"""
+
+import argparse
+import json
+import os
+
+from app.intent_classifier import IntentClassifier
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_examples(path):
+    with open(path) as f:
+        examples = [json.loads(line) for line in f if line.strip()]
+    return [e["query"] for e in examples], [e["agent"] for e in examples]
+
+
+def accuracy(model, queries, labels):
+    predictions = model.classify(queries)
+    return sum(1 for p, label in zip(predictions, labels) if p and p[0] == label) / len(labels)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data", default=os.path.join(HERE, "training", "intent_queries.jsonl"))
+    parser.add_argument("--out", default=os.path.join(HERE, "app", "intent_model.json"))
+    parser.add_argument("--epochs", type=int, default=400)
+    args = parser.parse_args()
+
+    queries, labels = load_examples(args.data)
+    held_out = set(range(0, len(queries), 5))
+    train = [i for i in range(len(queries)) if i not in held_out]
+    model = IntentClassifier.train([queries[i] for i in train], [labels[i] for i in train], epochs=args.epochs)
+    print(f"held-out accuracy: {accuracy(model, [queries[i] for i in held_out], [labels[i] for i in held_out]):.1%} "
+          f"({len(held_out)} queries)")
+
+    model = IntentClassifier.train(queries, labels, epochs=args.epochs)
+    print(f"training accuracy: {accuracy(model, queries, labels):.1%} ({len(queries)} queries)")
+    model.save(args.out)
+    print(f"wrote {args.out} (version {model.version}, {len(model.vocabulary)} terms)")
@@ -1,12 +1,17 @@
 from fastapi import FastAPI, HTTPException, Depends
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
-import requests
 import logging
 import asyncio
+import os
+import sys
 import uuid
 from datetime import datetime
 
+# Shared modules live next to the services, in services/shared
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from shared.deadlines import DeadlineExceeded, dapr_request, install_deadlines  # noqa: E402
+
 app = FastAPI(title="tutor-agent", description="Specialized agent for providing detailed coding explanations")
 
 # Dapr configuration
@@ -17,6 +22,8 @@ DAPR_PUBSUB_NAME = "pubsub"
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+install_deadlines(app)
+
 class CodingTaskRequest(BaseModel):
     task_id: Optional[str] = None
     user_id: str
@@ -81,7 +88,7 @@ async def process_coding_task(request: CodingTaskRequest):
             "value": response.dict()
         }
 
-        state_response = requests.post(state_url, json=[state_item])
+        state_response = await dapr_request("POST", state_url, json=[state_item])
         if state_response.status_code != 200:
             logger.warning(f"Failed to save task result to state store: {state_response.status_code}")
 
@@ -95,7 +102,7 @@ async def process_coding_task(request: CodingTaskRequest):
         }
 
         publish_url = f"{DAPR_HTTP_ENDPOINT}/v1.0/publish/{DAPR_PUBSUB_NAME}/coding-task-completed"
-        publish_response = requests.post(publish_url, json=event_data)
+        publish_response = await dapr_request("POST", publish_url, json=event_data)
 
         if publish_response.status_code != 200:
             logger.warning(f"Failed to publish coding-task-completed event: {publish_response.status_code}")
@@ -104,6 +111,8 @@ async def process_coding_task(request: CodingTaskRequest):
 
         return response
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error processing coding task: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing coding task: {str(e)}")
@@ -128,7 +137,7 @@ async def update_progress(request: ProgressUpdateRequest):
             }
         }
 
-        state_response = requests.post(state_url, json=[state_item])
+        state_response = await dapr_request("POST", state_url, json=[state_item])
         if state_response.status_code != 200:
             raise HTTPException(status_code=state_response.status_code, detail="Failed to update progress in state store")
 
@@ -141,7 +150,7 @@ async def update_progress(request: ProgressUpdateRequest):
         }
 
         publish_url = f"{DAPR_HTTP_ENDPOINT}/v1.0/publish/{DAPR_PUBSUB_NAME}/progress-updated"
-        publish_response = requests.post(publish_url, json=event_data)
+        publish_response = await dapr_request("POST", publish_url, json=event_data)
 
         if publish_response.status_code != 200:
             logger.warning(f"Failed to publish progress-updated event: {publish_response.status_code}")
@@ -150,6 +159,8 @@ async def update_progress(request: ProgressUpdateRequest):
 
         return {"status": "success", "user_id": request.user_id, "lesson_id": request.lesson_id}
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error updating progress: {e}")
         raise HTTPException(status_code=500, detail=f"Error updating progress: {str(e)}")
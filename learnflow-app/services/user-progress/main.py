@@ -1,10 +1,15 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-import requests
 import logging
 import json
+import os
+import sys
 from typing import Optional
 
+# Shared modules live next to the services, in services/shared
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from shared.deadlines import DeadlineExceeded, dapr_request, install_deadlines  # noqa: E402
+
 app = FastAPI(title="user-progress", description="FastAPI service with Dapr integration")
 
 # Dapr configuration
@@ -15,6 +20,8 @@ DAPR_PUBSUB_NAME = "pubsub"
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+install_deadlines(app)
+
 
 class Message(BaseModel):
     topic: str
@@ -71,7 +78,7 @@ async def update_progress(request: ProgressUpdateRequest):
             "key": f"progress_{request.user_id}_{request.lesson_id}",
             "value": progress_record
         }
-        state_response = requests.post(state_url, json=[state_item])
+        state_response = await dapr_request("POST", state_url, json=[state_item])
 
         if state_response.status_code != 200:
             raise HTTPException(status_code=state_response.status_code, detail="Failed to save progress to state store")
@@ -86,7 +93,7 @@ async def update_progress(request: ProgressUpdateRequest):
         }
 
         publish_url = f"{DAPR_HTTP_ENDPOINT}/v1.0/publish/{DAPR_PUBSUB_NAME}/progress-updated"
-        publish_response = requests.post(publish_url, json=event_data)
+        publish_response = await dapr_request("POST", publish_url, json=event_data)
 
         if publish_response.status_code != 200:
             logger.warning(f"Failed to publish progress-updated event: {publish_response.status_code}")
@@ -102,6 +109,8 @@ async def update_progress(request: ProgressUpdateRequest):
             "last_updated": timestamp,
             "success": True
         }
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error updating progress: {e}")
         raise HTTPException(status_code=500, detail=f"Error updating progress: {str(e)}")
@@ -115,7 +124,7 @@ async def get_status(user_id: str, lesson_id: Optional[str] = None):
             # Get specific lesson progress
             key = f"progress_{user_id}_{lesson_id}"
             state_url = f"{DAPR_HTTP_ENDPOINT}/v1.0/state/{DAPR_STATE_STORE}/{key}"
-            state_response = requests.get(state_url)
+            state_response = await dapr_request("GET", state_url)
 
             if state_response.status_code == 200:
                 progress_data = state_response.json()
@@ -142,6 +151,8 @@ async def get_status(user_id: str, lesson_id: Optional[str] = None):
                 "all_lessons_progress": [],
                 "message": "In a full implementation, this would return all progress records for the user"
             }
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error fetching progress status: {e}")
         raise HTTPException(status_code=500, detail=f"Error fetching progress status: {str(e)}")
@@ -176,7 +187,7 @@ async def handle_lesson_generated(data: dict):
             "key": f"progress_{user_id}_{lesson_id}",
             "value": initial_progress
         }
-        state_response = requests.post(state_url, json=[state_item])
+        state_response = await dapr_request("POST", state_url, json=[state_item])
 
         if state_response.status_code == 200:
             logger.info(f"Initialized progress tracking for lesson {lesson_id} for user {user_id}")
@@ -201,13 +212,15 @@ async def save_state(key: str, value: dict):
             "key": key,
             "value": value
         }
-        response = requests.post(url, json=[state_item])
+        response = await dapr_request("POST", url, json=[state_item])
         
         if response.status_code == 200:
             logger.info(f"State saved: {key}")
             return {"success": True, "key": key}
         else:
             raise HTTPException(status_code=response.status_code, detail="Failed to save state")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error saving state: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -218,7 +231,7 @@ async def get_state(key: str):
     """Get state using Dapr state store"""
     try:
         url = f"{DAPR_HTTP_ENDPOINT}/v1.0/state/{DAPR_STATE_STORE}/{key}"
-        response = requests.get(url)
+        response = await dapr_request("GET", url)
         
         if response.status_code == 200:
             value = response.json()
@@ -228,6 +241,8 @@ async def get_state(key: str):
             return {"key": key, "value": None}
         else:
             raise HTTPException(status_code=response.status_code, detail="Failed to get state")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error getting state: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -239,13 +254,15 @@ async def publish_message(message: Message):
     """Publish a message using Dapr pub/sub"""
     try:
         url = f"{DAPR_HTTP_ENDPOINT}/v1.0/publish/{DAPR_PUBSUB_NAME}/{message.topic}"
-        response = requests.post(url, json=message.data)
+        response = await dapr_request("POST", url, json=message.data)
         
         if response.status_code == 200:
             logger.info(f"Message published to topic: {message.topic}")
             return {"success": True, "topic": message.topic}
         else:
             raise HTTPException(status_code=response.status_code, detail="Failed to publish message")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error publishing message: {e}")
         raise HTTPException(status_code=500, detail=str(e))